@@ -1,8 +1,36 @@
+import asyncio
+import functools
+from langchain_core.messages import ToolMessage, message_chunk_to_message
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode, tools_condition
-from end_to_end.advanced_rag_tool_fusion_langgraph import advanced_rag_tool_fusion
+from end_to_end.advanced_rag_tool_fusion_langgraph import STREAM_PREPROCESSING, advanced_rag_tool_fusion
+from end_to_end.structural_tool_cache import StructuralToolCache
 
-toolshed_dict = {tool.name: {"tool_object":tool} for tool in tool_list}
+# Stream the agent's response and start executing each tool call as soon as its arguments are complete.
+# Requires a provider that streams stable partial tool-call JSON, and the graph to be run with `ainvoke`/`astream`.
+# The same holds when STREAM_PREPROCESSING is set in the toolshed graph, its retrieval node is then awaited.
+STREAM_AGENT_RESPONSES = False
+
+@functools.cache
+def get_toolshed() -> Dict[str, Any]:
+    """Maps tool names to tool objects, built on first use."""
+    return {tool.name: tool for tool in tool_list}
+
+@functools.cache
+def get_case_folded_toolshed() -> Dict[str, Any]:
+    return {tool.name.lower(): tool for tool in tool_list}
+
+def resolve_tool(tool_name: str):
+    """Looks up a retrieved tool name, falling back to a case-insensitive match."""
+    tool = get_toolshed().get(tool_name)
+    if tool is None:
+        tool = get_case_folded_toolshed()[tool_name.lower()]
+    return tool
+
+@functools.lru_cache(maxsize=128)
+def get_llm_with_tools(tool_names: frozenset):
+    """Binds the tools to the LLM, reusing the bound LLM when the same tool set is retrieved again."""
+    return llm.bind_tools([get_toolshed()[tool_name] for tool_name in sorted(tool_names)])
 
 class AdvancedRAGToolFusionAgent(TypedDict):
     user_query: str
@@ -10,28 +38,84 @@ class AdvancedRAGToolFusionAgent(TypedDict):
     retrieved_tool_name_from_toolshed: List[str]
     messages: Annotated[list, add_messages]
 
+structural_tool_cache = StructuralToolCache(max_size=1000)
+
+@structural_tool_cache.wrap
+def run_advanced_rag_tool_fusion(user_query: str, conversation_history: List[str]) -> List[str]:
+    result=advanced_rag_tool_fusion.invoke({"user_query": user_query, "conversation_history": conversation_history})
+    return result["final_top_k_tools"]
+
+@structural_tool_cache.awrap
+async def arun_advanced_rag_tool_fusion(user_query: str, conversation_history: List[str]) -> List[str]:
+    result = await advanced_rag_tool_fusion.ainvoke({"user_query": user_query, "conversation_history": conversation_history})
+    return result["final_top_k_tools"]
+
 def retrieve_tools_from_toolshed(state: AdvancedRAGToolFusionAgent):
-    result=advanced_rag_tool_fusion.invoke({"user_query": state["user_query"], "conversation_history": state.get("conversation_history", [])})
-    return {"retrieved_tool_name_from_toolshed": result["final_top_k_tools"]}
+    # queries that only differ by named entities or numbers reuse the previously retrieved tools
+    tool_names = run_advanced_rag_tool_fusion(state["user_query"], state.get("conversation_history", []))
+    return {"retrieved_tool_name_from_toolshed": tool_names}
+
+async def aretrieve_tools_from_toolshed(state: AdvancedRAGToolFusionAgent):
+    # the streaming preprocessing node is async-only, so the toolshed graph has to be awaited
+    tool_names = await arun_advanced_rag_tool_fusion(state["user_query"], state.get("conversation_history", []))
+    return {"retrieved_tool_name_from_toolshed": tool_names}
 
 def agent_node(state: AdvancedRAGToolFusionAgent):
-    selected_tools = [toolshed_dict[tool_name]['tool_object'] for tool_name in state["retrieved_tool_name_from_toolshed"]]
+    selected_tools = [resolve_tool(tool_name) for tool_name in state["retrieved_tool_name_from_toolshed"]]
     # Bind the selected tools to the LLM for the current interaction.
-    llm_with_tools = llm.bind_tools(selected_tools)
+    llm_with_tools = get_llm_with_tools(frozenset(tool.name for tool in selected_tools))
     # Invoke the LLM with the current messages and return the updated message list.
     return {"messages": [llm_with_tools.invoke(state["messages"])]}
 
+async def execute_tool_call(tool_call: Dict[str, Any]) -> ToolMessage:
+    tool = get_toolshed().get(tool_call["name"])
+    if tool is None:
+        return ToolMessage(content=f"Error: {tool_call['name']} is not a valid tool.", tool_call_id=tool_call["id"], status="error")
+    try:
+        return await tool.ainvoke(tool_call)
+    except Exception as e:
+        return ToolMessage(content=f"Error: {repr(e)}", tool_call_id=tool_call["id"], status="error")
+
+async def streaming_agent_node(state: AdvancedRAGToolFusionAgent):
+    selected_tools = [resolve_tool(tool_name) for tool_name in state["retrieved_tool_name_from_toolshed"]]
+    llm_with_tools = get_llm_with_tools(frozenset(tool.name for tool in selected_tools))
+
+    ai_message_chunk = None
+    tool_tasks = {}
+    async for chunk in llm_with_tools.astream(state["messages"]):
+        ai_message_chunk = chunk if ai_message_chunk is None else ai_message_chunk + chunk
+        # every tool call before the one still streaming has complete arguments, dispatch it right away
+        for tool_call in ai_message_chunk.tool_calls[:-1]:
+            if tool_call["id"] not in tool_tasks:
+                tool_tasks[tool_call["id"]] = asyncio.create_task(execute_tool_call(tool_call))
+    for tool_call in ai_message_chunk.tool_calls:
+        if tool_call["id"] not in tool_tasks:
+            tool_tasks[tool_call["id"]] = asyncio.create_task(execute_tool_call(tool_call))
+
+    tool_messages = await asyncio.gather(*tool_tasks.values())
+    return {"messages": [message_chunk_to_message(ai_message_chunk), *tool_messages]}
+
+def route_after_streaming_agent(state: AdvancedRAGToolFusionAgent):
+    # the streaming agent already executed the tools, loop back while it keeps calling them
+    return "agent" if isinstance(state["messages"][-1], ToolMessage) else END
+
 tool_node = ToolNode(tools=tool_list)
 
 builder = StateGraph(AdvancedRAGToolFusionAgent)
-builder.add_node("retrieve_tools_from_toolshed", retrieve_tools_from_toolshed)
-builder.add_node("agent", agent_node)
-builder.add_node("tools", tool_node)
-
-builder.add_conditional_edges("agent", tools_condition, path_map=["tools", END])
+if STREAM_PREPROCESSING:
+    builder.add_node("retrieve_tools_from_toolshed", aretrieve_tools_from_toolshed)
+else:
+    builder.add_node("retrieve_tools_from_toolshed", retrieve_tools_from_toolshed)
 builder.add_edge(START, "retrieve_tools_from_toolshed")
 builder.add_edge("retrieve_tools_from_toolshed", "agent")
 
-builder.add_edge("tools", "agent")
+if STREAM_AGENT_RESPONSES:
+    builder.add_node("agent", streaming_agent_node)
+    builder.add_conditional_edges("agent", route_after_streaming_agent, path_map=["agent", END])
+else:
+    builder.add_node("agent", agent_node)
+    builder.add_node("tools", tool_node)
+    builder.add_conditional_edges("agent", tools_condition, path_map=["tools", END])
+    builder.add_edge("tools", "agent")
 
 advanced_rag_tool_fusion_with_agent = builder.compile()
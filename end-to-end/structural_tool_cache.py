@@ -0,0 +1,83 @@
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+# Numeric entities (amounts, rates, years, durations) never change which tools are needed
+NUMBER_PATTERN = re.compile(r"[$€£]?\d[\d,]*(?:\.\d+)?(?:%|\s?(?:k|m|bn|million|billion)\b)?", re.IGNORECASE)
+# Named entities: quoted strings only. Capitalized words and acronyms are left unmasked, they often
+# name the financial concept itself (Sharpe, Treynor, NPV, ...) and so decide which tools are needed.
+# Single quotes must not touch a word, so apostrophes (the fund's, investor's) do not open a span.
+ENTITY_PATTERN = re.compile(r"\"[^\"]+\"|(?<!\w)'[^']+'(?!\w)")
+
+class StructuralToolCache:
+    """GenCache-style cache that reuses retrieved tools for queries sharing the same structure.
+
+    Queries are templatized by masking numbers and quoted entities. Two queries with the same template
+    reuse the cached tools, unless more than `max_entity_change` of their quoted entities differ
+    (by default a third of them, so a query about a single, different entity is retrieved again).
+    """
+    def __init__(self, max_size: int = 1000, max_entity_change: float = 0.34):
+        self.max_size = max_size
+        self.max_entity_change = max_entity_change
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[str, Tuple[List[str], List[str]]]" = OrderedDict()
+
+    def _templatize(self, text: str) -> Tuple[str, List[str]]:
+        entities = ENTITY_PATTERN.findall(text)
+        template = ENTITY_PATTERN.sub("<ENT>", text)
+        template = NUMBER_PATTERN.sub("<NUM>", template)
+        return " ".join(template.lower().split()), entities
+
+    def _get_key(self, user_query: str, conversation_history: List[str]) -> Tuple[str, List[str]]:
+        template, entities = self._templatize(user_query)
+        history_templates = [self._templatize(str(message))[0] for message in conversation_history]
+        key = hashlib.sha256(repr((template, history_templates)).encode("utf-8")).hexdigest()
+        return key, entities
+
+    def _entity_change(self, entities: List[str], cached_entities: List[str]) -> float:
+        if not entities:
+            return 0.0
+        changed = sum(1 for entity, cached_entity in zip(entities, cached_entities) if entity.lower() != cached_entity.lower())
+        return changed / len(entities)
+
+    def get(self, user_query: str, conversation_history: Optional[List[str]] = None) -> Optional[List[str]]:
+        key, entities = self._get_key(user_query, conversation_history or [])
+        cached = self._cache.get(key)
+        if cached is None or self._entity_change(entities, cached[1]) > self.max_entity_change:
+            self.misses += 1
+            return None
+        self._cache.move_to_end(key)
+        self.hits += 1
+        return cached[0]
+
+    def set(self, user_query: str, conversation_history: Optional[List[str]], tool_names: List[str]):
+        if not tool_names:
+            # don't cache failed reranks
+            return
+        key, entities = self._get_key(user_query, conversation_history or [])
+        self._cache[key] = (tool_names, entities)
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def wrap(self, retrieve: Callable[[str, List[str]], List[str]]) -> Callable[[str, List[str]], List[str]]:
+        """Wraps a `(user_query, conversation_history) -> tool names` function with the cache."""
+        def cached_retrieve(user_query: str, conversation_history: List[str]) -> List[str]:
+            tool_names = self.get(user_query, conversation_history)
+            if tool_names is None:
+                tool_names = retrieve(user_query, conversation_history)
+                self.set(user_query, conversation_history, tool_names)
+            return tool_names
+        return cached_retrieve
+
+    def awrap(self, aretrieve: Callable[[str, List[str]], Awaitable[List[str]]]) -> Callable[[str, List[str]], Awaitable[List[str]]]:
+        """Async counterpart of `wrap`."""
+        async def cached_aretrieve(user_query: str, conversation_history: List[str]) -> List[str]:
+            tool_names = self.get(user_query, conversation_history)
+            if tool_names is None:
+                tool_names = await aretrieve(user_query, conversation_history)
+                self.set(user_query, conversation_history, tool_names)
+            return tool_names
+        return cached_aretrieve
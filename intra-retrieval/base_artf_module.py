@@ -1,12 +1,25 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, List, Optional
 from abc import ABC, abstractmethod
-from langchain_openai import ChatOpenAI,OpenAIEmbeddings
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from pre_retrieval.response_cache import SemanticCache
+
+if TYPE_CHECKING:
+    # type hints only, langchain_openai is slow to import
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 
 class BaseARTFModules(ABC):
     def __init__(self, 
                  llm: Optional[ChatOpenAI] = None, 
-                 embedder: Optional[OpenAIEmbeddings] = None):
+                 embedder: Optional[OpenAIEmbeddings] = None,
+                 semantic_cache: Optional[SemanticCache] = None,
+                 cache_control: bool = False):
         self.llm = llm
         self.embedder = embedder
+        # Optional semantic cache consulted by the `semantic_cached` generate methods
+        self.semantic_cache = semantic_cache
+        # Mark the static system prompts with `cache_control` (Anthropic); OpenAI caches the identical prefix automatically
+        self.cache_control = cache_control
         if self.llm:
             self.structured_llm: ChatOpenAI = self._initialize_structured_llm()
         else:
@@ -16,6 +29,36 @@ class BaseARTFModules(ABC):
         """Provide a default behavior when LLM is not required."""
         return None 
 
+    def _get_cached_system_message(self, static_system_message: str) -> SystemMessage:
+        """Wraps a static system prompt so it stays a byte-identical, cacheable prefix across calls.
+
+        Anything that varies per instance or per call (n_items, top_k, ...) belongs in the human message.
+        """
+        if not self.cache_control:
+            return SystemMessage(content=static_system_message)
+        return SystemMessage(content=[{"type": "text", "text": static_system_message, "cache_control": {"type": "ephemeral"}}])
+
+    @staticmethod
+    def _fit_tool_names(tool_names: List[str], candidate_tool_names: List[str], k: int) -> List[str]:
+        """Turns a reranker answer into k unique retrieved tool names without another LLM call.
+
+        Unknown and duplicate names are dropped, extra names are truncated, and missing slots are
+        filled with the best remaining candidates, in order.
+        """
+        candidates = dict.fromkeys(candidate_tool_names)
+        fitted = [tool_name for tool_name in dict.fromkeys(tool_names) if tool_name in candidates][:k]
+        if len(fitted) < k:
+            chosen = set(fitted)
+            fitted += [tool_name for tool_name in candidates if tool_name not in chosen][:k - len(fitted)]
+        return fitted
+
+    def _build_messages(self, human_message: str, system_message: Optional[SystemMessage] = None) -> List[BaseMessage]:
+        """The prompt of a module: its prebuilt system message (or `system_message`) and the per-call human message.
+
+        The human message is fully interpolated already, so no prompt template is parsed or validated per call.
+        """
+        return [system_message or self._system_message, HumanMessage(content=human_message)]
+
     @abstractmethod
     def generate(self, **kwargs):
         """Abstract method for generating output."""
@@ -0,0 +1,93 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+from collections import OrderedDict
+from langchain_core.messages import HumanMessage, SystemMessage
+import asyncio
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+if TYPE_CHECKING:
+    # type hints only, langchain_openai is slow to import
+    from langchain_openai import ChatOpenAI
+
+CONVERSATION_SUMMARY_SYSTEM_MESSAGE = """You are an expert at summarizing conversations between a user and an assistant.
+Summarize the given turns into a single short paragraph (at most 100 words) that keeps every fact, number, entity and open request the user may refer back to.
+Only return the summary."""
+
+class ConversationHistorySummarizer:
+    """Keeps the conversation history sent to the query preprocessing modules short.
+
+    Older turns are folded into a summary in blocks of `summarize_every` turns, so the summarized
+    prefix only changes every few turns and its summary is reused in between. The last
+    `recent_turns` to `recent_turns + summarize_every - 1` turns are always kept verbatim.
+    At most `max_summaries` summaries are kept, the least recently used ones are evicted first.
+    """
+    def __init__(self, llm: ChatOpenAI, recent_turns: int = 5, summarize_every: int = 5, max_summaries: int = 1000):
+        self.llm = llm
+        self.recent_turns = recent_turns
+        self.summarize_every = summarize_every
+        self.max_summaries = max_summaries
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    def _split(self, conversation_history: List[Any]) -> Tuple[List[Any], List[Any]]:
+        n_older = max(0, len(conversation_history) - self.recent_turns) // self.summarize_every * self.summarize_every
+        return conversation_history[:n_older], conversation_history[n_older:]
+
+    def _key(self, older_turns: List[Any]) -> str:
+        return hashlib.sha256(json.dumps(older_turns, default=str).encode("utf-8")).hexdigest()
+
+    def _get_summary(self, key: str) -> Optional[str]:
+        summary = self._summaries.get(key)
+        if summary is not None:
+            self._summaries.move_to_end(key)
+        return summary
+
+    def _set_summary(self, key: str, summary: str):
+        self._summaries[key] = summary
+        self._summaries.move_to_end(key)
+        if len(self._summaries) > self.max_summaries:
+            self._summaries.popitem(last=False)
+
+    def _get_messages(self, older_turns: List[Any]):
+        return [SystemMessage(content=CONVERSATION_SUMMARY_SYSTEM_MESSAGE), HumanMessage(content=f"TURNS: {older_turns}\nSUMMARY:")]
+
+    def compress(self, conversation_history: List[Any]) -> Tuple[Optional[str], List[Any]]:
+        """Returns the summary of the older turns (None when there are none) and the recent turns."""
+        older_turns, recent_turns = self._split(conversation_history)
+        if not older_turns:
+            return None, recent_turns
+        key = self._key(older_turns)
+        summary = self._get_summary(key)
+        if summary is None:
+            summary = self.llm.invoke(self._get_messages(older_turns)).content
+            self._set_summary(key, summary)
+        return summary, recent_turns
+
+    async def acompress(self, conversation_history: List[Any]) -> Tuple[Optional[str], List[Any]]:
+        """Like `compress`, but never waits on the summary: until the background summary of the older
+        turns is ready, the full history is returned verbatim."""
+        older_turns, recent_turns = self._split(conversation_history)
+        if not older_turns:
+            return None, recent_turns
+        key = self._key(older_turns)
+        summary = self._get_summary(key)
+        if summary is not None:
+            return summary, recent_turns
+        if key not in self._pending:
+            task = asyncio.create_task(self._asummarize(key, older_turns))
+            task.add_done_callback(lambda task, key=key: self._on_summary_done(key, task))
+            self._pending[key] = task
+        return None, conversation_history
+
+    async def _asummarize(self, key: str, older_turns: List[Any]):
+        self._set_summary(key, (await self.llm.ainvoke(self._get_messages(older_turns))).content)
+
+    def _on_summary_done(self, key: str, task: asyncio.Task):
+        # the key is released even on failure, so the next call retries the summary
+        self._pending.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Summarizing the conversation history failed: %r", task.exception())
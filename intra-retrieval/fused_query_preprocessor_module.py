@@ -0,0 +1,202 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional, Tuple
+from langchain_core.messages import SystemMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from intra_retrieval.base_artf_module import BaseARTFModules
+from intra_retrieval.conversation_history_summarizer import ConversationHistorySummarizer
+from pre_retrieval.response_cache import SemanticCache, semantic_cached, semantic_namespace
+from pydantic import BaseModel, Field
+import re
+
+if TYPE_CHECKING:
+    # type hints only, langchain_openai is slow to import
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+# Markers of a multi-intent (multi-hop) question; without them the query is treated as a single step
+MULTI_INTENT_PATTERN = re.compile(r"\b(and|also|additionally|as well as|then|plus|both|along with)\b|[;&]|\?.*\?", re.IGNORECASE)
+MAX_SINGLE_INTENT_WORDS = 25
+
+# Static few-shot prefixes, kept byte-identical across calls so providers can cache them;
+# the number of expanded queries is given in the human message
+FUSED_QUERY_PREPROCESSOR_SYSTEM_MESSAGE = """You are an expert at preparing user questions for retrieving relevant tools from a vector database.
+You will perform three tasks in order, each building on the previous one:
+1. REWRITE: Analyze the user's input, identify ambiguities, and use the previous chat history for context. Correct grammar, clarify terms, and rewrite the query concisely for better understanding.
+2. DECOMPOSE: Break the rewritten query down into clearly defined step(s). A question asking for a single action is one step. A question asking for multiple things (usually denoted by the use of 'and' or 'additionally') should be broken down into 2-4 steps, depending on the complexity of the request. Always be as clear as possible, including the technical details.
+3. EXPAND: For each decomposed step, craft the requested number of nuanced sentence variations that target different keywords and aspects of understanding or solving the step. Some variations can focus on the more abstract concept, others on the quantitative version; some can be more professional and others more casual.
+
+Example:
+-----------
+Previous Chat History: []
+User Input: "current value of inv of 5k, yearly flows 3k for 3 yrs @ R 3.5, also IRR for another one 7k cost, 4k flows for 8 yrs"
+REWRITTEN QUERY: "What is the NPV of an initial investment of $5,000 with yearly cash flows of $3,000 for 3 years at a 3.5% rate? Also, calculate the internal rate of return (IRR) for another investment with an initial cost of $7,000 and yearly cash flows of $4,000 for 8 years."
+DECOMPOSED STEP 1: "Calculate the net present value (NPV) of an initial investment of $5,000 with yearly cash flows of $3,000 for 3 years at a 3.5% discount rate."
+EXPANDED QUERIES FOR STEP 1: ["Determine the present worth of a $5,000 investment returning $3,000 annually over 3 years, discounted at 3.5%.", "I want to know if my project is worth it after discounting its future cash flows."]
+DECOMPOSED STEP 2: "Calculate the internal rate of return (IRR) for an investment with an initial cost of $7,000 and yearly cash flows of $4,000 for 8 years."
+EXPANDED QUERIES FOR STEP 2: ["Find the discount rate at which the NPV of a $7,000 investment with $4,000 yearly inflows over 8 years is zero.", "What annual return does my investment effectively earn?"]
+-----------
+"""
+
+SINGLE_INTENT_QUERY_PREPROCESSOR_SYSTEM_MESSAGE = """You are an expert at preparing user questions for retrieving relevant tools from a vector database.
+The user question asks for a single action. You will perform two tasks in order:
+1. REWRITE: Analyze the user's input, identify ambiguities, and use the previous chat history for context. Correct grammar, clarify terms, and rewrite the query concisely for better understanding.
+2. EXPAND: Craft the requested number of nuanced sentence variations of the rewritten query that target different keywords and aspects of understanding or solving it. Some variations can focus on the more abstract concept, others on the quantitative version; some can be more professional and others more casual.
+
+Example:
+-----------
+Previous Chat History: ["User: status of project?", "Assistant: The project is 80% complete."]
+User Input: "npv of it?"
+REWRITTEN QUERY: "What is the net present value (NPV) of the project?"
+EXPANDED QUERIES: ["Calculate the net present value of the project's discounted cash flows.", "I want to know if my project is worth it after discounting its future cash flows."]
+-----------
+"""
+
+# The schemas are static, the number of expanded queries is requested in the prompt
+class Decomposition(BaseModel):
+    decomposed_query: str = Field(description="A single clearly defined step of the rewritten query.")
+    expanded_queries: List[str] = Field(
+        description="The requested number of variations or expanded versions of the decomposed query."
+    )
+
+class PreprocessedQuery(BaseModel):
+    rewritten_query: str = Field(description="The rewritten query.")
+    decompositions: List[Decomposition] = Field(description="The decomposed steps of the rewritten query, each with its expanded queries.")
+
+class SingleIntentQuery(BaseModel):
+    rewritten_query: str = Field(description="The rewritten query.")
+    expanded_queries: List[str] = Field(
+        description="The requested number of variations or expanded versions of the rewritten query."
+    )
+
+class FusedQueryPreprocessor(BaseARTFModules):
+    """Rewrites, decomposes and expands a user query in a single structured LLM call.
+
+    Queries that `needs_decomposition` classifies as single-intent skip the decomposition task and
+    use the rewritten query as their only step. That simpler task can be routed to a cheaper
+    `single_intent_llm`.
+    """
+    def __init__(
+        self,
+        llm: ChatOpenAI,
+        n_items: int,
+        semantic_cache: Optional[SemanticCache] = None,
+        cache_control: bool = False,
+        history_summarizer: Optional[ConversationHistorySummarizer] = None,
+        single_intent_llm: Optional[ChatOpenAI] = None
+    ):
+        self.n_items = n_items
+        # Rewriting and expanding a single-intent query needs no planning, a small model is enough
+        self.single_intent_llm = single_intent_llm or llm
+        super().__init__(llm=llm, semantic_cache=semantic_cache, cache_control=cache_control)
+        # Optional rolling summary of the older turns, keeps the prompt short in long sessions
+        self.history_summarizer = history_summarizer
+        self._system_message = self._get_cached_system_message(FUSED_QUERY_PREPROCESSOR_SYSTEM_MESSAGE)
+        self._single_intent_system_message = self._get_cached_system_message(SINGLE_INTENT_QUERY_PREPROCESSOR_SYSTEM_MESSAGE)
+        # n_items is fixed, so only the chat history and user question are filled in per call
+        self._human_message_templates = {
+            decompose: f"""NUMBER OF EXPANDED QUERIES: {self.n_items}
+{{summary_line}}Previous Chat History: {{conversation_history}}
+User Input: '{{user_question}}'
+REWRITTEN QUERY, {answer_format}:"""
+            for decompose, answer_format in (
+                (True, f"DECOMPOSED STEPS, AND {self.n_items} EXPANDED QUERIES PER STEP"),
+                (False, f"AND {self.n_items} EXPANDED QUERIES")
+            )
+        }
+
+    def _initialize_structured_llm(self):
+        self.structured_single_intent_llm = self.single_intent_llm.with_structured_output(SingleIntentQuery)
+        # A dict schema makes the structured output stream as growing partial dicts, used by `astream_decompositions`
+        self.streaming_structured_llm = self.llm.with_structured_output(convert_to_openai_tool(PreprocessedQuery))
+        return self.llm.with_structured_output(PreprocessedQuery)
+
+    @staticmethod
+    def needs_decomposition(query: str) -> bool:
+        """Cheap heuristic: short queries without conjunctions or multiple questions are single-intent."""
+        return bool(MULTI_INTENT_PATTERN.search(query)) or len(query.split()) > MAX_SINGLE_INTENT_WORDS
+
+    def _get_system_message(self) -> SystemMessage:
+        return self._system_message
+
+    def _get_single_intent_system_message(self) -> SystemMessage:
+        return self._single_intent_system_message
+
+    def _get_human_message(self, user_question: str, conversation_history: List[Any], decompose: bool = True, history_summary: Optional[str] = None) -> str:
+        summary_line = f"Summary of Older Chat History: {history_summary}\n" if history_summary else ""
+        return self._human_message_templates[decompose].format(summary_line=summary_line, conversation_history=conversation_history, user_question=user_question)
+
+    def _get_preprocess_messages(self, user_question: str, conversation_history: List[Any], decompose: bool = True, history_summary: Optional[str] = None):
+        system_message = self._get_system_message() if decompose else self._get_single_intent_system_message()
+        return self._build_messages(self._get_human_message(user_question, conversation_history, decompose, history_summary), system_message)
+
+    def _single_intent_result_to_dict(self, result) -> Dict[str, Any]:
+        return {
+            "rewritten_query": result.rewritten_query,
+            "decompositions": [{"decomposed_query": result.rewritten_query, "expanded_queries": result.expanded_queries}]
+        }
+
+    @semantic_cached()
+    def generate(self, query: str, conversation_history: Optional[List[str]] = []) -> Dict[str, Any]:
+        history_summary = None
+        if self.history_summarizer:
+            history_summary, conversation_history = self.history_summarizer.compress(conversation_history)
+        if not self.needs_decomposition(query):
+            messages = self._get_preprocess_messages(query, conversation_history, decompose=False, history_summary=history_summary)
+            return self._single_intent_result_to_dict(self.structured_single_intent_llm.invoke(messages))
+        messages = self._get_preprocess_messages(query, conversation_history, history_summary=history_summary)
+        result = self.structured_llm.invoke(messages)
+        return result.model_dump()
+
+    @semantic_cached()
+    async def agenerate(self, query: str, conversation_history: Optional[List[str]] = []) -> Dict[str, Any]:
+        history_summary = None
+        if self.history_summarizer:
+            history_summary, conversation_history = await self.history_summarizer.acompress(conversation_history)
+        if not self.needs_decomposition(query):
+            messages = self._get_preprocess_messages(query, conversation_history, decompose=False, history_summary=history_summary)
+            return self._single_intent_result_to_dict(await self.structured_single_intent_llm.ainvoke(messages))
+        messages = self._get_preprocess_messages(query, conversation_history, history_summary=history_summary)
+        result = await self.structured_llm.ainvoke(messages)
+        return result.model_dump()
+
+    async def astream_decompositions(self, query: str, conversation_history: Optional[List[str]] = []) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Yields `(rewritten_query, decomposition)` for each decomposition as soon as it is complete.
+
+        The rewritten query is written first, and a decomposition is complete once the model starts
+        writing the next one, so the caller can start retrieving tools for the first steps while the
+        last ones are still being generated. Results are shared with `agenerate` through the semantic cache.
+        """
+        if not self.needs_decomposition(query):
+            result = await self.agenerate(query, conversation_history)
+            for decomposition in result["decompositions"]:
+                yield result["rewritten_query"], decomposition
+            return
+
+        namespace = embedding = None
+        if self.semantic_cache is not None:
+            # the same entry `agenerate` reads and writes, checked before the history is summarized
+            namespace = semantic_namespace(self, {"conversation_history": conversation_history})
+            result, embedding = await self.semantic_cache.aget(namespace, query)
+            if result is not None:
+                for decomposition in result["decompositions"]:
+                    yield result["rewritten_query"], decomposition
+                return
+
+        history_summary = None
+        if self.history_summarizer:
+            history_summary, conversation_history = await self.history_summarizer.acompress(conversation_history)
+        messages = self._get_preprocess_messages(query, conversation_history, history_summary=history_summary)
+
+        n_yielded = 0
+        partial = {}
+        async for chunk in self.streaming_structured_llm.astream(messages):
+            partial = chunk or {}
+            decompositions = partial.get("decompositions") or []
+            # every decomposition before the one being written is final
+            while n_yielded < len(decompositions) - 1:
+                yield partial.get("rewritten_query", ""), decompositions[n_yielded]
+                n_yielded += 1
+        decompositions = partial.get("decompositions") or []
+        for decomposition in decompositions[n_yielded:]:
+            yield partial.get("rewritten_query", ""), decomposition
+        if namespace is not None and decompositions:
+            self.semantic_cache.set(namespace, embedding, {"rewritten_query": partial.get("rewritten_query", ""), "decompositions": decompositions})
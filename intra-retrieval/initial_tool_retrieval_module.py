@@ -1,8 +1,13 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, List
 from abc import ABC, abstractmethod
-from langchain_openai import ChatOpenAI,OpenAIEmbeddings
 from intra_retrieval.base_artf_module import BaseARTFModules
 from pre_retrieval.vector_store_indexer import BaseVectorStoreIndexer
 
+if TYPE_CHECKING:
+    # type hints only, langchain_openai is slow to import
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
 class InitialToolRetrievalModule(BaseARTFModules):
     def __init__(self, toolshed_knowledge_base: BaseVectorStoreIndexer):
         self.toolshed_knowledge_base = toolshed_knowledge_base
@@ -22,3 +27,27 @@ class InitialToolRetrievalModule(BaseARTFModules):
             return docs
         except Exception as e:
             raise ValueError(f"Error retrieving tools: {str(e)}")
+
+    def generate_batch(self, queries: List[str], top_k: int) -> List[List[Document]]:
+        """Queries the index with all queries in one embedding call and one search."""
+        try:
+            return self.toolshed_knowledge_base.query_batch(queries, k=top_k)
+        except Exception as e:
+            raise ValueError(f"Error retrieving tools: {str(e)}")
+
+    async def agenerate_batch(self, queries: List[str], top_k: int) -> List[List[Document]]:
+        """Asynchronous batched query to the index."""
+        try:
+            return await self.toolshed_knowledge_base.aquery_batch(queries, k=top_k)
+        except Exception as e:
+            raise ValueError(f"Error retrieving tools: {str(e)}")
+
+    def retrieve_all(self, queries_by_intent: List[List[str]], top_k: int) -> List[List[List[Document]]]:
+        """Retrieves the tools of every query of every intent in one batch, keeping the nesting of `queries_by_intent`."""
+        retrieved_tools_iter = iter(self.generate_batch([q for queries in queries_by_intent for q in queries], top_k=top_k))
+        return [[next(retrieved_tools_iter) for _ in queries] for queries in queries_by_intent]
+
+    async def aretrieve_all(self, queries_by_intent: List[List[str]], top_k: int) -> List[List[List[Document]]]:
+        """Asynchronous `retrieve_all`: all queries are in flight at once instead of one round-trip per query."""
+        retrieved_tools_iter = iter(await self.agenerate_batch([q for queries in queries_by_intent for q in queries], top_k=top_k))
+        return [[next(retrieved_tools_iter) for _ in queries] for queries in queries_by_intent]
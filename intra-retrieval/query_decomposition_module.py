@@ -1,19 +1,17 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, List, Optional, Tuple
 from abc import ABC, abstractmethod
-from langchain_openai import ChatOpenAI,OpenAIEmbeddings
+from langchain_core.messages import SystemMessage
 from intra_retrieval.base_artf_module import BaseARTFModules
+from pre_retrieval.response_cache import SemanticCache, semantic_cached
 from pydantic import BaseModel, Field
 
-class QueryDecompositionModule(BaseARTFModules):
-    def __init__(self, llm: AzureChatOpenAI):
-        super().__init__(llm=llm)
-
-    def _initialize_structured_llm(self):
-        class DecomposedQuery(BaseModel):
-            decomposed_steps: List[str] = Field(description="The decomposed steps of the query.")
-        return self.llm.with_structured_output(DecomposedQuery)
+if TYPE_CHECKING:
+    # type hints only, langchain_openai is slow to import
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 
-    def _get_system_message(self) -> str:
-        return """You are an expert at breaking down user questions into clearly defined step(s).
+# Static few-shot prefix, kept byte-identical across calls so providers can cache it
+QUERY_DECOMPOSITION_SYSTEM_MESSAGE = """You are an expert at breaking down user questions into clearly defined step(s).
 You will be given a user question that can be answered by a single action or multiple actions (multi-hop queries).
 For some questions, the user may be asking for a single action, which is typically just a single topic and query, which can be broken down into one step.
 For other questions, the user may be asking for multiple things (usually denoted by the use of 'and' or 'additionally'), which can be broken down into multiple steps.
@@ -39,33 +37,51 @@ EX. STEP(S):
 -----------
 """
 
+class DecomposedQuery(BaseModel):
+    decomposed_steps: List[str] = Field(description="The decomposed steps of the query.")
+
+class QueryDecompositionModule(BaseARTFModules):
+    def __init__(
+        self,
+        llm: AzureChatOpenAI,
+        embedder: Optional[OpenAIEmbeddings] = None,
+        semantic_cache: Optional[SemanticCache] = None,
+        cache_control: bool = False
+    ):
+        super().__init__(llm=llm, embedder=embedder, semantic_cache=semantic_cache, cache_control=cache_control)
+        self._system_message = self._get_cached_system_message(QUERY_DECOMPOSITION_SYSTEM_MESSAGE)
+
+    def _initialize_structured_llm(self):
+        return self.llm.with_structured_output(DecomposedQuery)
+
+    def _get_system_message(self) -> SystemMessage:
+        return self._system_message
+
     def _get_human_message(self, user_question: str) -> str:
         return f"""USER QUESTION: {user_question}
 STEPS FOR THAT QUERY:"""
 
+    @semantic_cached()
     def generate(self, query: str) -> List[str]:
         messages = self._get_decomposition_messages(user_question=query)
         result = self.structured_llm.invoke(messages)
         return result.decomposed_steps
 
+    @semantic_cached()
     async def agenerate(self, query: str) -> List[str]:
         messages = self._get_decomposition_messages(user_question=query)
         result = await self.structured_llm.ainvoke(messages)
         return result.decomposed_steps
 
-    def _get_decomposition_messages(self, user_question: str):
-        system_message = self._get_system_message()
-        human_message = self._get_human_message(user_question=user_question)
-
-        chat_template = ChatPromptTemplate.from_messages(
-            [
-                SystemMessagePromptTemplate.from_template(system_message),
-                HumanMessagePromptTemplate.from_template(human_message)
-            ]
-        )
+    def generate_with_embeddings(self, query: str) -> Tuple[List[str], List[List[float]]]:
+        """Decomposes the query and embeds all decomposed steps in one embedding request."""
+        decomposed_steps = self.generate(query)
+        return decomposed_steps, self.embedder.embed_documents(decomposed_steps)
 
-        messages = chat_template.format_messages(
-            user_question=user_question
-        )
+    async def agenerate_with_embeddings(self, query: str) -> Tuple[List[str], List[List[float]]]:
+        """Asynchronous `generate_with_embeddings`."""
+        decomposed_steps = await self.agenerate(query)
+        return decomposed_steps, await self.embedder.aembed_documents(decomposed_steps)
 
-        return messages
+    def _get_decomposition_messages(self, user_question: str):
+        return self._build_messages(self._get_human_message(user_question=user_question))
@@ -1,18 +1,18 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, List, Optional
 from abc import ABC, abstractmethod
-from langchain_openai import ChatOpenAI,OpenAIEmbeddings
+from langchain_core.messages import SystemMessage
 from intra_retrieval.base_artf_module import BaseARTFModules
+from intra_retrieval.conversation_history_summarizer import ConversationHistorySummarizer
+from pre_retrieval.response_cache import SemanticCache, semantic_cached
+from pydantic import BaseModel, Field
 
-class LLMQueryRewritingModule(BaseARTFModules):
-    def __init__(self, llm: ChatOpenAI):
-        super().__init__(llm=llm)
-
-    def _initialize_structured_llm(self):
-        class RewrittenQuery(BaseModel):
-            rewritten_query: str = Field(description="The rewritten query.")
-        return self.llm.with_structured_output(RewrittenQuery)
+if TYPE_CHECKING:
+    # type hints only, langchain_openai is slow to import
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 
-    def _get_system_message(self) -> str:
-        return """You are an intelligent assistant designed to rewrite user queries for better understanding and clarity.
+# Static few-shot prefix, kept byte-identical across calls so providers can cache it
+QUERY_REWRITING_SYSTEM_MESSAGE = """You are an intelligent assistant designed to rewrite user queries for better understanding and clarity.
 Your task is to analyze the user's input, identify ambiguities, and use the previous chat history for context. Correct grammar, clarify terms, and rewrite the query concisely for better understanding.
 
 Example 1:
@@ -35,35 +35,51 @@ Rewritten Query: "What is the NPV of an initial investment of $5,000 with yearly
 -----------
 """
 
-    def _get_human_message(self, user_question: str, conversation_history: List[Any]) -> str:
-        return f"""Previous Chat History: {conversation_history}
-User Input: '{user_question}'
-Rewritten Query:"""
+class RewrittenQuery(BaseModel):
+    rewritten_query: str = Field(description="The rewritten query.")
 
-    def _get_rewrite_messages(self, user_question: str, conversation_history: List[Any]):
-        system_message = self._get_system_message()
-        human_message = self._get_human_message(user_question, conversation_history)
+class LLMQueryRewritingModule(BaseARTFModules):
+    def __init__(
+        self,
+        llm: ChatOpenAI,
+        semantic_cache: Optional[SemanticCache] = None,
+        cache_control: bool = False,
+        history_summarizer: Optional[ConversationHistorySummarizer] = None
+    ):
+        super().__init__(llm=llm, semantic_cache=semantic_cache, cache_control=cache_control)
+        # Optional rolling summary of the older turns, keeps the prompt short in long sessions
+        self.history_summarizer = history_summarizer
+        self._system_message = self._get_cached_system_message(QUERY_REWRITING_SYSTEM_MESSAGE)
+
+    def _initialize_structured_llm(self):
+        return self.llm.with_structured_output(RewrittenQuery)
 
-        chat_template = ChatPromptTemplate.from_messages(
-            [
-                SystemMessagePromptTemplate.from_template(system_message),
-                HumanMessagePromptTemplate.from_template(human_message)
-            ]
-        )
+    def _get_system_message(self) -> SystemMessage:
+        return self._system_message
 
-        messages = chat_template.format_messages(
-            conversation_history=conversation_history,
-            user_question=user_question
-        )
+    def _get_human_message(self, user_question: str, conversation_history: List[Any], history_summary: Optional[str] = None) -> str:
+        summary_line = f"Summary of Older Chat History: {history_summary}\n" if history_summary else ""
+        return f"""{summary_line}Previous Chat History: {conversation_history}
+User Input: '{user_question}'
+Rewritten Query:"""
 
-        return messages
+    def _get_rewrite_messages(self, user_question: str, conversation_history: List[Any], history_summary: Optional[str] = None):
+        return self._build_messages(self._get_human_message(user_question, conversation_history, history_summary))
 
+    @semantic_cached()
     def generate(self, query: str, conversation_history: Optional[List[str]] = []) -> str:
-        messages = self._get_rewrite_messages(query, conversation_history)
+        history_summary = None
+        if self.history_summarizer:
+            history_summary, conversation_history = self.history_summarizer.compress(conversation_history)
+        messages = self._get_rewrite_messages(query, conversation_history, history_summary)
         result = self.structured_llm.invoke(messages)
         return result.rewritten_query
 
+    @semantic_cached()
     async def agenerate(self, query: str, conversation_history: Optional[List[str]] = []) -> str:
-        messages = self._get_rewrite_messages(query, conversation_history)
+        history_summary = None
+        if self.history_summarizer:
+            history_summary, conversation_history = await self.history_summarizer.acompress(conversation_history)
+        messages = self._get_rewrite_messages(query, conversation_history, history_summary)
         result = await self.structured_llm.ainvoke(messages)
         return result.rewritten_query
@@ -0,0 +1,190 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set
+from langchain_core.messages import SystemMessage
+from intra_retrieval.base_artf_module import BaseARTFModules
+from pre_retrieval.response_cache import SemanticCache, semantic_cached
+from post_retrieval.reranker_multi_query_expansion_or_variation_module import RerankerMultiQueryExpansionVariations
+from post_retrieval.reranker_query_decomposition import RerankerDecomposedQueries
+from pydantic import BaseModel, Field
+import functools
+
+if TYPE_CHECKING:
+    # type hints only, langchain_openai is slow to import
+    import tiktoken
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+# Static prefix of the global rerank prompt, kept byte-identical across calls so providers can cache it;
+# the number of intents and of tools are given in the human message
+GLOBAL_RERANK_SYSTEM_MESSAGE = """You are an expert at reranking tools retrieved from a vector database and combining them into the final list of tools that solve a user question.
+The user question has been broken down into one or more distinct user intents. For each intent you are given sentence variations of that intent and the unique tools retrieved by embedding each sentence variation, annotated with the sentences that retrieved them and at which rank.
+Your task has two stages:
+1. For EACH intent independently, rank the requested number of most relevant tools to solve that intent, in order of relevance.
+2. Combine the per-intent rankings into a single unique list of the requested number of final tools that solve the entire user question. Start by taking the requested top tools from each intent, then add the next most relevant tool(s) from the intents until you have the requested number of unique final tools. If a tool appears in several intents, count it for the intent it is most relevant to and take the next tool from the other intents."""
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model_name: Optional[str]) -> tiktoken.Encoding:
+    """The tokenizer of the model, loaded once per process (tiktoken ships with langchain-openai)."""
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except (KeyError, TypeError):
+        return tiktoken.get_encoding("o200k_base")
+
+# The schemas are static, the number of tools is requested in the prompt and fixed locally by `_fit_tool_names`
+class IntentToolNames(BaseModel):
+    intent_number: int = Field(description="The number of the intent these tool names belong to.")
+    tool_names: List[str] = Field(description="The exact tool names most relevant to this intent, in order of relevance.")
+
+class GlobalToolNames(BaseModel):
+    intent_tool_names: List[IntentToolNames] = Field(description="The reranked tool names for every intent, one entry per intent.")
+    final_tool_names: List[str] = Field(description="The unique exact final tool names that solve the entire user question.")
+
+class GlobalReranker(BaseARTFModules):
+    """Reranks the tools of every decomposed query and combines them into the final top k in one LLM call.
+
+    When the combined candidates would exceed `max_prompt_tokens`, it falls back to the two-stage form:
+    a batched per-intent rerank followed by the decomposed-query combiner.
+    """
+    def __init__(
+        self,
+        llm: ChatOpenAI,
+        top_k: int,
+        final_top_k: int,
+        reranker_multi_query_expansion_variations: RerankerMultiQueryExpansionVariations,
+        reranker_query_decomposition: RerankerDecomposedQueries,
+        max_prompt_tokens: int = 12000,
+        semantic_cache: Optional[SemanticCache] = None,
+        cache_control: bool = False
+    ):
+        self.top_k = top_k
+        self.final_top_k = final_top_k
+        self.reranker_multi_query_expansion_variations = reranker_multi_query_expansion_variations
+        self.reranker_query_decomposition = reranker_query_decomposition
+        self.max_prompt_tokens = max_prompt_tokens
+        super().__init__(llm=llm, semantic_cache=semantic_cache, cache_control=cache_control)
+        self._system_message = self._get_cached_system_message(GLOBAL_RERANK_SYSTEM_MESSAGE)
+        # The static system prompt is tokenized once, only the human message is counted per call
+        self._encoding = get_encoding(getattr(llm, "model_name", None))
+        self._n_system_message_tokens = len(self._encoding.encode(GLOBAL_RERANK_SYSTEM_MESSAGE))
+
+    def _initialize_structured_llm(self):
+        # Strict JSON schema decoding guarantees the shape
+        return self.llm.with_structured_output(GlobalToolNames, method="json_schema", strict=True)
+
+    def _get_messages(self, user_question: str, items: List[Dict[str, Any]]):
+        num_intents = len(items)
+        num_tools_per_intent = max(1, self.final_top_k // num_intents)
+        num_tools_per_intent_text = f"{num_tools_per_intent} tools" if num_tools_per_intent > 1 else f"{num_tools_per_intent} tool"
+
+        # Intents often retrieve the same tools, each description is only written once
+        described_tool_names: Set[str] = set()
+        intents_section = ""
+        for intent_idx, item in enumerate(items, start=1):
+            intents_section += f"""### INTENT {intent_idx}: '{item["user_question"]}'
+SENTENCE VARIATIONS: {item["ai_response"]}
+UNIQUE RETRIEVED TOOLS:
+{self.reranker_multi_query_expansion_variations._format_candidates(user_question_results=item.get("user_question_results"), sentence_results=item["sentence_results"], described_tool_names=described_tool_names)}
+
+"""
+
+        human_message = f"""NUMBER OF INTENTS: {num_intents}
+NUMBER OF TOOLS TO RETURN PER INTENT: {self.top_k}
+TOP TOOLS TO TAKE FROM EACH INTENT FIRST: {num_tools_per_intent_text}
+NUMBER OF FINAL UNIQUE TOOLS: {self.final_top_k}
+
+USER QUESTION: '{user_question}'
+{intents_section}=========
+Return the top {self.top_k} TOOL NAMES for each of the {num_intents} intent(s), and the {self.final_top_k} FINAL UNIQUE TOOL NAMES."""
+
+        return self._build_messages(human_message)
+
+    def _estimate_tokens(self, messages) -> int:
+        n_tokens = 0
+        for message in messages:
+            if message is self._system_message:
+                n_tokens += self._n_system_message_tokens
+            elif isinstance(message.content, str):
+                n_tokens += len(self._encoding.encode(message.content))
+            else:
+                n_tokens += sum(len(self._encoding.encode(block.get("text", ""))) for block in message.content)
+        return n_tokens
+
+    def _parse_result(self, result, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Fits the answer locally instead of asking again: every intent to its top k retrieved tools and the
+        final list to the final top k, padded with the best remaining candidates."""
+        candidates_per_intent = [
+            self.reranker_multi_query_expansion_variations._candidate_tool_names(item.get("user_question_results"), item["sentence_results"])
+            for item in items
+        ]
+        tool_names_by_intent = {r.intent_number: r.tool_names for r in result.intent_tool_names}
+        intent_tool_names = [
+            self._fit_tool_names(tool_names_by_intent.get(intent_number, []), candidates, self.top_k)
+            for intent_number, candidates in enumerate(candidates_per_intent, start=1)
+        ]
+        # the final list is padded from the per-intent rankings interleaved by rank, then from the other retrieved tools
+        final_candidates = (
+            self.reranker_query_decomposition._candidate_tool_names(intent_tool_names)
+            + self.reranker_query_decomposition._candidate_tool_names(candidates_per_intent)
+        )
+        final_tool_names = self._fit_tool_names(result.final_tool_names, final_candidates, self.final_top_k)
+        return {"intent_tool_names": intent_tool_names, "final_tool_names": final_tool_names}
+
+    @staticmethod
+    def _combine_arguments(user_question: str, items: List[Dict[str, Any]], intent_tool_names: List[List[str]]) -> Optional[Dict[str, Any]]:
+        """Arguments of the decomposed-query combiner in the two-stage fallback, None when a single intent needs no combining."""
+        if len(items) == 1:
+            return None
+        return {
+            "user_question": user_question,
+            "list_of_intents": [item["user_question"] for item in items],
+            "list_of_list_of_tools": intent_tool_names
+        }
+
+    def _rerank_two_stage(self, user_question: str, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        intent_tool_names = self.reranker_multi_query_expansion_variations.generate_batch(items=items)
+        combine_arguments = self._combine_arguments(user_question, items, intent_tool_names)
+        final_tool_names = intent_tool_names[0] if combine_arguments is None else self.reranker_query_decomposition.generate(**combine_arguments)
+        return {"intent_tool_names": intent_tool_names, "final_tool_names": final_tool_names}
+
+    async def _arerank_two_stage(self, user_question: str, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        intent_tool_names = await self.reranker_multi_query_expansion_variations.agenerate_batch(items=items)
+        combine_arguments = self._combine_arguments(user_question, items, intent_tool_names)
+        final_tool_names = intent_tool_names[0] if combine_arguments is None else await self.reranker_query_decomposition.agenerate(**combine_arguments)
+        return {"intent_tool_names": intent_tool_names, "final_tool_names": final_tool_names}
+
+    @semantic_cached(query_arg="user_question")
+    def generate(self, user_question: str, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Each item holds the keyword arguments of `RerankerMultiQueryExpansionVariations.generate` for one intent."""
+        items = self.reranker_multi_query_expansion_variations.prefilter_items(items)
+        messages = self._get_messages(user_question, items)
+        if self._estimate_tokens(messages) <= self.max_prompt_tokens:
+            # only request errors are retried, a wrong number of tools is fixed locally by `_parse_result`
+            attempts = 0
+            max_attempts = 3
+            while attempts < max_attempts:
+                attempts += 1
+                try:
+                    return self._parse_result(self.structured_llm.invoke(messages), items)
+                except Exception as e:
+                    pass  # Handle exceptions as needed
+
+        # Fallback: prompt too large or the requests failed, rerank in two stages
+        return self._rerank_two_stage(user_question, items)
+
+    @semantic_cached(query_arg="user_question")
+    async def agenerate(self, user_question: str, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        items = await self.reranker_multi_query_expansion_variations.aprefilter_items(items)
+        messages = self._get_messages(user_question, items)
+        if self._estimate_tokens(messages) <= self.max_prompt_tokens:
+            # only request errors are retried, a wrong number of tools is fixed locally by `_parse_result`
+            attempts = 0
+            max_attempts = 3
+            while attempts < max_attempts:
+                attempts += 1
+                try:
+                    return self._parse_result(await self.structured_llm.ainvoke(messages), items)
+                except Exception as e:
+                    pass  # Handle exceptions as needed
+
+        # Fallback: prompt too large or the requests failed, rerank in two stages
+        return await self._arerank_two_stage(user_question, items)
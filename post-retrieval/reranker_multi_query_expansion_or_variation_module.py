@@ -1,83 +1,198 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set
 from abc import ABC, abstractmethod
-from langchain_openai import ChatOpenAI,OpenAIEmbeddings
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from intra_retrieval.base_artf_module import BaseARTFModules
+from pre_retrieval.response_cache import SemanticCache, semantic_cached
 from pydantic import BaseModel, Field
+import asyncio
+
+if TYPE_CHECKING:
+    # type hints only, langchain_openai is slow to import
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+TOOL_ENTRY_PREFIX = "-------\nTOOL NAME: "
+
+# Static prefix of the batched rerank prompt, kept byte-identical across calls so providers can cache it;
+# the number of tasks and of tools per task are given in the human message
+BATCH_RERANK_SYSTEM_MESSAGE = """You are an expert at reranking tools retrieved from a vector database.
+You will be given numbered tasks. Each task contains a user question, sentence variations of that question, and the unique tools retrieved by embedding each sentence variation, annotated with the sentences that retrieved them and at which rank.
+For EACH task independently, rank the requested number of most relevant tools to solve that task's user question. Just return the TOOL NAMES for each task, together with the task number."""
+
+# The schemas are static, the number of tools is requested in the prompt and fixed locally by `_fit_tool_names`
+class FinalToolNames(BaseModel):
+    tool_names: List[str] = Field(
+        description="The list of exact final tool names after reranking."
+    )
+
+class RerankResult(BaseModel):
+    task_number: int = Field(description="The number of the task these tool names belong to.")
+    tool_names: List[str] = Field(
+        description="The list of exact final tool names after reranking for this task."
+    )
+
+class BatchFinalToolNames(BaseModel):
+    results: List[RerankResult] = Field(description="The reranked tool names for every task, one entry per task.")
 
 class RerankerMultiQueryExpansionVariations(BaseARTFModules):
+    """Reranks the tools retrieved for a query and its expansions down to the top k with an LLM.
+
+    With `cross_encoder_model_name` (requires `sentence-transformers`), a local cross-encoder first scores
+    every retrieved tool against the query and only the best `n_prefiltered` (default 2 * top_k) reach the LLM.
+    """
     def __init__(
         self,
         llm: ChatOpenAI,
         top_k: int,
-        multi_query_expansion_variation_module: MultiQueryExpansionModule
+        multi_query_expansion_variation_module: MultiQueryExpansionModule,
+        semantic_cache: Optional[SemanticCache] = None,
+        cache_control: bool = False,
+        cross_encoder_model_name: Optional[str] = None,
+        n_prefiltered: Optional[int] = None
     ):
         self.top_k = top_k
         self.multi_query_expansion_variation_module = multi_query_expansion_variation_module
-        super().__init__(llm=llm)
+        self.n_prefiltered = n_prefiltered or 2 * top_k
+        self.cross_encoder = None
+        if cross_encoder_model_name:
+            from sentence_transformers import CrossEncoder  # optional dependency, only needed for the prefilter
+            self.cross_encoder = CrossEncoder(cross_encoder_model_name)
+        super().__init__(llm=llm, semantic_cache=semantic_cache, cache_control=cache_control)
+        self._batch_system_message = self._get_cached_system_message(BATCH_RERANK_SYSTEM_MESSAGE)
+        # top_k is fixed, so the closing instruction of the rerank prompt is built once
+        self._finalized_list_instruction = f"""=========
+Based on these results, rank the top {self.top_k} most relevant tools to solve the user question. Just return the {self.top_k} TOOL NAMES for each relevant tool.
+"""
         self._initialize_structured_llm()
 
     def _initialize_structured_llm(self):
-        class FinalToolNames(BaseModel):
-            tool_names: Annotated[
-                List[str],
-                Field(
-                    description=f"The list of {self.top_k} exact final tool names after reranking.",
-                    min_length=self.top_k,
-                    max_length=self.top_k
-                )
-            ]
-        self.structured_llm = self.llm.with_structured_output(FinalToolNames)
+        # Strict JSON schema decoding guarantees the shape
+        self.structured_llm = self.llm.with_structured_output(FinalToolNames, method="json_schema", strict=True)
+        self.structured_batch_llm = self.llm.with_structured_output(BatchFinalToolNames, method="json_schema", strict=True)
 
     def _format_documents(self, documents: List[Document]) -> str:
-        formatted_list = []
-        for doc in documents:
-            tool_name = doc.metadata.get('tool_name', 'Unknown')
-            tool_description = doc.page_content
-            formatted_list.append(f"""-------\nTOOL NAME: {tool_name}\nTOOL DESCRIPTION & USEFUL DETAILS: {tool_description}""")
-        return "\n".join(formatted_list)
+        return "\n".join(
+            f"{TOOL_ENTRY_PREFIX}{doc.metadata.get('tool_name', 'Unknown')}\nTOOL DESCRIPTION & USEFUL DETAILS: {doc.page_content}"
+            for doc in documents
+        )
+
+    def _format_candidates(
+        self,
+        user_question_results: Optional[List[Document]],
+        sentence_results: List[List[Document]],
+        described_tool_names: Optional[Set[str]] = None
+    ) -> str:
+        """Lists every retrieved tool once, annotated with the queries that retrieved it and at which rank.
+
+        When several tasks or intents share one prompt, pass the same `described_tool_names` set to every
+        call: a tool already described earlier in the prompt is then listed by name only.
+        """
+        # The user question itself is optional, its expansions usually already cover its retrievals
+        sources = [] if user_question_results is None else [("USER QUESTION", user_question_results)]
+        sources += [(f"SENTENCE {idx}", sentence_result) for idx, sentence_result in enumerate(sentence_results, start=1)]
+
+        candidates: Dict[str, Document] = {}
+        appearances: Dict[str, List[str]] = {}
+        for source, documents in sources:
+            for rank, doc in enumerate(documents, start=1):
+                tool_name = doc.metadata.get('tool_name', 'Unknown')
+                candidates.setdefault(tool_name, doc)
+                appearances.setdefault(tool_name, []).append(f"{source} (rank {rank})")
+
+        formatted_candidates = []
+        for tool_name, doc in candidates.items():
+            if described_tool_names is None or tool_name not in described_tool_names:
+                tool_description = doc.page_content
+            else:
+                tool_description = "SAME AS ABOVE"
+            if described_tool_names is not None:
+                described_tool_names.add(tool_name)
+            formatted_candidates.append(f"{TOOL_ENTRY_PREFIX}{tool_name}\nRETRIEVED BY: {', '.join(appearances[tool_name])}\nTOOL DESCRIPTION & USEFUL DETAILS: {tool_description}")
+        return "\n".join(formatted_candidates)
+
+    def _candidate_tool_names(
+        self,
+        user_question_results: Optional[List[Document]],
+        sentence_results: List[List[Document]]
+    ) -> List[str]:
+        """Retrieved tool names ordered by their best rank over all queries, ties kept in retrieval order."""
+        sources = ([] if user_question_results is None else [user_question_results]) + list(sentence_results)
+        best_rank: Dict[str, int] = {}
+        for documents in sources:
+            for rank, doc in enumerate(documents):
+                tool_name = doc.metadata.get('tool_name', 'Unknown')
+                best_rank[tool_name] = min(rank, best_rank.get(tool_name, rank))
+        return sorted(best_rank, key=best_rank.get)
+
+    def prefilter_items(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Keeps the `n_prefiltered` tools of each item that the cross-encoder scores highest against its user question.
+
+        Each item holds the keyword arguments of `generate`. All (question, tool) pairs are scored in one batch.
+        Returns the items unchanged when no cross-encoder is configured.
+        """
+        if self.cross_encoder is None:
+            return items
+        candidates_per_item: List[Dict[str, Document]] = []
+        for item in items:
+            candidates: Dict[str, Document] = {}
+            for documents in [item.get("user_question_results") or [], *item["sentence_results"]]:
+                for doc in documents:
+                    candidates.setdefault(doc.metadata.get('tool_name', 'Unknown'), doc)
+            candidates_per_item.append(candidates)
+
+        pairs = [(item["user_question"], doc.page_content) for item, candidates in zip(items, candidates_per_item) for doc in candidates.values()]
+        scores_iter = iter(self.cross_encoder.predict(pairs).tolist() if pairs else [])
+
+        prefiltered_items = []
+        for item, candidates in zip(items, candidates_per_item):
+            scores = {tool_name: next(scores_iter) for tool_name in candidates}
+            kept = set(sorted(scores, key=scores.get, reverse=True)[:self.n_prefiltered])
+            keep = lambda documents: [doc for doc in documents if doc.metadata.get('tool_name', 'Unknown') in kept]
+            prefiltered_items.append({
+                **item,
+                "user_question_results": None if item.get("user_question_results") is None else keep(item["user_question_results"]),
+                "sentence_results": [keep(documents) for documents in item["sentence_results"]]
+            })
+        return prefiltered_items
+
+    async def aprefilter_items(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Asynchronous `prefilter_items`, the CPU-bound scoring runs in a worker thread."""
+        if self.cross_encoder is None:
+            return items
+        return await asyncio.to_thread(self.prefilter_items, items)
 
     def _get_finalized_list_thoughts_messages(
         self,
         user_question: str,
         ai_response: str,
-        user_question_results: List[Document],
+        user_question_results: Optional[List[Document]],
         sentence_results: List[List[Document]]
     ):
-        # Build the dynamic prompt based on the number of sentences
-        sentences_section = ""
-        for idx, sentence_result in enumerate(sentence_results, start=1):
-            sentences_section += f"SENTENCE {idx} EMBEDDED AND RETRIEVED TOOLS:\n{self._format_documents(documents=sentence_result)}\n================\n"
-        
-        finalized_list_thoughts = f"""OK here are the results:
-USER QUESTION EMBEDDED AND RETRIEVED TOOLS:
-{self._format_documents(documents=user_question_results)}
-{sentences_section}
-=========
-Based on these results, rank the top {self.top_k} most relevant tools to solve the user question. Just return the {self.top_k} TOOL NAMES for each relevant tool.
-"""
-        ai_response_prompt = "{ai_response}"
-
+        # Each retrieved tool is listed once, with the sentences that retrieved it
+        finalized_list_thoughts = f"""OK here are the results, the unique tools retrieved by embedding the sentences:
+{self._format_candidates(user_question_results=user_question_results, sentence_results=sentence_results)}
+{self._finalized_list_instruction}"""
         # Get the sentence extraction prompt from the multi_query_expansion_variation_module
         sentence_extraction_messages = self.multi_query_expansion_variation_module._get_expansion_messages(user_question=user_question)
 
-        chat_template = ChatPromptTemplate.from_messages(
-            [
-                *sentence_extraction_messages,
-                AIMessagePromptTemplate.from_template(ai_response_prompt),
-                HumanMessagePromptTemplate.from_template(finalized_list_thoughts)
-            ]
-        )
-
-        messages = chat_template.format_messages(ai_response=ai_response)
-
-        return messages
+        return [
+            *sentence_extraction_messages,
+            AIMessage(content=str(ai_response)),
+            HumanMessage(content=finalized_list_thoughts)
+        ]
 
+    @semantic_cached(query_arg="user_question")
     def generate(
         self,
         user_question: str,
         ai_response: str,
-        user_question_results: List[Document],
+        user_question_results: Optional[List[Document]],
         sentence_results: List[List[Document]] # Ensure these the same order as the sentences
     ) -> List[Document]:
+        if self.cross_encoder is not None:
+            item = self.prefilter_items([{"user_question": user_question, "user_question_results": user_question_results, "sentence_results": sentence_results}])[0]
+            user_question_results, sentence_results = item["user_question_results"], item["sentence_results"]
+
         # Step 1: Get the expansion messages from the multi_query_expansion_variation_module
         expansion_messages = self.multi_query_expansion_variation_module._get_expansion_messages(user_question=user_question)
 
@@ -89,34 +204,35 @@ Based on these results, rank the top {self.top_k} most relevant tools to solve t
             sentence_results=sentence_results
         )
 
-        # Step 3: Invoke the structured LLM to get the top_k tool names
-        # Note: This is a simple way of handling errors. In production, more tests should be done to ensure the AI output tool name matches the python tool name.
+        # Step 3: Invoke the structured LLM to get the top_k tool names, only retrying on request errors
+        # since the answer is truncated or padded locally with the best remaining retrieved tools
+        candidate_tool_names = self._candidate_tool_names(user_question_results, sentence_results)
         attempts = 0
         max_attempts = 3
-        result = None
 
         while attempts < max_attempts:
             attempts += 1
             try:
                 result = self.structured_llm.invoke(messages)
-                if len(result.tool_names) == self.top_k:
-                    break
+                return self._fit_tool_names(result.tool_names, candidate_tool_names, self.top_k)
             except Exception as e:
                 pass  # Handle exceptions as needed
 
-        if result and len(result.tool_names) == self.top_k:
-            return result.tool_names
-        else:
-            # Fallback or error handling
-            return []
+        # Fallback or error handling
+        return []
 
+    @semantic_cached(query_arg="user_question")
     async def agenerate(
         self,
         user_question: str,
         ai_response: str,
-        user_question_results: List[Document],
+        user_question_results: Optional[List[Document]],
         sentence_results: List[List[Document]] # Ensure these the same order as the sentences
         ) -> List[Document]:
+        if self.cross_encoder is not None:
+            item = (await self.aprefilter_items([{"user_question": user_question, "user_question_results": user_question_results, "sentence_results": sentence_results}]))[0]
+            user_question_results, sentence_results = item["user_question_results"], item["sentence_results"]
+
         # Step 1: Get the expansion messages from the multi_query_expansion_variation_module
         expansion_messages = self.multi_query_expansion_variation_module._get_expansion_messages(user_question=user_question)
 
@@ -128,23 +244,89 @@ Based on these results, rank the top {self.top_k} most relevant tools to solve t
             sentence_results=sentence_results
         )
 
-        # Step 3: Invoke the structured LLM to get the top_k tool names
-        # Note: This is a simple way of handling errors. In production, more tests should be done to ensure the AI output tool name matches the python tool name.
+        # Step 3: Invoke the structured LLM to get the top_k tool names, only retrying on request errors
+        # since the answer is truncated or padded locally with the best remaining retrieved tools
+        candidate_tool_names = self._candidate_tool_names(user_question_results, sentence_results)
         attempts = 0
         max_attempts = 3
-        result = None
 
         while attempts < max_attempts:
             attempts += 1
             try:
                 result = await self.structured_llm.ainvoke(messages)
-                if len(result.tool_names) == self.top_k:
-                    break
+                return self._fit_tool_names(result.tool_names, candidate_tool_names, self.top_k)
+            except Exception as e:
+                pass  # Handle exceptions as needed
+
+        # Fallback or error handling
+        return []
+
+    def _get_batch_messages(self, items: List[Dict[str, Any]]):
+        # Decomposed queries often retrieve the same tools, each description is only written once
+        described_tool_names: Set[str] = set()
+        tasks_section = ""
+        for task_idx, item in enumerate(items, start=1):
+            tasks_section += f"""### Task {task_idx}
+USER QUESTION: {item["user_question"]}
+SENTENCE VARIATIONS: {item["ai_response"]}
+UNIQUE RETRIEVED TOOLS:
+{self._format_candidates(user_question_results=item.get("user_question_results"), sentence_results=item["sentence_results"], described_tool_names=described_tool_names)}
+
+"""
+
+        human_message = f"""NUMBER OF TASKS: {len(items)}
+NUMBER OF TOOLS TO RETURN PER TASK: {self.top_k}
+
+{tasks_section}=========
+Based on these results, return the top {self.top_k} TOOL NAMES for each of the {len(items)} tasks."""
+
+        return self._build_messages(human_message, self._batch_system_message)
+
+    def _parse_batch_result(self, result, items: List[Dict[str, Any]]) -> List[List[str]]:
+        # A task missing from the answer falls back to its best retrieved tools
+        tool_names_by_task = {r.task_number: r.tool_names for r in result.results}
+        return [
+            self._fit_tool_names(
+                tool_names_by_task.get(task_number, []),
+                self._candidate_tool_names(item.get("user_question_results"), item["sentence_results"]),
+                self.top_k
+            )
+            for task_number, item in enumerate(items, start=1)
+        ]
+
+    def generate_batch(self, items: List[Dict[str, Any]]) -> List[List[str]]:
+        """Reranks several decomposed queries in one LLM call.
+
+        Each item holds the keyword arguments of `generate`. Returns the tool names in the same order as `items`.
+        """
+        items = self.prefilter_items(items)
+        messages = self._get_batch_messages(items)
+
+        attempts = 0
+        max_attempts = 3
+
+        while attempts < max_attempts:
+            attempts += 1
+            try:
+                return self._parse_batch_result(self.structured_batch_llm.invoke(messages), items)
+            except Exception as e:
+                pass  # Handle exceptions as needed
+
+        return [[] for _ in items]
+
+    async def agenerate_batch(self, items: List[Dict[str, Any]]) -> List[List[str]]:
+        """Asynchronously reranks several decomposed queries in one LLM call."""
+        items = await self.aprefilter_items(items)
+        messages = self._get_batch_messages(items)
+
+        attempts = 0
+        max_attempts = 3
+
+        while attempts < max_attempts:
+            attempts += 1
+            try:
+                return self._parse_batch_result(await self.structured_batch_llm.ainvoke(messages), items)
             except Exception as e:
                 pass  # Handle exceptions as needed
 
-        if result and len(result.tool_names) == self.top_k:
-            return result.tool_names
-        else:
-            # Fallback or error handling
-            return []
+        return [[] for _ in items]
@@ -1,42 +1,31 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
 from abc import ABC, abstractmethod
-from langchain_openai import ChatOpenAI,OpenAIEmbeddings
+from langchain_core.messages import SystemMessage
 from intra_retrieval.base_artf_module import BaseARTFModules
+from pre_retrieval.response_cache import SemanticCache, semantic_cached
 from pydantic import BaseModel, Field
+import itertools
+import numpy as np
 
-class RerankerDecomposedQueries(BaseARTFModules):
-    def __init__(self, llm: AzureChatOpenAI, final_top_k: int):
-        self.final_top_k = final_top_k
-        super().__init__(llm=llm)
-        self._initialize_structured_llm()
-
-    def _initialize_structured_llm(self):
-        class FinalToolNames(BaseModel):
-            tool_names: List[str] = Field(
-                ...,
-                description=f"The list of {self.final_top_k} exact final tool names after reranking.",
-                min_length=self.final_top_k,
-                max_length=self.final_top_k
-            )
-        self.structured_llm = self.llm.with_structured_output(FinalToolNames)
+try:
+    import numba
+except ImportError:  # optional, only speeds up `assign_overlapping_tools`
+    numba = None
 
-    def _get_final_combined_thoughts_messages(
-        self,
-        user_question: str,
-        list_of_intents: List[str],
-        list_of_list_of_tools: List[List[str]]
-    ):
-        num_intents = len(list_of_intents)
-        top_k_per_intent = len(list_of_list_of_tools[0])
-        num_tools_divisible_by_intent = max(1, self.final_top_k // num_intents)
-        num_tools_divisible_by_intent_text = f"{num_tools_divisible_by_intent} tools" if num_tools_divisible_by_intent > 1 else f"{num_tools_divisible_by_intent} tool"
+if TYPE_CHECKING:
+    # type hints only, langchain_openai is slow to import
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 
-        final_combined_thoughts = f"""You are an expert at combining and narrowing down the top tools from each user intent to a single unique list of {self.final_top_k} tools that solve the user question.
-You will be given a user query that has been broken down into {num_intents} distinct user intents.
-You are also given the {top_k_per_intent} most relevant tools for each intent that can solve that particular intent, which ARE IN ORDER OF RELEVANCE!
-Your task is to combine the top {top_k_per_intent} tools from each intent into a single unique list of {self.final_top_k} tools that are most relevant to the user question, which can solve the entire {num_intents}-step process.
-Your first approach should be to take the top {num_tools_divisible_by_intent_text} from each intent and then add the next most relevant tool(s) from the intents until you have a unique list of {self.final_top_k} tools.
+# Static few-shot prefix, kept byte-identical across calls so providers can cache it;
+# the number of intents and of final tools are given in the human message
+DECOMPOSED_QUERIES_COMBINER_SYSTEM_MESSAGE = """You are an expert at combining and narrowing down the top tools from each user intent to a single unique list of tools that solve the user question.
+You will be given a user query that has been broken down into distinct user intents, and the number of final tools to return.
+You are also given the most relevant tools for each intent that can solve that particular intent, which ARE IN ORDER OF RELEVANCE!
+Your task is to combine the top tools from each intent into a single unique list of final tools that are most relevant to the user question, which can solve the entire multi-step process.
+Your first approach should be to take the top N tools from each intent, where N is the number of final tools divided by the number of intents (at least 1), and then add the next most relevant tool(s) from the intents until you have a unique list of the requested number of final tools.
 However, one important thing to note is that there may be overlap between the tools from each intent, this is because of our retrieval process.
-If there are overlapping tools within each top {num_tools_divisible_by_intent_text}, first understand which top {num_tools_divisible_by_intent_text} are most relevant to their respective intents, and then go to the other intents and add the next most {num_tools_divisible_by_intent} relevant tools.
+If there are overlapping tools within each top N tools, first understand which top N tools are most relevant to their respective intents, and then go to the other intents and add the next most N relevant tools.
 
 Here is an example with no overlapping tools (with 2 distinct user intents and 3 tools per intent, and a final top k of 3):
 ---------
@@ -63,127 +52,230 @@ LIST OF TOOLS FOR INTENT 4: ['get_dividend_payout_ratio', 'get_retention_ratio',
 THE APPROACH TO TAKE:
 First, identify the top 2 tools for Intent 1 is 'get_return_on_equity' and 'get_net_profit_margin'. The top 2 tools for Intent 2 are 'get_return_on_assets' and 'get_return_on_equity'. The top 2 tools for Intent 3 are 'get_debt_ratio' and 'get_debt_to_equity_ratio'. The top 2 tools for intent 4 are 'get_dividend_payout_ratio' and 'get_retention_ratio'. Since there is an overlap between Intent 1 and Intent 2 'get_return_on_equity' and 'get_return_on_assets', we need to understand which intent these 2 tools should be counted for. Considering Intent 1 is very much related to return on equity, we can count 'get_return_on_equity' there. Then we go to Intent 2 and add the next 1 tool which is 'get_net_profit_margin'. Since there is no more overlap, this gives us a unique list of 8 tools that are most relevant to the entire user question. So we can choose 2 more tools which is the most relevant from the list. The last two tools we will choose is 'get_total_debt' and 'get_dividend_yield', since they are relevant in the third slot to their respective intents.Now we have successfully built a unique list of 10 tools.
 
-Final unique list of {self.final_top_k} tools: ['get_return_on_equity', 'get_return_on_assets', 'get_debt_ratio', 'get_dividend_payout_ratio', 'get_net_profit_margin'].
+Final unique list of tools: ['get_return_on_equity', 'get_return_on_assets', 'get_debt_ratio', 'get_dividend_payout_ratio', 'get_net_profit_margin'].
 ---------
 YOUR TURN:
 """
 
-        # Build the human prompt
-        human_combiner_prompt = f"USER QUESTION: '{user_question}'\n"
-        for idx, intent in enumerate(list_of_intents, start=1):
-            human_combiner_prompt += f"INTENT {idx}: '{intent}'\n"
-            human_combiner_prompt += f"LIST OF TOOLS FOR INTENT {idx}: {list_of_list_of_tools[idx-1]}\n"
-        human_combiner_prompt += f"THE APPROACH TO TAKE AND {self.final_top_k} FINAL UNIQUE TOOLS:"
-
-        # Create the chat template
-        final_thoughts_chat_template = ChatPromptTemplate.from_messages(
-            [
-                SystemMessagePromptTemplate.from_template(final_combined_thoughts),
-                HumanMessagePromptTemplate.from_template(human_combiner_prompt)
-            ]
-        )
+# The schema is static, the number of tools is requested in the prompt and fixed locally by `_fit_tool_names`
+class FinalToolNames(BaseModel):
+    # Reasoning comes first so the model thinks through the approach before committing to the tools
+    reasoning: str = Field(description="The approach to take to combine the tools of each intent, step by step.")
+    tool_names: List[str] = Field(
+        ...,
+        description="The list of exact final tool names after reranking."
+    )
 
-        # Format the messages
-        final_thoughts_messages = final_thoughts_chat_template.format_messages()
+def assign_overlapping_tools(similarities: np.ndarray, retrieved_by: np.ndarray, margin: float) -> np.ndarray:
+    """Assigns each tool to the intent it is most similar to, among the intents that retrieved it.
 
-        return final_thoughts_messages
+    `similarities` and `retrieved_by` are (n_tools, n_intents). Returns the intent index of every tool,
+    or -1 when the best intent does not beat the runner-up by at least `margin`.
+    """
+    if numba is not None:
+        return _assign_overlapping_tools_jit(np.ascontiguousarray(similarities, dtype=np.float32), np.ascontiguousarray(retrieved_by, dtype=np.bool_), margin)
+    scores = np.where(retrieved_by, similarities, -np.inf)
+    order = np.argsort(-scores, axis=1)
+    best = np.take_along_axis(scores, order[:, :1], axis=1)[:, 0]
+    runner_up = np.take_along_axis(scores, order[:, 1:2], axis=1)[:, 0]
+    return np.where(best - runner_up >= margin, order[:, 0], -1)
+
+if numba is not None:
+    # A single pass per tool instead of a masked copy and an argsort; the arrays are tiny, so the
+    # loop is kept serial and compiled once per machine (cache=True)
+    @numba.njit(cache=True)
+    def _assign_overlapping_tools_jit(similarities: np.ndarray, retrieved_by: np.ndarray, margin: float) -> np.ndarray:
+        n_tools, n_intents = similarities.shape
+        assignments = np.full(n_tools, -1, dtype=np.int64)
+        for tool_idx in range(n_tools):
+            best, runner_up, best_intent = -np.inf, -np.inf, -1
+            for intent_idx in range(n_intents):
+                if not retrieved_by[tool_idx, intent_idx]:
+                    continue
+                score = similarities[tool_idx, intent_idx]
+                if score > best:
+                    best, runner_up, best_intent = score, best, intent_idx
+                elif score > runner_up:
+                    runner_up = score
+            if best - runner_up >= margin:
+                assignments[tool_idx] = best_intent
+        return assignments
+
+class RerankerDecomposedQueries(BaseARTFModules):
+    """Combines the reranked tools of every decomposed query into the final top k.
 
-    def _get_structured_prompt_after_first_response(
+    When an `embedder` is given, tools retrieved by several intents are first assigned to their closest
+    intent by cosine similarity. If every overlap is clear-cut, the final list is built deterministically
+    and the LLM is only called for the ambiguous cases.
+    """
+    def __init__(
         self,
-        ai_response: str
+        llm: AzureChatOpenAI,
+        final_top_k: int,
+        semantic_cache: Optional[SemanticCache] = None,
+        cache_control: bool = False,
+        embedder: Optional[OpenAIEmbeddings] = None,
+        assignment_margin: float = 0.02
     ):
-        human_structured = f"""Return ONLY the {self.final_top_k} final list of unique tools in a structured list format. As an example: ['tool_1', 'tool_2', 'tool_3', 'tool_4', 'tool_5']
-Do not include any other information such as your reasoning or context.
-Just the {self.final_top_k} final combined tools."""
-
-        # Build the chat template with the AI response and the human instruction
-        human_final_chat_template = ChatPromptTemplate.from_messages(
-            [
-                AIMessage(content=ai_response),
-                HumanMessage(content=human_structured)
-            ]
-        )
-        human_final_chat_message = human_final_chat_template.format_messages()
-        return human_final_chat_message
+        self.final_top_k = final_top_k
+        self.assignment_margin = assignment_margin
+        super().__init__(llm=llm, embedder=embedder, semantic_cache=semantic_cache, cache_control=cache_control)
+        self._system_message = self._get_cached_system_message(DECOMPOSED_QUERIES_COMBINER_SYSTEM_MESSAGE)
+        self._initialize_structured_llm()
+
+    def _initialize_structured_llm(self):
+        # Strict JSON schema decoding guarantees the shape
+        self.structured_llm = self.llm.with_structured_output(FinalToolNames, method="json_schema", strict=True)
+
+    @staticmethod
+    def _candidate_tool_names(list_of_list_of_tools: List[List[str]]) -> List[str]:
+        """The tools of every intent interleaved by rank: the top tool of each intent first, then the second, ..."""
+        return [tool_name for tools_at_rank in itertools.zip_longest(*list_of_list_of_tools) for tool_name in tools_at_rank if tool_name is not None]
+
+    def _get_overlapping_tools(self, list_of_list_of_tools: List[List[str]]) -> Tuple[List[str], np.ndarray]:
+        """The tools retrieved by more than one intent, with a (n_tools, n_intents) mask of the intents that retrieved them."""
+        retrieved_by: Dict[str, Set[int]] = {}
+        for intent_idx, tools in enumerate(list_of_list_of_tools):
+            for tool_name in tools:
+                retrieved_by.setdefault(tool_name, set()).add(intent_idx)
+        overlapping_tools = [tool_name for tool_name, intent_ids in retrieved_by.items() if len(intent_ids) > 1]
+        mask = np.zeros((len(overlapping_tools), len(list_of_list_of_tools)), dtype=bool)
+        for row, tool_name in enumerate(overlapping_tools):
+            mask[row, list(retrieved_by[tool_name])] = True
+        return overlapping_tools, mask
 
+    def _combine_assigned(
+        self,
+        list_of_list_of_tools: List[List[str]],
+        overlapping_tools: List[str],
+        retrieved_by: np.ndarray,
+        embeddings: Optional[List[List[float]]]
+    ) -> Optional[List[str]]:
+        owners: Dict[str, int] = {}
+        if overlapping_tools:
+            vectors = np.asarray(embeddings, dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            # cosine similarity of every overlapping tool (rows) with every intent (columns)
+            similarities = vectors[:len(overlapping_tools)] @ vectors[len(overlapping_tools):].T
+            assignments = assign_overlapping_tools(similarities, retrieved_by, self.assignment_margin)
+            if (assignments < 0).any():
+                return None  # ambiguous overlap, left to the LLM
+            owners = dict(zip(overlapping_tools, assignments.tolist()))
+
+        # with disjoint lists, taking the tools by rank across intents is the top N of each intent, then the next ones
+        disjoint_tools = [
+            [tool_name for tool_name in tools if owners.get(tool_name, intent_idx) == intent_idx]
+            for intent_idx, tools in enumerate(list_of_list_of_tools)
+        ]
+        final_tool_names = list(dict.fromkeys(self._candidate_tool_names(disjoint_tools)))[:self.final_top_k]
+        return final_tool_names if len(final_tool_names) == self.final_top_k else None
+
+    def _embedding_texts(self, list_of_intents: List[str], overlapping_tools: List[str]) -> List[str]:
+        return [tool_name.replace("_", " ") for tool_name in overlapping_tools] + list(list_of_intents)
+
+    def _combine_deterministically(self, list_of_intents: List[str], list_of_list_of_tools: List[List[str]]) -> Optional[List[str]]:
+        """The final tools when every overlap between intents is clear-cut, else None."""
+        overlapping_tools, retrieved_by = self._get_overlapping_tools(list_of_list_of_tools)
+        embeddings = self.embedder.embed_documents(self._embedding_texts(list_of_intents, overlapping_tools)) if overlapping_tools else None
+        return self._combine_assigned(list_of_list_of_tools, overlapping_tools, retrieved_by, embeddings)
+
+    async def _acombine_deterministically(self, list_of_intents: List[str], list_of_list_of_tools: List[List[str]]) -> Optional[List[str]]:
+        overlapping_tools, retrieved_by = self._get_overlapping_tools(list_of_list_of_tools)
+        embeddings = await self.embedder.aembed_documents(self._embedding_texts(list_of_intents, overlapping_tools)) if overlapping_tools else None
+        return self._combine_assigned(list_of_list_of_tools, overlapping_tools, retrieved_by, embeddings)
+
+    def _get_final_combined_thoughts_messages(
+        self,
+        user_question: str,
+        list_of_intents: List[str],
+        list_of_list_of_tools: List[List[str]]
+    ):
+        num_intents = len(list_of_intents)
+        top_k_per_intent = len(list_of_list_of_tools[0])
+        num_tools_divisible_by_intent = max(1, self.final_top_k // num_intents)
+        num_tools_divisible_by_intent_text = f"{num_tools_divisible_by_intent} tools" if num_tools_divisible_by_intent > 1 else f"{num_tools_divisible_by_intent} tool"
+
+        # Build the human prompt, it holds everything that changes between calls
+        human_combiner_prompt = f"NUMBER OF INTENTS: {num_intents}\n"
+        human_combiner_prompt += f"NUMBER OF TOOLS PER INTENT: {top_k_per_intent}\n"
+        human_combiner_prompt += f"TOP TOOLS TO TAKE FROM EACH INTENT FIRST (N): {num_tools_divisible_by_intent_text}\n"
+        human_combiner_prompt += f"NUMBER OF FINAL UNIQUE TOOLS: {self.final_top_k}\n"
+        human_combiner_prompt += f"USER QUESTION: '{user_question}'\n"
+        for idx, intent in enumerate(list_of_intents, start=1):
+            human_combiner_prompt += f"INTENT {idx}: '{intent}'\n"
+            human_combiner_prompt += f"LIST OF TOOLS FOR INTENT {idx}: {list_of_list_of_tools[idx-1]}\n"
+        human_combiner_prompt += f"THE APPROACH TO TAKE (reasoning) AND {self.final_top_k} FINAL UNIQUE TOOLS (tool_names):"
+
+        return self._build_messages(human_combiner_prompt)
+
+    @semantic_cached(query_arg="user_question")
     def generate(
         self,
         user_question: str,
         list_of_intents: List[str],
         list_of_list_of_tools: List[List[str]]
     ) -> List[str]:
+        if self.embedder is not None:
+            final_tool_names = self._combine_deterministically(list_of_intents, list_of_list_of_tools)
+            if final_tool_names:
+                return final_tool_names
+
+        # Step 1: Prepare the initial messages
+        messages = self._get_final_combined_thoughts_messages(
+            user_question=user_question,
+            list_of_intents=list_of_intents,
+            list_of_list_of_tools=list_of_list_of_tools
+        )
+        candidate_tool_names = self._candidate_tool_names(list_of_list_of_tools)
+
         attempts = 0
         max_attempts = 3
-        result = None
 
         while attempts < max_attempts:
             attempts += 1
             try:
-                # Step 1: Prepare the initial messages
-                messages = self._get_final_combined_thoughts_messages(
-                    user_question=user_question,
-                    list_of_intents=list_of_intents,
-                    list_of_list_of_tools=list_of_list_of_tools
-                )
-
-                # Step 2: Use the regular LLM to get the AI response
-                ai_response_content = (self.llm.invoke(messages)).content
-                #print(ai_response_content)
-                # Step 3: Prepare the structured prompt with the AI response
-                structured_messages = self._get_structured_prompt_after_first_response(
-                    ai_response=ai_response_content
-                )
-
-                # Step 4: Use the structured LLM to parse the AI response and get the structured output
-                result = self.structured_llm.invoke(structured_messages)
-                if len(list(set(result.tool_names))) == self.final_top_k:
-                    break
+                # Step 2: Use the structured LLM to reason and return the final tools in one call,
+                # truncated or padded locally with the next tools of each intent
+                result = self.structured_llm.invoke(messages)
+                return self._fit_tool_names(result.tool_names, candidate_tool_names, self.final_top_k)
             except Exception as e:
                 continue  # Handle exceptions as needed
 
-        if result and len(list(set(result.tool_names))) == self.final_top_k:
-            return result.tool_names
-        else:
-            # Fallback or error handling
-            return []
+        # Fallback or error handling
+        return []
 
+    @semantic_cached(query_arg="user_question")
     async def agenerate(
         self,
         user_question: str,
         list_of_intents: List[str],
         list_of_list_of_tools: List[List[str]]
     ) -> List[str]:
+        if self.embedder is not None:
+            final_tool_names = await self._acombine_deterministically(list_of_intents, list_of_list_of_tools)
+            if final_tool_names:
+                return final_tool_names
+
+        # Step 1: Prepare the initial messages
+        messages = self._get_final_combined_thoughts_messages(
+            user_question=user_question,
+            list_of_intents=list_of_intents,
+            list_of_list_of_tools=list_of_list_of_tools
+        )
+        candidate_tool_names = self._candidate_tool_names(list_of_list_of_tools)
+
         attempts = 0
         max_attempts = 3
-        result = None
 
         while attempts < max_attempts:
             attempts += 1
             try:
-                # Step 1: Prepare the initial messages
-                messages = self._get_final_combined_thoughts_messages(
-                    user_question=user_question,
-                    list_of_intents=list_of_intents,
-                    list_of_list_of_tools=list_of_list_of_tools
-                )
-
-                # Step 2: Use the regular LLM to get the AI response
-                ai_response_content = (await self.llm.ainvoke(messages)).content
-                #print(ai_response_content)
-                # Step 3: Prepare the structured prompt with the AI response
-                structured_messages = self._get_structured_prompt_after_first_response(
-                    ai_response=ai_response_content
-                )
-
-                # Step 4: Use the structured LLM to parse the AI response and get the structured output
-                result = await self.structured_llm.ainvoke(structured_messages)
-                if len(list(set(result.tool_names))) == self.final_top_k:
-                    break
+                # Step 2: Use the structured LLM to reason and return the final tools in one call,
+                # truncated or padded locally with the next tools of each intent
+                result = await self.structured_llm.ainvoke(messages)
+                return self._fit_tool_names(result.tool_names, candidate_tool_names, self.final_top_k)
             except Exception as e:
                 continue  # Handle exceptions as needed
 
-        if result and len(list(set(result.tool_names))) == self.final_top_k:
-            return result.tool_names
-        else:
-            # Fallback or error handling
-            return []
+        # Fallback or error handling
+        return []
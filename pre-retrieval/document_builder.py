@@ -1,7 +1,25 @@
 from abc import ABC, abstractmethod
 from langchain.schema.document import Document
 import re
-from typing import Dict, Any, List, Optional
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Any, List, Optional
+
+# Position before every uppercase letter except the first character (CamelCase and mixedCase boundaries)
+CAMEL_CASE_BOUNDARY_PATTERN = re.compile(r'(?<!^)(?=[A-Z])')
+
+def format_tool_name_for_embedding(tool_name: str) -> str:
+    """
+    Formats the tool name for embedding by:
+    - Replacing underscores with spaces.
+    - Inserting spaces before uppercase letters (for CamelCase and mixedCase).
+    - Converting the result to title case.
+    """
+    name_with_spaces = tool_name.replace('_', ' ')
+    if not tool_name.islower():
+        # only names with uppercase letters have CamelCase boundaries to split
+        name_with_spaces = CAMEL_CASE_BOUNDARY_PATTERN.sub(' ', name_with_spaces)
+    return name_with_spaces.title()
 
 class BaseKnowledgeBaseBuilder(ABC):
     def __init__(self, toolshed_dict: Dict[str, Any]):
@@ -11,47 +29,55 @@ class BaseKnowledgeBaseBuilder(ABC):
     def build_documents(self, *args, **kwargs) -> List[Document]:
         pass
 
+class ToolEntry:
+    """The parts of a tool's document that only depend on the tool, computed once per tool."""
+    __slots__ = ('name_for_embedding', 'description', 'args_schema')
+
+    def __init__(self, name_for_embedding: str, description: str, args_schema: str):
+        self.name_for_embedding = name_for_embedding
+        self.description = description
+        self.args_schema = args_schema
+
+def _build_args_schema(tool_object: Any) -> str:
+    args_schema = getattr(tool_object, 'args_schema', None)
+    # Read the declared fields directly instead of materializing the full JSON schema
+    fields = getattr(args_schema, 'model_fields', None) or getattr(args_schema, '__fields__', None)
+    if not fields:
+        return ''
+    parameters = []
+    for name, field in fields.items():
+        # pydantic v1 keeps title and description on `field_info`, v2 on the field itself
+        field_info = getattr(field, 'field_info', field)
+        # same default title as the JSON schema, e.g. 'cash_flows' -> 'Cash Flows'
+        title = field_info.title or name.title().replace('_', ' ')
+        parameters.append(f"{title}: {field_info.description or ''}")
+    return ' '.join(parameters)
+
 class DocumentBuilder:
     def __init__(self, toolshed_dict: Dict[str, Any]):
         self.toolshed_dict = toolshed_dict
+        self._entries: Dict[str, ToolEntry] = {tool_name: self._build_entry(tool_name) for tool_name in toolshed_dict}
 
-    def _get_args_schema(self, tool_name: str) -> str:
+    def _build_entry(self, tool_name: str) -> ToolEntry:
         tool_object = self.toolshed_dict[tool_name]['tool_object']
-        try:
-            schema = tool_object.args_schema.schema()
-            parameters = []
-            for key, value in schema['properties'].items():
-                parameters.append(f"{value['title']}: {value['description']}")
-            return ' '.join(parameters)
-        except AttributeError:
-            return ''
-
-    def _get_hypothetical_questions(self, tool_name: str, hypothetical_questions_dict: Dict[str, List[str]]) -> str:
-        questions = hypothetical_questions_dict.get(tool_name, [])
-        return ' '.join(questions)
-
-    def _get_key_topics(self, tool_name: str, key_topics_dict: Dict[str, List[str]]) -> str:
-        topics = key_topics_dict.get(tool_name, [])
-        return ' '.join(topics)
+        return ToolEntry(format_tool_name_for_embedding(tool_name), tool_object.description, _build_args_schema(tool_object))
+
+    def _get_entry(self, tool_name: str) -> ToolEntry:
+        entry = self._entries.get(tool_name)
+        if entry is None:
+            # tool added to the toolshed after the builder was created
+            entry = self._entries[tool_name] = self._build_entry(tool_name)
+        return entry
+
+    def _get_args_schema(self, tool_name: str) -> str:
+        return self._get_entry(tool_name).args_schema
 
     def _format_tool_name_for_embedding(self, tool_name: str) -> str:
-        """
-        Formats the tool name for embedding by:
-        - Replacing underscores with spaces.
-        - Inserting spaces before uppercase letters (for CamelCase and mixedCase).
-        - Converting the result to title case.
-        """
-        # Replace underscores with spaces
-        name_with_spaces = tool_name.replace('_', ' ')
-        # Insert spaces before uppercase letters (excluding the first character)
-        name_with_spaces = re.sub(r'(?<!^)(?=[A-Z])', ' ', name_with_spaces)
-        # Convert to title case
-        tool_name_for_embedding = name_with_spaces.title()
-        return tool_name_for_embedding
-
-    def build_document(
+        """The tool name formatted by `format_tool_name_for_embedding`, precomputed for every tool of the toolshed."""
+        return self._get_entry(tool_name).name_for_embedding
+
+    def get_component_getters(
         self,
-        tool_name: str,
         include_name: bool = True,
         include_description: bool = True,
         include_args_schema: bool = False,
@@ -59,50 +85,84 @@ class DocumentBuilder:
         include_key_topics: bool = False,
         hypothetical_questions_dict: Optional[Dict[str, List[str]]] = None,
         key_topics_dict: Optional[Dict[str, List[str]]] = None,
-    ) -> Document:
-        # Build the document content based on the specified components
-        content_parts = []
-
-        tool_data_dict = self.toolshed_dict[tool_name]
-        tool_description = tool_data_dict['tool_object'].description
+    ) -> List[Callable[[str], List[str]]]:
+        """Resolves the include flags once into the ordered getters of the enabled components.
 
+        Each getter returns the texts of its component for a tool name.
+        """
+        getters: List[Callable[[str], List[str]]] = []
         if include_name:
-            tool_name_for_embedding = self._format_tool_name_for_embedding(tool_name)
-            content_parts.append(tool_name_for_embedding)
+            getters.append(lambda tool_name: [self._get_entry(tool_name).name_for_embedding])
         if include_description:
-            content_parts.append(tool_description)
+            getters.append(lambda tool_name: [self._get_entry(tool_name).description])
         if include_args_schema:
-            args_schema = self._get_args_schema(tool_name)
-            if args_schema:
-                content_parts.append(args_schema)
+            getters.append(lambda tool_name: [self._get_entry(tool_name).args_schema])
         if include_hypothetical_questions:
             if hypothetical_questions_dict is None:
                 raise ValueError("hypothetical_questions_dict must be provided when include_hypothetical_questions is True")
-            questions_text = self._get_hypothetical_questions(tool_name, hypothetical_questions_dict)
-            if questions_text:
-                content_parts.append(questions_text)
+            getters.append(lambda tool_name: hypothetical_questions_dict.get(tool_name, []))
         if include_key_topics:
             if key_topics_dict is None:
                 raise ValueError("key_topics_dict must be provided when include_key_topics is True")
-            key_topics_text = self._get_key_topics(tool_name, key_topics_dict)
-            if key_topics_text:
-                content_parts.append(key_topics_text)
-
-        page_content = ' - '.join(content_parts)
-
+            getters.append(lambda tool_name: key_topics_dict.get(tool_name, []))
+        return getters
+
+    @staticmethod
+    def join_components(tool_name: str, component_getters: List[Callable[[str], List[str]]]) -> str:
+        """The text embedded for the tool: ' - ' between its non-empty components, single spaces between the
+        questions or topics of a component. Every piece goes into one list, joined once."""
+        pieces: List[str] = []
+        for get_component in component_getters:
+            texts = get_component(tool_name)
+            if not any(texts):
+                continue
+            if pieces:
+                pieces.append(' - ')
+            for i, text in enumerate(texts):
+                if i:
+                    pieces.append(' ')
+                pieces.append(text)
+        return ''.join(pieces)
+
+    def build_page_content(self, tool_name: str, **build_kwargs) -> str:
+        """The text embedded for the tool, `build_kwargs` select its components as in `get_component_getters`."""
+        return self.join_components(tool_name, self.get_component_getters(**build_kwargs))
+
+    @staticmethod
+    def to_document(tool_name: str, page_content: str) -> Document:
         metadata = {
             'tool_name': tool_name,
-            'tool_hash':'Not implemented yet',
+            # changes whenever the embedded text changes, so unchanged tools can reuse their cached embedding
+            'tool_hash': hashlib.blake2b(page_content.encode('utf-8'), digest_size=16).hexdigest(),
             # Add any other metadata you need
         }
 
         doc = Document(page_content=page_content, metadata=metadata)
         return doc
 
+    def build_document(self, tool_name: str, **build_kwargs) -> Document:
+        """Builds the tool's Document, `build_kwargs` select its components as in `build_page_content`."""
+        return self.to_document(tool_name, self.build_page_content(tool_name, **build_kwargs))
+
+# Set once per worker process by `_init_document_worker`, so the toolshed is pickled once per worker instead of per task
+_worker_component_getters: List[Callable[[str], List[str]]] = []
+
+def _init_document_worker(toolshed_dict: Dict[str, Any], build_kwargs: Dict[str, Any]):
+    global _worker_component_getters
+    _worker_component_getters = DocumentBuilder(toolshed_dict).get_component_getters(**build_kwargs)
+
+def _build_page_content_in_worker(tool_name: str) -> str:
+    # Only the text crosses the process boundary, plain strings pickle far cheaper than Documents
+    return DocumentBuilder.join_components(tool_name, _worker_component_getters)
+
 class ToolshedKnowledgeBaseBuilder(BaseKnowledgeBaseBuilder):
-    def __init__(self, toolshed_dict: Dict[str, Any]):
+    def __init__(self, toolshed_dict: Dict[str, Any], parallel_threshold: int = 500, max_workers: Optional[int] = None):
+        """Toolsheds with more than `parallel_threshold` tools are built across `max_workers` processes
+        (default: one per core); smaller ones are built in-process, where forking would cost more than it saves."""
         super().__init__(toolshed_dict)
         self.document_builder = DocumentBuilder(toolshed_dict)
+        self.parallel_threshold = parallel_threshold
+        self.max_workers = max_workers
 
     def build_documents(
         self,
@@ -118,17 +178,33 @@ class ToolshedKnowledgeBaseBuilder(BaseKnowledgeBaseBuilder):
         if not tool_names:
             tool_names = list(self.toolshed_dict.keys())
 
-        docs = []
-        for tool_name in tool_names:
-            doc = self.document_builder.build_document(
-                tool_name=tool_name,
-                include_name=include_name,
-                include_description=include_description,
-                include_args_schema=include_args_schema,
-                include_hypothetical_questions=include_hypothetical_questions,
-                include_key_topics=include_key_topics,
-                hypothetical_questions_dict=hypothetical_questions_dict,
-                key_topics_dict=key_topics_dict,
-            )
-            docs.append(doc)
+        build_kwargs = dict(
+            include_name=include_name,
+            include_description=include_description,
+            include_args_schema=include_args_schema,
+            include_hypothetical_questions=include_hypothetical_questions,
+            include_key_topics=include_key_topics,
+            hypothetical_questions_dict=hypothetical_questions_dict,
+            key_topics_dict=key_topics_dict,
+        )
+        if len(tool_names) > self.parallel_threshold:
+            with ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=_init_document_worker,
+                initargs=(self.toolshed_dict, build_kwargs)
+            ) as executor:
+                page_contents = executor.map(_build_page_content_in_worker, tool_names, chunksize=64)
+                return [DocumentBuilder.to_document(tool_name, page_content) for tool_name, page_content in zip(tool_names, page_contents)]
+
+        component_getters = self.document_builder.get_component_getters(**build_kwargs)
+        return [
+            DocumentBuilder.to_document(tool_name, DocumentBuilder.join_components(tool_name, component_getters))
+            for tool_name in tool_names
+        ]
+
+    def build_and_index(self, indexer, batch_size: Optional[int] = 64, **build_kwargs) -> List[Document]:
+        """Builds the documents (`build_kwargs` are passed to `build_documents`) and indexes them with
+        `indexer`, a `BaseVectorStoreIndexer`, which embeds all of them in batches of `batch_size`."""
+        docs = self.build_documents(**build_kwargs)
+        indexer.index_documents(docs, batch_size=batch_size)
         return docs
@@ -1,66 +1,24 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Type
+from abc import ABC, abstractmethod
 from langchain_core.prompts import ChatPromptTemplate,HumanMessagePromptTemplate, SystemMessagePromptTemplate, AIMessagePromptTemplate
 from langchain_core.messages import HumanMessage, AIMessage,SystemMessage
-
-class BaseToolDocumentEnhancementGenerator(ABC):
-    def __init__(self, llm: ChatOpenAI, n_items: int):
-        self.llm = llm
-        self.n_items = n_items
-        self.structured_llm = self._initialize_structured_llm()
-
-    @abstractmethod
-    def _initialize_structured_llm(self):
-        """Define the structured LLM with the appropriate output model."""
-        pass
-
-    @abstractmethod
-    def _get_system_message(self, **kwargs):
-        """Construct the system message for the prompt."""
-        pass
-
-    @abstractmethod
-    def _get_human_message(self, **kwargs):
-        """Construct the human message for the prompt."""
-        pass
-
-    def _get_messages(self, **kwargs):
-        system_message = self._get_system_message(**kwargs)
-        human_message = self._get_human_message(**kwargs)
-        chat_template = ChatPromptTemplate.from_messages(
-            [
-                SystemMessage(content=system_message),
-                HumanMessagePromptTemplate.from_template(human_message)
-            ]
-        )
-        messages = chat_template.format_messages()
-        return messages
-
-    
-    @abstractmethod
-    def generate(self, **kwargs):
-        """Abstract method for generating output."""
-        pass
-
-    @abstractmethod
-    async def agenerate(self, **kwargs):
-        """Abstract method for generating output asynchronously."""
-        pass
-
-class QuestionGenerator(BaseToolDocumentEnhancementGenerator):
-    def __init__(self, llm: ChatOpenAI, n_items: int):
-        super().__init__(llm, n_items)
-
-    def _initialize_structured_llm(self):
-        class GeneratedQuestions(BaseModel):
-            generated_questions: List[str] = Field(
-                description=f"{self.n_items} example questions that the function can answer."
-            )
-        return self.llm.with_structured_output(GeneratedQuestions)
-
-    def _get_system_message(self, **kwargs):
-        return f"""You are an expert at generating hypothetical questions that a given Python function can answer.
+from langchain_community.adapters.openai import convert_message_to_dict
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pre_retrieval.response_cache import DiskCache, cached
+import asyncio
+import io
+import json
+import time
+from pydantic import BaseModel, Field
+
+if TYPE_CHECKING:
+    # type hints only, langchain_openai is slow to import
+    from langchain_openai import ChatOpenAI
+
+# Static few-shot prefixes, kept byte-identical across calls so providers can cache them
+QUESTION_GENERATOR_STATIC_SYSTEM_MESSAGE = """You are an expert at generating hypothetical questions that a given Python function can answer.
 You are given the name of a function, its description, and its arguments.
-Your job is to do the following:
-1. Generate {self.n_items} example questions that the function can answer.
 
 The example questions should have roughly 50% questions that contain all of the arguments and read similar to a text-book type of question (What is the present value of $20,000 to be received in 10 years if the discount rate is 7%?).
 While 50% other questions are more abstract and focus on the function's utility and purpose -- and include no function arguments (ex. "I want to know the discount rate of a project with breakeven net present value").
@@ -144,52 +102,10 @@ Calculates the periodic loan payment required to amortize a loan using the formu
 - How does the interest rate impact the size of my loan payments?
 
 ---
+"""
 
-Take a deep breath and think through the problem step by step."""
-
-    def _get_human_message(self, tool_name: str, tool_description: str, tool_arguments: str):
-        return f"""FUNCTION NAME: `{tool_name}`
-FUNCTION DESCRIPTION: `{tool_description}`
-FUNCTION ARGUMENTS: `{tool_arguments}`
-
-{self.n_items} GENERATED QUESTIONS THAT THE FUNCTION CAN ANSWER:"""
-
-    def generate(self, tool_name: str, tool_description: str, tool_arguments: str) -> List[str]:
-        messages = self._get_messages(
-            tool_name=tool_name, 
-            tool_description=tool_description, 
-            tool_arguments=tool_arguments
-        )
-        result = self.structured_llm.invoke(messages)
-        return result.generated_questions
-
-    async def agenerate(self, tool_name: str, tool_description: str, tool_arguments: str) -> List[str]:
-        messages = self._get_messages(
-            tool_name=tool_name, 
-            tool_description=tool_description, 
-            tool_arguments=tool_arguments
-        )
-        result = await self.structured_llm.ainvoke(messages)  # Using async invoke
-        return result.generated_questions
-
-class KeyTopicGenerator(BaseToolDocumentEnhancementGenerator):
-    def __init__(self, llm: ChatOpenAI, n_items: int):
-        super().__init__(llm, n_items)
-
-    def _initialize_structured_llm(self):
-        class KeyTopics(BaseModel):
-            key_topics: List[str] = Field(
-                description=f"{self.n_items} key topics, themes, or intents that capture the overarching theme and topic of the questions."
-            )
-        return self.llm.with_structured_output(KeyTopics)
-
-    
-
-    def _get_system_message(self, **kwargs) -> str:
-        return f"""You are an expert at generating key topics, themes, or intents from a list of questions that a Python function can answer.
+KEY_TOPIC_GENERATOR_STATIC_SYSTEM_MESSAGE = """You are an expert at generating key topics, themes, or intents from a list of questions that a Python function can answer.
 You are given the name of a function, its description, along with various example questions that can be answered by using the function.
-Your job is to do the following:
-1. Generate a list of {self.n_items} key topics, each 1-5 words long, that capture the overarching theme and topic of the following questions.
 
 See below the following examples
 
@@ -244,6 +160,211 @@ EXAMPLE QUESTIONS:
 - How does the interest rate impact the size of my loan payments?
 KEY TOPICS: ['Loan Payment Calculation', 'Amortization Schedule', 'Monthly Payment Determination', 'Debt Repayment Planning', 'Interest Rate Impact on Loans']
 -----------
+"""
+
+class GeneratedQuestions(BaseModel):
+    generated_questions: List[str] = Field(
+        description="Example questions that the function can answer."
+    )
+
+class KeyTopics(BaseModel):
+    key_topics: List[str] = Field(
+        description="Key topics, themes, or intents that capture the overarching theme and topic of the questions."
+    )
+
+class BaseToolDocumentEnhancementGenerator(ABC):
+    static_system_message: str = ""
+    # Structured output model and the name of its list field, set by subclasses
+    output_schema: Type[BaseModel]
+    output_field: str = ""
+
+    def __init__(self, llm: ChatOpenAI, n_items: int, cache_control: bool = False, cache: Optional[DiskCache] = None, max_in_flight: int = 32):
+        self.llm = llm
+        self.n_items = n_items
+        # Upper bound on concurrent requests in `agenerate_many`, tune to the provider's rate limit
+        self.max_in_flight = max_in_flight
+        # Optional exact-match response cache, so re-runs skip tools that did not change
+        self.cache = cache
+        # Mark the static prefix with `cache_control` (Anthropic); OpenAI caches the identical prefix automatically
+        self.cache_control = cache_control
+        self.structured_llm = self._initialize_structured_llm()
+        # The system prompt only depends on n_items, so it is built once instead of on every call
+        self._system_message = SystemMessage(content=self._get_system_content())
+
+    def _initialize_structured_llm(self):
+        # The schema is static, the number of items is requested in the prompt
+        return self.llm.with_structured_output(self.output_schema, method="function_calling")
+
+    @abstractmethod
+    def _get_system_message(self, **kwargs):
+        """Construct the system message for the prompt."""
+        pass
+
+    @abstractmethod
+    def _get_human_message(self, **kwargs):
+        """Construct the human message for the prompt."""
+        pass
+
+    def _get_system_content(self, **kwargs) -> List[Dict[str, Any]]:
+        static_block = {"type": "text", "text": self.static_system_message}
+        if self.cache_control:
+            static_block["cache_control"] = {"type": "ephemeral"}
+        return [static_block, {"type": "text", "text": self._get_system_message(**kwargs)}]
+
+    def _get_messages(self, **kwargs):
+        # The human message is fully interpolated already, so no prompt template is needed
+        return [
+            self._system_message,
+            HumanMessage(content=self._get_human_message(**kwargs))
+        ]
+
+    def _get_batch_request(self, custom_id: str, **kwargs) -> Dict[str, Any]:
+        tool = convert_to_openai_tool(self.output_schema)
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.llm.model_name,
+                "messages": [convert_message_to_dict(m) for m in self._get_messages(**kwargs)],
+                "tools": [tool],
+                "tool_choice": {"type": "function", "function": {"name": tool["function"]["name"]}},
+            },
+        }
+
+    def _parse_batch_output_line(self, line: Dict[str, Any]) -> Optional[List[str]]:
+        response = line.get("response")
+        if line.get("error") or not response or response.get("status_code") != 200:
+            return None
+        try:
+            tool_call = response["body"]["choices"][0]["message"]["tool_calls"][0]
+            arguments = json.loads(tool_call["function"]["arguments"])
+            return self.output_schema(**arguments).model_dump()[self.output_field]
+        except Exception:
+            return None
+
+    def generate_via_batch_api(self, rows: List[Dict[str, Any]], poll_interval: float = 60.0) -> List[List[str]]:
+        """Generates outputs for many tools through the OpenAI Batch API (24h window, half the cost).
+
+        Each row holds the keyword arguments of `generate`. Rows already in `self.cache` are not sent,
+        and every batch result is stored there under the same key as `generate`. Rows whose batch
+        request failed, or that the batch did not return, are retried live through `agenerate_many`.
+        Results keep the order of `rows`. Blocks until the batch is done, so it is meant for offline builds
+        and must not be called from a running event loop.
+        """
+        cache_keys: List[Optional[str]] = [None] * len(rows)
+        results: List[Optional[List[str]]] = [None] * len(rows)
+        if self.cache is not None:
+            cache_keys = [self.generate.cache_key(self, (), row) for row in rows]
+            results = [self.cache.get(key) for key in cache_keys]
+        pending = [idx for idx, result in enumerate(results) if result is None]
+
+        if pending:
+            client = self.llm.root_client
+            requests = [self._get_batch_request(custom_id=str(idx), **rows[idx]) for idx in pending]
+            batch_input = "\n".join(json.dumps(request) for request in requests).encode("utf-8")
+
+            batch_file = client.files.create(file=("toolshed_batch.jsonl", io.BytesIO(batch_input)), purpose="batch")
+            batch = client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+            while batch.status not in ("completed", "failed", "expired", "cancelled"):
+                time.sleep(poll_interval)
+                batch = client.batches.retrieve(batch.id)
+
+            if batch.output_file_id:
+                for raw_line in client.files.content(batch.output_file_id).text.splitlines():
+                    if raw_line.strip():
+                        line = json.loads(raw_line)
+                        idx = int(line["custom_id"])
+                        results[idx] = self._parse_batch_output_line(line)
+                        if results[idx] is not None and self.cache is not None:
+                            self.cache.set(cache_keys[idx], results[idx])
+
+        failed = [idx for idx, result in enumerate(results) if result is None]
+        if failed:
+            # `agenerate` is cached too, so the retried rows are stored as well
+            for idx, result in zip(failed, asyncio.run(self.agenerate_many([rows[idx] for idx in failed]))):
+                results[idx] = result
+        return results
+
+    async def agenerate_many(self, rows: List[Dict[str, Any]]) -> List[List[str]]:
+        """Runs `agenerate` for many tools concurrently, with at most `max_in_flight` requests at once.
+
+        Each row holds the keyword arguments of `agenerate`. Results keep the order of `rows`.
+        """
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async def _agenerate_one(row: Dict[str, Any]) -> List[str]:
+            async with semaphore:
+                return await self.agenerate(**row)
+
+        return await asyncio.gather(*(_agenerate_one(row) for row in rows))
+
+    @abstractmethod
+    def generate(self, **kwargs):
+        """Abstract method for generating output."""
+        pass
+
+    @abstractmethod
+    async def agenerate(self, **kwargs):
+        """Abstract method for generating output asynchronously."""
+        pass
+
+class QuestionGenerator(BaseToolDocumentEnhancementGenerator):
+    static_system_message = QUESTION_GENERATOR_STATIC_SYSTEM_MESSAGE
+    output_schema = GeneratedQuestions
+    output_field = "generated_questions"
+
+    def __init__(self, llm: ChatOpenAI, n_items: int, cache_control: bool = False, cache: Optional[DiskCache] = None, max_in_flight: int = 32):
+        super().__init__(llm, n_items, cache_control, cache, max_in_flight)
+
+
+    def _get_system_message(self, **kwargs):
+        return f"""Your job is to do the following:
+1. Generate {self.n_items} example questions that the function can answer.
+
+Take a deep breath and think through the problem step by step."""
+
+    def _get_human_message(self, tool_name: str, tool_description: str, tool_arguments: str):
+        return f"""FUNCTION NAME: `{tool_name}`
+FUNCTION DESCRIPTION: `{tool_description}`
+FUNCTION ARGUMENTS: `{tool_arguments}`
+
+{self.n_items} GENERATED QUESTIONS THAT THE FUNCTION CAN ANSWER:"""
+
+    @cached()
+    def generate(self, tool_name: str, tool_description: str, tool_arguments: str) -> List[str]:
+        messages = self._get_messages(
+            tool_name=tool_name, 
+            tool_description=tool_description, 
+            tool_arguments=tool_arguments
+        )
+        result = self.structured_llm.invoke(messages)
+        return result.generated_questions
+
+    @cached()
+    async def agenerate(self, tool_name: str, tool_description: str, tool_arguments: str) -> List[str]:
+        messages = self._get_messages(
+            tool_name=tool_name, 
+            tool_description=tool_description, 
+            tool_arguments=tool_arguments
+        )
+        result = await self.structured_llm.ainvoke(messages)  # Using async invoke
+        return result.generated_questions
+
+class KeyTopicGenerator(BaseToolDocumentEnhancementGenerator):
+    static_system_message = KEY_TOPIC_GENERATOR_STATIC_SYSTEM_MESSAGE
+    output_schema = KeyTopics
+    output_field = "key_topics"
+
+    def __init__(self, llm: ChatOpenAI, n_items: int, cache_control: bool = False, cache: Optional[DiskCache] = None, max_in_flight: int = 32):
+        super().__init__(llm, n_items, cache_control, cache, max_in_flight)
+
+
+    
+
+    def _get_system_message(self, **kwargs) -> str:
+        return f"""Your job is to do the following:
+1. Generate a list of {self.n_items} key topics, each 1-5 words long, that capture the overarching theme and topic of the example questions.
 
 Take a deep breath and think through the problem step by step."""
 
@@ -253,6 +374,7 @@ FUNCTION DESCRIPTION: `{tool_description}`
 EXAMPLE QUESTIONS: {example_questions}
 {self.n_items} KEY TOPICS THAT CAPTURE THE OVERARCHING THEME AND TOPIC:"""
 
+    @cached(unordered_args=("example_questions",))
     def generate(self, tool_name: str, tool_description: str, example_questions: List[str]) -> List[str]:
         messages = self._get_messages(
             tool_name=tool_name,
@@ -262,6 +384,7 @@ EXAMPLE QUESTIONS: {example_questions}
         result = self.structured_llm.invoke(messages)
         return result.key_topics
 
+    @cached(unordered_args=("example_questions",))
     async def agenerate(self, tool_name: str, tool_description: str, example_questions: List[str]) -> List[str]:
         messages = self._get_messages(
             tool_name=tool_name,
@@ -0,0 +1,203 @@
+from __future__ import annotations
+import functools
+import hashlib
+import inspect
+import json
+import os
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+if TYPE_CHECKING:
+    # type hints only, langchain_openai is slow to import
+    from langchain_openai import OpenAIEmbeddings
+
+class DiskCache:
+    """Exact-match response cache storing one JSON file per key."""
+    def __init__(self, cache_dir: str = ".cache/toolshed"):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        with open(path, "r") as f:
+            self.hits += 1
+            return json.load(f)
+
+    def set(self, key: str, value: Any):
+        # write to a temp file first so a crash never leaves a truncated entry
+        tmp_path = self._path(key) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, self._path(key))
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+def make_cache_key(*parts: Any) -> str:
+    """Hashes the normalized parts into a SHA-256 hex key."""
+    payload = json.dumps([_normalize(p) for p in parts], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def cached(unordered_args: tuple = ()):
+    """Caches a generate/agenerate method in `self.cache` (a DiskCache) when one is set.
+
+    The key covers the class name, `self.n_items` and every call argument. Arguments listed in
+    `unordered_args` are sorted first so their order does not change the key. The wrapper's
+    `cache_key(self, args, kwargs)` returns the key of a call, for callers that fill the cache themselves.
+    """
+    def decorator(method: Callable):
+        signature = inspect.signature(method)
+        self_name = next(iter(signature.parameters))
+
+        def _key(self, args, kwargs) -> str:
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments: Dict[str, Any] = dict(bound.arguments)
+            arguments.pop(self_name)
+            for name in unordered_args:
+                arguments[name] = sorted(_normalize(arguments[name]))
+            return make_cache_key(self.__class__.__name__, getattr(self, "n_items", None), arguments)
+
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                if getattr(self, "cache", None) is None:
+                    return await method(self, *args, **kwargs)
+                key = _key(self, args, kwargs)
+                result = self.cache.get(key)
+                if result is None:
+                    result = await method(self, *args, **kwargs)
+                    self.cache.set(key, result)
+                return result
+            async_wrapper.cache_key = _key
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if getattr(self, "cache", None) is None:
+                return method(self, *args, **kwargs)
+            key = _key(self, args, kwargs)
+            result = self.cache.get(key)
+            if result is None:
+                result = method(self, *args, **kwargs)
+                self.cache.set(key, result)
+            return result
+        wrapper.cache_key = _key
+        return wrapper
+    return decorator
+
+class SemanticCache:
+    """In-memory cache returning a stored result when a new query embeds close to a cached one.
+
+    Entries live in separate namespaces (module, prompt parameters and every non-query argument),
+    each holding a matrix of L2-normalized query embeddings searched with a single dot product.
+    """
+    def __init__(self, embedder: OpenAIEmbeddings, threshold: float = 0.92, max_size: int = 10000):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._embeddings: Dict[str, np.ndarray] = {}
+        self._values: Dict[str, List[Any]] = {}
+
+    @staticmethod
+    def _normalize_embedding(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _lookup(self, namespace: str, embedding: np.ndarray) -> Optional[Any]:
+        matrix = self._embeddings.get(namespace)
+        if matrix is not None:
+            similarities = matrix @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                self.hits += 1
+                return self._values[namespace][best]
+        self.misses += 1
+        return None
+
+    def get(self, namespace: str, query: str) -> Tuple[Optional[Any], np.ndarray]:
+        """Returns the cached value (or None) and the query embedding, so a miss can be stored without re-embedding."""
+        embedding = self._normalize_embedding(self.embedder.embed_query(query))
+        return self._lookup(namespace, embedding), embedding
+
+    async def aget(self, namespace: str, query: str) -> Tuple[Optional[Any], np.ndarray]:
+        embedding = self._normalize_embedding(await self.embedder.aembed_query(query))
+        return self._lookup(namespace, embedding), embedding
+
+    def set(self, namespace: str, embedding: np.ndarray, value: Any):
+        matrix = self._embeddings.get(namespace)
+        values = self._values.setdefault(namespace, [])
+        matrix = embedding[None, :] if matrix is None else np.vstack([matrix, embedding[None, :]])
+        values.append(value)
+        if len(values) > self.max_size:
+            # evict the oldest entries first
+            matrix = matrix[-self.max_size:]
+            del values[:-self.max_size]
+        self._embeddings[namespace] = matrix
+
+def semantic_namespace(instance: Any, arguments: Dict[str, Any]) -> str:
+    """The namespace `semantic_cached` stores a call of `instance` in, given its non-query arguments."""
+    prompt_parameters = [getattr(instance, name, None) for name in ("n_items", "top_k", "final_top_k")]
+    return make_cache_key(instance.__class__.__name__, prompt_parameters, arguments)
+
+def semantic_cached(query_arg: str = "query"):
+    """Caches a generate/agenerate method in `self.semantic_cache` (a SemanticCache) when one is set.
+
+    `query_arg` is matched by embedding similarity. The class name, the prompt parameters
+    (`n_items`, `top_k`, `final_top_k`) and every other argument (e.g. the conversation history)
+    must match exactly, through the namespace. Empty results (failed calls) are not cached.
+    """
+    def decorator(method: Callable):
+        signature = inspect.signature(method)
+        self_name = next(iter(signature.parameters))
+
+        def _namespace_and_query(self, args, kwargs) -> Tuple[str, str]:
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments: Dict[str, Any] = dict(bound.arguments)
+            arguments.pop(self_name)
+            query = arguments.pop(query_arg)
+            return semantic_namespace(self, arguments), query
+
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                if getattr(self, "semantic_cache", None) is None:
+                    return await method(self, *args, **kwargs)
+                namespace, query = _namespace_and_query(self, args, kwargs)
+                result, embedding = await self.semantic_cache.aget(namespace, query)
+                if result is None:
+                    result = await method(self, *args, **kwargs)
+                    if result:
+                        self.semantic_cache.set(namespace, embedding, result)
+                return result
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if getattr(self, "semantic_cache", None) is None:
+                return method(self, *args, **kwargs)
+            namespace, query = _namespace_and_query(self, args, kwargs)
+            result, embedding = self.semantic_cache.get(namespace, query)
+            if result is None:
+                result = method(self, *args, **kwargs)
+                if result:
+                    self.semantic_cache.set(namespace, embedding, result)
+            return result
+        return wrapper
+    return decorator
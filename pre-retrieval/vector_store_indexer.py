@@ -1,12 +1,34 @@
+from __future__ import annotations
 from abc import ABC, abstractmethod
-from typing import List
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+import asyncio
+import hashlib
+import json
 from langchain.schema.document import Document
 import os
+import pickle
+import numpy as np
 from langchain.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores.utils import DistanceStrategy
+import uuid
+import warnings
+
+try:
+    import faiss
+except ImportError:  # only FAISSVectorStoreIndexer needs it, NumpyVectorStoreIndexer works without
+    faiss = None
+
+if TYPE_CHECKING:
+    # type hints only, langchain_openai is slow to import
+    from langchain_openai import OpenAIEmbeddings
+
+# Saved next to index.faiss/index.pkl: how the stored vectors were built and are searched
+INDEX_CONFIG_FILE = "index_config.json"
 
 class BaseVectorStoreIndexer(ABC):
     @abstractmethod
-    def index_documents(self, documents: List[Document]):
+    def index_documents(self, documents: List[Document], batch_size: Optional[int] = None):
         """Indexes the provided documents into a vector store."""
         pass
 
@@ -16,8 +38,8 @@ class BaseVectorStoreIndexer(ABC):
         pass
 
     @abstractmethod
-    def load_index(self, load_path: str):
-        """Loads the index from the specified path."""
+    def load_index(self, load_path: str, mmap: bool = False):
+        """Loads the index from the specified path, optionally memory-mapping it instead of reading it into RAM."""
         pass
 
     @abstractmethod
@@ -30,42 +52,427 @@ class BaseVectorStoreIndexer(ABC):
         """Asynchronously queries the index with the given query string."""
         pass
 
+    def query_batch(self, queries: List[str], k: int = 5) -> List[List[Document]]:
+        """Queries the index with each query string. Override to batch the lookups."""
+        return [self.query(query, k=k) for query in queries]
+
+    async def aquery_batch(self, queries: List[str], k: int = 5) -> List[List[Document]]:
+        """Asynchronously queries the index with all query strings concurrently. Override to batch the lookups."""
+        return list(await asyncio.gather(*(self.aquery(query, k=k) for query in queries)))
+
+    def _embed_texts(self, texts: List[str], batch_size: Optional[int] = None) -> np.ndarray:
+        """Embeds the texts with `self.embedding_model` into a float32 (N, d) matrix, in a single call or in batches of `batch_size`.
+
+        Batches are formed from texts of similar length, so local models pad each batch as little as possible.
+        Identical texts (e.g. tools sharing boilerplate) are embedded once.
+        """
+        unique_texts = list(dict.fromkeys(texts))
+        if len(unique_texts) < len(texts):
+            position = {text: i for i, text in enumerate(unique_texts)}
+            return self._embed_texts(unique_texts, batch_size)[[position[text] for text in texts]]
+        if not batch_size:
+            return np.ascontiguousarray(self.embedding_model.embed_documents(texts), dtype=np.float32)
+        order = np.argsort([len(text.split()) for text in texts], kind="stable")
+        sorted_texts = [texts[i] for i in order]
+        sorted_embeddings = []
+        for start in range(0, len(sorted_texts), batch_size):
+            sorted_embeddings.extend(self.embedding_model.embed_documents(sorted_texts[start:start + batch_size]))
+        # scatter the rows back to the order of `texts`
+        embeddings = np.empty((len(texts), len(sorted_embeddings[0])), dtype=np.float32)
+        embeddings[order] = sorted_embeddings
+        return embeddings
+
 class FAISSVectorStoreIndexer(BaseVectorStoreIndexer):
-    def __init__(self, embedding_model: ChatOpenAI = None):
+    def __init__(
+        self,
+        embedding_model: ChatOpenAI = None,
+        index_type: str = "flat",
+        hnsw_m: int = 32,
+        ef_construction: int = 200,
+        ef_search: int = 64,
+        nprobe: int = 8,
+        nlist: Optional[int] = None,
+        index_factory_str: Optional[str] = None,
+        use_gpu: bool = False,
+        embedding_cache_path: Optional[str] = None,
+        add_chunk_size: int = 4000,
+        coalesce_queries: bool = False,
+        max_batch: int = 32,
+        max_wait: float = 0.002
+    ):
+        """
+        index_type selects the FAISS index:
+        - "flat": exact search, best for small toolsheds.
+        - "hnsw": HNSW graph (IndexHNSWFlat) for sub-linear search on large toolsheds.
+        - "ivfpq": inverted lists with product-quantized codes, trained on the tool embeddings.
+        - "hnsw_ivfpq": "ivfpq" with an HNSW graph over the list centroids and 4-bit FastScan codes, for 10k-1M tools.
+        - "sq8": exact search over int8 scalar-quantized vectors, 4x less memory than "flat".
+        - "fp16": exact search over half-precision vectors, 2x less memory than "flat" with no measurable recall loss.
+        `nlist` is the number of IVF lists (default 4 * sqrt(N), at most N / 39 so every list gets enough training points).
+        `index_factory_str` (e.g. "IVF256,PQ32x8") builds any FAISS index with `faiss.index_factory` instead of `index_type`.
+        `use_gpu` moves the index to the first GPU when faiss-gpu and a GPU are available (not supported for "hnsw").
+        `embedding_cache_path` (a .npz file) keeps the embeddings by content hash, so rebuilds only embed new or changed tools.
+        `add_chunk_size` documents are embedded and added at a time, which bounds the peak memory of large toolsheds;
+        trained index types are trained on the first chunk.
+        `coalesce_queries` makes concurrent `aquery` calls share FAISS searches: queries arriving within
+        `max_wait` seconds of each other are searched together, up to `max_batch` at a time.
+        """
         if embedding_model is None:
             print("No embedding model provided. Using default model.")
         else:
             self.embedding_model = embedding_model
+            # bound once, queries skip the LangChain store and call the model and the FAISS index directly
+            self._embed_query = embedding_model.embed_query
+            self._aembed_query = embedding_model.aembed_query
+        if index_type not in ("flat", "hnsw", "ivfpq", "hnsw_ivfpq", "sq8", "fp16"):
+            raise ValueError(f"Unknown index_type '{index_type}'. Use 'flat', 'hnsw', 'ivfpq', 'hnsw_ivfpq', 'sq8' or 'fp16'.")
+        self.index_type = index_type
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.nprobe = nprobe
+        self.nlist = nlist
+        self.index_factory_str = index_factory_str
+        self.use_gpu = use_gpu
+        self.embedding_cache_path = embedding_cache_path
+        self.add_chunk_size = add_chunk_size
+        self.coalesce_queries = coalesce_queries
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        # the batch of queries waiting for the next coalesced search and its event loop; there is no long-lived
+        # worker task to cancel, each batch is searched by a timer on its loop or as soon as it is full
+        self._pending_queries: Optional[List[tuple]] = None
+        self._pending_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._gpu_resources = None
         self.index = None
 
-    def index_documents(self, documents: List[Document]):
-        """Indexes the provided documents into a FAISS vector store."""
-        self.index = FAISS.from_documents(documents, self.embedding_model)
+    def _create_faiss_index(self, n: int, training_embeddings: np.ndarray) -> faiss.Index:
+        """Creates the empty FAISS index for `n` documents, trained on the L2-normalized `training_embeddings` if needed."""
+        n_train, d = training_embeddings.shape
+        if self.index_factory_str:
+            index = faiss.index_factory(d, self.index_factory_str, faiss.METRIC_INNER_PRODUCT)
+            if not index.is_trained:
+                index.train(training_embeddings)
+        elif self.index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(d, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = self.ef_construction
+        elif self.index_type in ("ivfpq", "hnsw_ivfpq") and n_train >= 256:
+            # PQ with 8-bit codes needs at least 256 training vectors; smaller toolsheds stay flat
+            nlist = self.nlist or max(1, min(int(4 * np.sqrt(n)), n_train // 39))
+            m = next(m for m in range(max(1, d // 4), 0, -1) if d % m == 0)
+            if self.index_type == "hnsw_ivfpq":
+                # the HNSW coarse quantizer finds the nprobe lists sub-linearly, FastScan scans 4-bit codes with SIMD lookups
+                index = faiss.index_factory(d, f"IVF{nlist}_HNSW{self.hnsw_m},PQ{m}x4fs", faiss.METRIC_INNER_PRODUCT)
+            else:
+                quantizer = faiss.IndexFlatIP(d)
+                index = faiss.IndexIVFPQ(quantizer, d, nlist, m, 8, faiss.METRIC_INNER_PRODUCT)
+            index.train(training_embeddings)
+        elif self.index_type in ("sq8", "fp16") and n_train >= 100:
+            # Below ~100 tools the fixed cost dominates and the memory saving is negligible
+            quantizer_type = faiss.ScalarQuantizer.QT_8bit if self.index_type == "sq8" else faiss.ScalarQuantizer.QT_fp16
+            index = faiss.IndexScalarQuantizer(d, quantizer_type, faiss.METRIC_INNER_PRODUCT)
+            index.train(training_embeddings)
+        else:
+            index = faiss.IndexFlatIP(d)
+        return index
+
+    def _to_gpu(self, index: faiss.Index) -> faiss.Index:
+        """Copies the index to GPU 0 when `use_gpu` is set and possible, else returns it unchanged."""
+        if not self.use_gpu or isinstance(index, faiss.IndexHNSW):
+            return index
+        if not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+            warnings.warn("No GPU available for FAISS, using the CPU index.", RuntimeWarning, stacklevel=2)
+            return index
+        if self._gpu_resources is None:
+            # the resources must outlive every GPU index created from them
+            self._gpu_resources = faiss.StandardGpuResources()
+        return faiss.index_cpu_to_gpu(self._gpu_resources, 0, index)
+
+    def _configure_search(self, index: faiss.Index):
+        """Applies the query-time parameters of the approximate indexes."""
+        if isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efSearch = self.ef_search
+        elif isinstance(index, faiss.IndexIVF):
+            index.nprobe = self.nprobe
+            quantizer = faiss.downcast_index(index.quantizer)
+            if isinstance(quantizer, faiss.IndexHNSW):
+                # the graph must return at least nprobe centroids
+                quantizer.hnsw.efSearch = max(self.ef_search, self.nprobe)
+
+    def _wrap_faiss_index(
+        self,
+        faiss_index: faiss.Index,
+        docstore,
+        index_to_docstore_id,
+        normalize_L2: bool = True,
+        distance_strategy: DistanceStrategy = DistanceStrategy.MAX_INNER_PRODUCT
+    ) -> FAISS:
+        # Built indexes hold normalized vectors, so inner product is cosine similarity; queries are normalized by the store
+        return FAISS(
+            self.embedding_model,
+            faiss_index,
+            docstore,
+            index_to_docstore_id,
+            normalize_L2=normalize_L2,
+            distance_strategy=distance_strategy
+        )
+
+    @staticmethod
+    def _load_index_config(load_path: str) -> Dict[str, Any]:
+        """The metric and normalization an index was saved with; indexes saved without them use LangChain's defaults (L2, unnormalized)."""
+        config_path = os.path.join(load_path, INDEX_CONFIG_FILE)
+        if not os.path.exists(config_path):
+            return {"normalize_L2": False, "distance_strategy": DistanceStrategy.EUCLIDEAN_DISTANCE}
+        with open(config_path, "r") as f:
+            config = json.load(f)
+        return {"normalize_L2": config["normalize_L2"], "distance_strategy": DistanceStrategy(config["distance_strategy"])}
+
+    def _embedding_model_name(self) -> str:
+        return str(getattr(self.embedding_model, "model", None) or getattr(self.embedding_model, "model_name", None) or type(self.embedding_model).__name__)
+
+    def _load_embedding_cache(self) -> Dict[str, np.ndarray]:
+        if not os.path.exists(self.embedding_cache_path):
+            return {}
+        with np.load(self.embedding_cache_path) as cache:
+            # vectors of another embedding model are useless
+            if str(cache["model"]) != self._embedding_model_name():
+                return {}
+            return dict(zip(cache["hashes"].tolist(), cache["embeddings"]))
+
+    def _save_embedding_cache(self, cache: Dict[str, np.ndarray]):
+        # write to a temp file first so a crash never leaves a truncated cache
+        tmp_path = self.embedding_cache_path + ".tmp.npz"
+        np.savez(tmp_path, model=self._embedding_model_name(), hashes=np.array(list(cache)), embeddings=np.stack(list(cache.values())))
+        os.replace(tmp_path, self.embedding_cache_path)
+
+    def _embed_documents_cached(self, documents: List[Document], cache: Dict[str, np.ndarray], batch_size: Optional[int] = None) -> np.ndarray:
+        """Embeds only the documents whose content hash is not in `cache`, in one batched call, and adds them to it."""
+        hashes = [
+            doc.metadata.get("tool_hash") or hashlib.blake2b(doc.page_content.encode("utf-8"), digest_size=16).hexdigest()
+            for doc in documents
+        ]
+        missing = list(dict.fromkeys(h for h in hashes if h not in cache))
+        if missing:
+            content_by_hash = {h: doc.page_content for h, doc in zip(hashes, documents)}
+            new_embeddings = self._embed_texts([content_by_hash[h] for h in missing], batch_size)
+            cache.update(zip(missing, new_embeddings))
+        return np.ascontiguousarray([cache[h] for h in hashes], dtype=np.float32)
+
+    def index_documents(self, documents: List[Document], batch_size: Optional[int] = None):
+        """Indexes the provided documents into a FAISS vector store.
+
+        Each chunk of `add_chunk_size` documents is embedded together, or in batches of `batch_size` for local
+        models with a memory limit, and added to the index before the next chunk is embedded.
+        """
+        cache = self._load_embedding_cache() if self.embedding_cache_path else None
+        n_cached = len(cache) if cache is not None else 0
+        faiss_index = None
+        for start in range(0, len(documents), self.add_chunk_size):
+            chunk = documents[start:start + self.add_chunk_size]
+            if cache is not None:
+                embeddings = self._embed_documents_cached(chunk, cache, batch_size)
+            else:
+                embeddings = self._embed_texts([doc.page_content for doc in chunk], batch_size)
+            # Normalize once at index time so searches run on the plain inner-product kernel
+            faiss.normalize_L2(embeddings)
+            if faiss_index is None:
+                faiss_index = self._create_faiss_index(len(documents), embeddings)
+            faiss_index.add(embeddings)
+        if cache is not None and len(cache) > n_cached:
+            self._save_embedding_cache(cache)
+        self._configure_search(faiss_index)
+
+        ids = [str(uuid.uuid4()) for _ in documents]
+        docstore = InMemoryDocstore(dict(zip(ids, documents)))
+        index_to_docstore_id = dict(enumerate(ids))
+        self.index = self._wrap_faiss_index(self._to_gpu(faiss_index), docstore, index_to_docstore_id)
 
     def save_index(self, save_path: str):
         """Saves the FAISS index to the specified path."""
         if self.index is not None:
             os.makedirs(save_path, exist_ok=True)
-            self.index.save_local(save_path)
+            faiss_index = self.index.index
+            if hasattr(faiss, "GpuIndex") and isinstance(faiss_index, faiss.GpuIndex):
+                # GPU indexes cannot be serialized, save a CPU copy
+                self.index.index = faiss.index_gpu_to_cpu(faiss_index)
+            try:
+                self.index.save_local(save_path)
+            finally:
+                self.index.index = faiss_index
+            with open(os.path.join(save_path, INDEX_CONFIG_FILE), "w") as f:
+                json.dump({"normalize_L2": self.index._normalize_L2, "distance_strategy": DistanceStrategy(self.index.distance_strategy).value}, f)
         else:
             raise ValueError("Index has not been created yet. Call 'index_documents' first.")
 
-    def load_index(self, load_path: str):
-        """Loads the FAISS index from the specified path."""
-        self.index = FAISS.load_local(load_path, self.embedding_model, allow_dangerous_deserialization=True)
+    def load_index(self, load_path: str, mmap: bool = False):
+        """Loads the FAISS index from the specified path, with the metric and normalization it was saved with.
+
+        With `mmap=True` the vectors stay on disk and are paged in on demand, which removes the
+        deserialization cost at startup and keeps them out of the process RSS.
+        """
+        config = self._load_index_config(load_path)
+        if not mmap:
+            self.index = FAISS.load_local(
+                load_path,
+                self.embedding_model,
+                allow_dangerous_deserialization=True,
+                **config
+            )
+            self._configure_search(self.index.index)
+            self.index.index = self._to_gpu(self.index.index)
+            return
+        faiss_index = faiss.read_index(os.path.join(load_path, "index.faiss"), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        with open(os.path.join(load_path, "index.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        self._configure_search(faiss_index)
+        self.index = self._wrap_faiss_index(faiss_index, docstore, index_to_docstore_id, **config)
 
     def query(self, query: str, k: int = 5):
         """Queries the FAISS index with the given query string."""
         if self.index is not None:
-            docs = self.index.similarity_search(query, k=k)
-            return docs
+            return self._search_vectors([self._embed_query(query)], k)[0]
         else:
             raise ValueError("Index has not been created yet. Call 'index_documents' or 'load_index' first.")
     
     async def aquery(self, query: str, k: int = 5):
         """Asynchronously queries the FAISS index with the given query string."""
         if self.index is not None:
-            docs = await self.index.asimilarity_search(query, k=k)
-            return docs
+            vector = await self._aembed_query(query)
+            if self.coalesce_queries:
+                return await self._acoalesced_search(vector, k)
+            return self._search_vectors([vector], k)[0]
+        else:
+            raise ValueError("Index has not been created yet. Call 'index_documents' or 'load_index' first.")
+
+    def _search_vectors(self, vectors: List[List[float]], k: int) -> List[List[Document]]:
+        """Runs a single FAISS search over the stacked (N, d) query matrix."""
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.index._normalize_L2:
+            faiss.normalize_L2(matrix)
+        _, indices = self.index.index.search(matrix, k)
+        results = []
+        for row in indices:
+            docs = []
+            for i in row:
+                if i == -1:
+                    continue
+                docs.append(self.index.docstore.search(self.index.index_to_docstore_id[i]))
+            results.append(docs)
+        return results
+
+    async def _acoalesced_search(self, vector: List[float], k: int) -> List[Document]:
+        loop = asyncio.get_running_loop()
+        batch = self._pending_queries
+        if batch is None or self._pending_loop is not loop:
+            # first query of a new batch: it is searched after `max_wait` seconds at the latest
+            batch = self._pending_queries = []
+            self._pending_loop = loop
+            loop.call_later(self.max_wait, self._search_batch, batch)
+        future = loop.create_future()
+        batch.append((vector, k, future))
+        if len(batch) >= self.max_batch:
+            self._search_batch(batch)
+        return await future
+
+    def _search_batch(self, batch: List[tuple]):
+        """Answers the queries of a coalesced batch with one FAISS search; a batch already searched is empty."""
+        if self._pending_queries is batch:
+            self._pending_queries = None
+        queries = batch[:]
+        batch.clear()
+        if not queries:
+            return
+        try:
+            results = self._search_vectors([vector for vector, _, _ in queries], max(k for _, k, _ in queries))
+        except Exception as e:
+            for _, _, future in queries:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, k, future), docs in zip(queries, results):
+            if not future.done():
+                future.set_result(docs[:k])
+
+    def query_batch(self, queries: List[str], k: int = 5) -> List[List[Document]]:
+        """Embeds all queries in one call and searches the FAISS index once."""
+        if self.index is not None:
+            vectors = self.embedding_model.embed_documents(queries)
+            return self._search_vectors(vectors, k)
+        else:
+            raise ValueError("Index has not been created yet. Call 'index_documents' or 'load_index' first.")
+
+    async def aquery_batch(self, queries: List[str], k: int = 5) -> List[List[Document]]:
+        """Asynchronously embeds all queries in one call and searches the FAISS index once."""
+        if self.index is not None:
+            vectors = await self.embedding_model.aembed_documents(queries)
+            return self._search_vectors(vectors, k)
+        else:
+            raise ValueError("Index has not been created yet. Call 'index_documents' or 'load_index' first.")
+
+class NumpyVectorStoreIndexer(BaseVectorStoreIndexer):
+    """Exact cosine search with a single matrix product over the normalized (N, d) embedding matrix.
+
+    Needs neither FAISS nor training, and for toolsheds of up to ~10k tools a BLAS matrix-vector
+    product is as fast as a flat FAISS index.
+    """
+    def __init__(self, embedding_model: OpenAIEmbeddings):
+        if embedding_model is None:
+            raise ValueError("NumpyVectorStoreIndexer needs an embedding model to embed the documents and queries.")
+        self.embedding_model = embedding_model
+        self.embeddings: Optional[np.ndarray] = None
+        self.documents: List[Document] = []
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    def index_documents(self, documents: List[Document], batch_size: Optional[int] = None):
+        """Embeds the documents and stores them as a C-contiguous, L2-normalized float32 matrix."""
+        embeddings = self._embed_texts([doc.page_content for doc in documents], batch_size)
+        self.embeddings = np.ascontiguousarray(self._normalize(embeddings), dtype=np.float32)
+        self.documents = list(documents)
+
+    def save_index(self, save_path: str):
+        """Saves the embedding matrix and the documents to the specified path."""
+        if self.embeddings is not None:
+            os.makedirs(save_path, exist_ok=True)
+            np.save(os.path.join(save_path, "embeddings.npy"), self.embeddings)
+            with open(os.path.join(save_path, "documents.pkl"), "wb") as f:
+                pickle.dump(self.documents, f)
         else:
+            raise ValueError("Index has not been created yet. Call 'index_documents' first.")
+
+    def load_index(self, load_path: str, mmap: bool = False):
+        """Loads the embedding matrix and the documents, optionally memory-mapping the matrix."""
+        self.embeddings = np.load(os.path.join(load_path, "embeddings.npy"), mmap_mode="r" if mmap else None)
+        with open(os.path.join(load_path, "documents.pkl"), "rb") as f:
+            self.documents = pickle.load(f)
+
+    def _search_vectors(self, vectors: List[List[float]], k: int) -> List[List[Document]]:
+        """Scores every query against every document in one matrix product and keeps the top k of each."""
+        if self.embeddings is None:
             raise ValueError("Index has not been created yet. Call 'index_documents' or 'load_index' first.")
+        scores = self._normalize(np.asarray(vectors, dtype=np.float32)) @ self.embeddings.T
+        k = min(k, scores.shape[1])
+        # argpartition finds the top k in O(N), only those k are sorted
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < scores.shape[1] else np.tile(np.arange(k), (len(scores), 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        top = np.take_along_axis(top, np.argsort(-top_scores, axis=1), axis=1)
+        return [[self.documents[i] for i in row] for row in top.tolist()]
+
+    def query(self, query: str, k: int = 5):
+        """Queries the index with the given query string."""
+        return self._search_vectors([self.embedding_model.embed_query(query)], k)[0]
+
+    async def aquery(self, query: str, k: int = 5):
+        """Asynchronously queries the index with the given query string."""
+        return self._search_vectors([await self.embedding_model.aembed_query(query)], k)[0]
+
+    def query_batch(self, queries: List[str], k: int = 5) -> List[List[Document]]:
+        """Embeds all queries in one call and scores them in one matrix product."""
+        return self._search_vectors(self.embedding_model.embed_documents(queries), k)
+
+    async def aquery_batch(self, queries: List[str], k: int = 5) -> List[List[Document]]:
+        """Asynchronously embeds all queries in one call and scores them in one matrix product."""
+        return self._search_vectors(await self.embedding_model.aembed_documents(queries), k)
@@ -0,0 +1,13 @@
+import sys
+import types
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# The modules import each other as `pre_retrieval.*`, `intra_retrieval.*`, `post_retrieval.*` and `end_to_end.*`,
+# while the directories are named with dashes; expose each directory under its package name.
+for package_name in ("pre_retrieval", "intra_retrieval", "post_retrieval", "end_to_end"):
+    if package_name not in sys.modules:
+        package = types.ModuleType(package_name)
+        package.__path__ = [str(ROOT / package_name.replace("_", "-"))]
+        sys.modules[package_name] = package
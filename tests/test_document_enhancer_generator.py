@@ -0,0 +1,63 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("langchain_core")
+pytest.importorskip("langchain_community")
+
+from pre_retrieval.document_enhancer_generator import QuestionGenerator
+from pre_retrieval.response_cache import DiskCache
+
+
+class _Files:
+    def __init__(self):
+        self.sent = []
+
+    def create(self, file, purpose):
+        self.sent = file[1].getvalue().decode("utf-8").splitlines()
+        return SimpleNamespace(id="input")
+
+    def content(self, file_id):
+        lines = []
+        for raw_request in self.sent:
+            custom_id = json.loads(raw_request)["custom_id"]
+            if custom_id == "2":
+                continue  # the batch did not return this row
+            arguments = json.dumps({"generated_questions": [f"batch {custom_id}"]})
+            message = {"tool_calls": [{"function": {"arguments": arguments}}]}
+            lines.append(json.dumps({"custom_id": custom_id, "response": {"status_code": 200, "body": {"choices": [{"message": message}]}}}))
+        return SimpleNamespace(text="\n".join(lines))
+
+
+class _LLM:
+    model_name = "gpt-4o-mini"
+
+    def __init__(self):
+        self.files = _Files()
+        self.root_client = SimpleNamespace(
+            files=self.files,
+            batches=SimpleNamespace(create=lambda **kwargs: SimpleNamespace(id="batch", status="completed", output_file_id="output")),
+        )
+        self.live_calls = 0
+
+    def with_structured_output(self, schema, method=None):
+        async def ainvoke(messages):
+            self.live_calls += 1
+            return SimpleNamespace(generated_questions=["live"])
+        return SimpleNamespace(ainvoke=ainvoke)
+
+
+def test_batch_api_goes_through_the_disk_cache(tmp_path):
+    llm = _LLM()
+    generator = QuestionGenerator(llm, n_items=1, cache=DiskCache(str(tmp_path)))
+    rows = [{"tool_name": f"tool_{idx}", "tool_description": "description", "tool_arguments": "arguments"} for idx in range(3)]
+
+    assert generator.generate_via_batch_api(rows) == [["batch 0"], ["batch 1"], ["live"]]
+    assert len(llm.files.sent) == 3 and llm.live_calls == 1
+
+    # every row was cached, under the key `generate` uses
+    llm.files.sent = []
+    assert generator.generate_via_batch_api(rows) == [["batch 0"], ["batch 1"], ["live"]]
+    assert llm.files.sent == [] and llm.live_calls == 1
+    assert generator.generate(**rows[0]) == ["batch 0"]
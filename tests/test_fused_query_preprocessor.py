@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("langchain_core")
+pytest.importorskip("pydantic")
+
+from intra_retrieval.fused_query_preprocessor_module import FusedQueryPreprocessor
+from pre_retrieval.response_cache import SemanticCache
+
+QUERY = "What is the NPV of my project and also its IRR?"
+DECOMPOSITIONS = [
+    {"decomposed_query": "Calculate the NPV of the project.", "expanded_queries": ["npv a", "npv b"]},
+    {"decomposed_query": "Calculate the IRR of the project.", "expanded_queries": ["irr a", "irr b"]},
+]
+
+
+class _Embedder:
+    async def aembed_query(self, text):
+        return [1.0, 0.0]
+
+
+class _StreamingLLM:
+    def __init__(self):
+        self.calls = 0
+
+    async def astream(self, messages):
+        self.calls += 1
+        yield {"rewritten_query": QUERY}
+        yield {"rewritten_query": QUERY, "decompositions": DECOMPOSITIONS[:1]}
+        yield {"rewritten_query": QUERY, "decompositions": DECOMPOSITIONS}
+
+
+def _preprocessor():
+    preprocessor = FusedQueryPreprocessor.__new__(FusedQueryPreprocessor)
+    preprocessor.n_items = 2
+    preprocessor.history_summarizer = None
+    preprocessor.semantic_cache = SemanticCache(embedder=_Embedder())
+    preprocessor.streaming_structured_llm = _StreamingLLM()
+    preprocessor._get_preprocess_messages = lambda *args, **kwargs: []
+    return preprocessor
+
+
+async def _collect(preprocessor):
+    return [item async for item in preprocessor.astream_decompositions(QUERY, [])]
+
+
+def test_astream_decompositions_shares_the_semantic_cache():
+    preprocessor = _preprocessor()
+    expected = [(QUERY, decomposition) for decomposition in DECOMPOSITIONS]
+
+    assert asyncio.run(_collect(preprocessor)) == expected
+    # the second call is answered from the entry the stream stored, without another LLM call
+    assert asyncio.run(_collect(preprocessor)) == expected
+    assert preprocessor.streaming_structured_llm.calls == 1
+    assert asyncio.run(preprocessor.agenerate(QUERY, [])) == {"rewritten_query": QUERY, "decompositions": DECOMPOSITIONS}
@@ -0,0 +1,75 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+pytest.importorskip("pydantic")
+
+import json
+
+from langchain_core.messages import AIMessage
+from langchain_core.output_parsers import PydanticOutputParser
+from post_retrieval.global_reranker import GlobalToolNames
+
+
+def _parse_answer(answer):
+    # the parser `with_structured_output(..., method="json_schema")` applies to the model's message
+    return PydanticOutputParser(pydantic_object=GlobalToolNames).invoke(AIMessage(content=json.dumps(answer)))
+
+
+def test_global_tool_names_schema_has_no_length_constraints():
+    schema = json.dumps(GlobalToolNames.model_json_schema())
+    assert "minItems" not in schema and "maxItems" not in schema
+    # a wrong number of tools still parses, `_parse_result` fits it
+    result = _parse_answer({"intent_tool_names": [], "final_tool_names": ["get_npv"]})
+    assert result.final_tool_names == ["get_npv"]
+
+
+def _document(tool_name):
+    from langchain_core.documents import Document
+    return Document(page_content=tool_name, metadata={"tool_name": tool_name})
+
+
+def test_parse_result_fits_counts_without_another_call():
+    from post_retrieval.global_reranker import GlobalReranker
+    from post_retrieval.reranker_multi_query_expansion_or_variation_module import RerankerMultiQueryExpansionVariations
+    from post_retrieval.reranker_query_decomposition import RerankerDecomposedQueries
+
+    reranker = GlobalReranker.__new__(GlobalReranker)
+    reranker.top_k = 2
+    reranker.final_top_k = 3
+    reranker.reranker_multi_query_expansion_variations = RerankerMultiQueryExpansionVariations.__new__(RerankerMultiQueryExpansionVariations)
+    reranker.reranker_query_decomposition = RerankerDecomposedQueries.__new__(RerankerDecomposedQueries)
+    items = [
+        {"user_question": "npv", "user_question_results": None, "sentence_results": [[_document("get_npv"), _document("get_pv")]]},
+        {"user_question": "irr", "user_question_results": None, "sentence_results": [[_document("get_irr"), _document("get_mirr")]]},
+    ]
+    result = _parse_answer({
+        "intent_tool_names": [{"intent_number": 1, "tool_names": ["get_npv", "get_npv", "get_pv", "get_roi"]}],
+        "final_tool_names": ["get_irr", "unknown_tool"],
+    })
+    parsed = reranker._parse_result(result, items)
+    assert parsed["intent_tool_names"] == [["get_npv", "get_pv"], ["get_irr", "get_mirr"]]
+    assert parsed["final_tool_names"] == ["get_irr", "get_npv", "get_pv"]
+
+
+def test_two_stage_fallback_is_shared_by_sync_and_async():
+    import asyncio
+    from types import SimpleNamespace
+    from post_retrieval.global_reranker import GlobalReranker
+
+    intent_tool_names = [["get_npv", "get_pv"], ["get_irr", "get_mirr"]]
+
+    async def agenerate_batch(items):
+        return intent_tool_names
+
+    async def agenerate(**kwargs):
+        return ["combined", *kwargs["list_of_intents"]]
+
+    reranker = GlobalReranker.__new__(GlobalReranker)
+    reranker.reranker_multi_query_expansion_variations = SimpleNamespace(generate_batch=lambda items: intent_tool_names, agenerate_batch=agenerate_batch)
+    reranker.reranker_query_decomposition = SimpleNamespace(generate=lambda **kwargs: ["combined", *kwargs["list_of_intents"]], agenerate=agenerate)
+    items = [{"user_question": "npv"}, {"user_question": "irr"}]
+
+    expected = {"intent_tool_names": intent_tool_names, "final_tool_names": ["combined", "npv", "irr"]}
+    assert reranker._rerank_two_stage("q", items) == expected
+    assert asyncio.run(reranker._arerank_two_stage("q", items)) == expected
+    assert reranker._rerank_two_stage("q", items[:1])["final_tool_names"] == ["get_npv", "get_pv"]
@@ -0,0 +1,28 @@
+import pytest
+
+from end_to_end.structural_tool_cache import StructuralToolCache
+
+
+@pytest.mark.parametrize("cached_query, query", [
+    ("What is the Sharpe ratio of a fund returning 12% with a 3% risk-free rate and 15% volatility?",
+     "What is the Treynor ratio of a fund returning 12% with a 3% risk-free rate and 15% volatility?"),
+    ("Compute the Sortino ratio for an 8% return, a 2% target and 6% downside deviation.",
+     "Compute the Calmar ratio for an 8% return, a 2% target and 6% downside deviation."),
+])
+def test_different_ratio_queries_do_not_collide(cached_query, query):
+    cache = StructuralToolCache()
+    cache.set(cached_query, [], ["get_cached_ratio"])
+    assert cache.get(query, []) is None
+
+
+def test_queries_differing_only_in_numbers_share_tools():
+    cache = StructuralToolCache()
+    cache.set("What is the Sharpe ratio of a fund returning 12% with a 3% risk-free rate?", [], ["get_sharpe_ratio"])
+    assert cache.get("What is the Sharpe ratio of a fund returning 9.5% with a 4% risk-free rate?", []) == ["get_sharpe_ratio"]
+
+
+def test_changed_quoted_entity_is_retrieved_again():
+    cache = StructuralToolCache()
+    cache.set("Get the fund's Sharpe ratio for 'Alpha Growth'", [], ["get_sharpe_ratio"])
+    assert cache.get("Get the fund's Sharpe ratio for 'alpha growth'", []) == ["get_sharpe_ratio"]
+    assert cache.get("Get the fund's Sharpe ratio for 'Beta Income'", []) is None
@@ -0,0 +1,31 @@
+import importlib
+
+import pytest
+
+pytest.importorskip("langchain_core")
+pytest.importorskip("pydantic")
+
+from pydantic import BaseModel
+
+SCHEMA_MODULES = [
+    "intra_retrieval.fused_query_preprocessor_module",
+    "intra_retrieval.multi_query_expansion_or_variation_module",
+    "intra_retrieval.query_decomposition_module",
+    "intra_retrieval.query_rewriting_module",
+    "post_retrieval.global_reranker",
+    "post_retrieval.reranker_multi_query_expansion_or_variation_module",
+    "post_retrieval.reranker_query_decomposition",
+]
+
+
+@pytest.mark.parametrize("module_name", SCHEMA_MODULES)
+def test_structured_output_schemas_are_fully_defined(module_name):
+    module = importlib.import_module(module_name)
+    schemas = [
+        value for value in vars(module).values()
+        if isinstance(value, type) and issubclass(value, BaseModel) and value is not BaseModel and value.__module__ == module_name
+    ]
+    assert schemas
+    for schema in schemas:
+        # raises when a field annotation cannot be resolved
+        assert schema.model_json_schema()["properties"]
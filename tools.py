@@ -1,8 +1,261 @@
-from typing import Annotated, List
-from math import sqrt, log, exp
-import numpy as np 
-from langchain.tools import tool
-from scipy.stats import norm
+from typing import Annotated, Callable, Dict, List, Optional, Tuple
+from functools import lru_cache
+from math import ceil, sqrt, log, log1p, exp, expm1, erfc, isnan, pi
+import numpy as np
+from langchain.tools import BaseTool, tool
+
+try:
+    from numba import njit, vectorize
+except ImportError:  # optional, the kernels below then run as plain Python
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+    # the element-wise formulas broadcast over numpy arrays as they are
+    vectorize = njit
+
+# The kernels are compiled eagerly for the signatures given: every scalar is a float64 ('f8'), so integer
+# arguments such as periods are converted on the way in instead of compiling an int64 specialization whose
+# intermediate products could overflow
+
+# Standard normal CDF and inverse CDF on plain floats, without SciPy's distribution machinery
+@njit('f8(f8)', cache=True)
+def _norm_cdf(x):
+    return 0.5 * erfc(-x / sqrt(2.0))
+
+# Acklam's rational approximation of the inverse normal CDF (relative error < 1.15e-9)
+_PPF_A = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02, 1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+_PPF_B = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02, 6.680131188771972e+01, -1.328068155288572e+01)
+_PPF_C = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00, -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+_PPF_D = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00)
+_PPF_P_LOW = 0.02425
+
+@lru_cache(maxsize=1024)
+def _norm_ppf(p: float) -> float:
+    if not 0.0 < p < 1.0:
+        return -float('inf') if p == 0.0 else float('inf') if p == 1.0 else float('nan')
+    a, b, c, d = _PPF_A, _PPF_B, _PPF_C, _PPF_D
+    if p < _PPF_P_LOW or p > 1.0 - _PPF_P_LOW:
+        # tails
+        q = sqrt(-2.0 * log(p if p < _PPF_P_LOW else 1.0 - p))
+        x = (((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) / ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1.0)
+        if p > 1.0 - _PPF_P_LOW:
+            x = -x
+    else:
+        q = p - 0.5
+        r = q * q
+        x = (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * q / (((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1.0)
+    # one Halley step brings the approximation to full double precision
+    e = _norm_cdf(x) - p
+    u = e * sqrt(2.0 * pi) * exp(0.5 * x * x)
+    return x - u / (1.0 + 0.5 * x * u)
+
+# Left-tail z-scores of the confidence levels VaR is almost always asked at, looked up without a call
+_VAR_Z_SCORES = {confidence_level: _norm_ppf(1 - confidence_level) for confidence_level in (0.9, 0.95, 0.975, 0.99, 0.995, 0.999)}
+
+# The discount factor exp(-r * T) is an argument so that callers pricing both the call and the put
+# (through put-call parity) compute it once
+@njit('f8(f8, f8, f8, f8, f8, f8)', cache=True)
+def _black_scholes_call_discounted(stock_price, strike_price, time_to_expiration, risk_free_rate, volatility, discount_factor):
+    volatility_sqrt_time = volatility * sqrt(time_to_expiration)
+    d1 = (log(stock_price / strike_price) + (risk_free_rate + 0.5 * volatility ** 2) * time_to_expiration) / volatility_sqrt_time
+    d2 = d1 - volatility_sqrt_time
+    return stock_price * _norm_cdf(d1) - strike_price * discount_factor * _norm_cdf(d2)
+
+@njit('f8(f8, f8, f8, f8)', cache=True)
+def _put_from_parity(call_price, strike_price, discount_factor, stock_price):
+    return call_price + strike_price * discount_factor - stock_price
+
+@njit('f8(f8, f8, f8, f8, f8)', cache=True)
+def _black_scholes_call(stock_price, strike_price, time_to_expiration, risk_free_rate, volatility):
+    discount_factor = exp(-risk_free_rate * time_to_expiration)
+    return _black_scholes_call_discounted(stock_price, strike_price, time_to_expiration, risk_free_rate, volatility, discount_factor)
+
+@njit('f8[:](f8[:], f8[:], f8[:], f8[:], f8[:])', cache=True)
+def _black_scholes_call_batch(stock_prices, strike_prices, times_to_expiration, risk_free_rates, volatilities):
+    call_prices = np.empty(stock_prices.size)
+    for i in range(stock_prices.size):
+        call_prices[i] = _black_scholes_call(stock_prices[i], strike_prices[i], times_to_expiration[i], risk_free_rates[i], volatilities[i])
+    return call_prices
+
+# The agent often calls the costlier tools again with the same arguments (e.g. in follow-up questions),
+# so their results are memoized; list arguments are passed as tuples to be hashable
+_black_scholes_call_cached = lru_cache(maxsize=2048)(_black_scholes_call)
+
+@njit('f8(f8[:], f8, f8, i8)', cache=True)
+def _irr_newton(cash_flows, guess=0.1, tol=1e-9, max_iterations=50):
+    """Newton's method on NPV(rate), NaN when it does not converge."""
+    rate = guess
+    for _ in range(max_iterations):
+        if rate <= -1.0:
+            return np.nan
+        discount = 1.0 / (1.0 + rate)
+        discount_factor = 1.0  # discount ** t, updated by multiplication instead of a pow per cash flow
+        npv = 0.0
+        d_npv = 0.0
+        for t in range(cash_flows.size):
+            npv += cash_flows[t] * discount_factor
+            d_npv -= t * cash_flows[t] * discount_factor * discount
+            discount_factor *= discount
+        if d_npv == 0.0:
+            return np.nan
+        step = npv / d_npv
+        rate -= step
+        if abs(step) < tol:
+            return rate
+    return np.nan
+
+@lru_cache(maxsize=1024)
+def _internal_rate_of_return(cash_flows: Tuple[float, ...]) -> float:
+    # every argument is passed, the typed signature does not cover omitted defaults
+    irr = _irr_newton(np.asarray(cash_flows, dtype=np.float64), 0.1, 1e-9, 50)
+    if isnan(irr):
+        # np.irr was removed in NumPy 1.20, numpy-financial hosts it now; NaN when no rate zeroes the NPV.
+        # Imported on first use, only the IRR fallback and MIRR need it.
+        import numpy_financial as npf
+        irr = npf.irr(cash_flows)
+    return float(irr)
+
+@lru_cache(maxsize=1024)
+def _modified_internal_rate_of_return(cash_flows: Tuple[float, ...], finance_rate: float, reinvestment_rate: float) -> float:
+    import numpy_financial as npf
+    return float(npf.mirr(cash_flows, finance_rate, reinvestment_rate))
+
+@lru_cache(maxsize=1024)
+def _bond_duration(cash_flows: Tuple[float, ...], yields: Tuple[float, ...]) -> float:
+    # yields[t - 1] is the spot yield of period t, so cash flow t is discounted by (1 + yields[t - 1]) ** t
+    n = min(len(cash_flows), len(yields))
+    t = np.arange(1, n + 1, dtype=np.float64)
+    growth = 1.0 + np.asarray(yields[:n], dtype=np.float64)
+    if n and (growth == growth[0]).all():
+        # flat yield curve: the powers are a running product, one multiply per period instead of a pow
+        discount = np.cumprod(growth)
+    else:
+        discount = np.power(growth, t)
+    weighted_cash_flows = np.asarray(cash_flows[:n], dtype=np.float64) / discount
+    return float((t * weighted_cash_flows).sum() / weighted_cash_flows.sum())
+
+def _divide(numerator: float, denominator: float) -> float:
+    """numerator / denominator, NaN instead of a ZeroDivisionError that would end the agent's turn when the denominator is 0."""
+    return numerator / denominator if denominator else float('nan')
+
+# Element-wise formulas compiled to numpy ufuncs: one C loop over broadcast arrays without temporaries,
+# and still callable on plain floats
+@vectorize(['f8(f8, f8, f8)'], cache=True)
+def _enterprise_values(market_capitalizations, total_debts, cash_and_equivalents):
+    return market_capitalizations + total_debts - cash_and_equivalents
+
+# float32 first: numpy picks the first loop its inputs cast to safely
+@vectorize(['f4(f4, f4, f4, f4)', 'f8(f8, f8, f8, f8)'], cache=True)
+def _fx_forward_rate(spot_rate, domestic_interest_rate, foreign_interest_rate, time_to_maturity):
+    return spot_rate * (1 + domestic_interest_rate * time_to_maturity) / (1 + foreign_interest_rate * time_to_maturity)
+
+def _fx_forward_rates(spot_rates, domestic_interest_rates, foreign_interest_rates, times_to_maturity, dtype=np.float64) -> np.ndarray:
+    """Interest rate parity forward rates of any broadcastable mix of scalars and per-pair sequences, in one vectorized pass.
+
+    `dtype=np.float32` halves the memory traffic of large books at about 7 significant digits, enough for
+    display and risk scans; the tools keep float64 for anything that settles.
+    """
+    spot_rates, domestic_interest_rates, foreign_interest_rates, times_to_maturity = (
+        np.asarray(array, dtype=dtype) for array in (spot_rates, domestic_interest_rates, foreign_interest_rates, times_to_maturity)
+    )
+    if domestic_interest_rates.size == foreign_interest_rates.size == times_to_maturity.size == 1:
+        # every pair shares the same rates and maturity: the parity factor is computed once and only the spots are scaled
+        return spot_rates * _fx_forward_rate(dtype(1), domestic_interest_rates, foreign_interest_rates, times_to_maturity)
+    return _fx_forward_rate(spot_rates, domestic_interest_rates, foreign_interest_rates, times_to_maturity)
+
+def _ev_to_ebitda_ratios(enterprise_values, ebitdas) -> np.ndarray:
+    """EV/EBITDA per company, NaN where EBITDA is 0; the division is masked instead of raising or warning."""
+    enterprise_values = np.asarray(enterprise_values, dtype=np.float64)
+    ebitdas = np.asarray(ebitdas, dtype=np.float64)
+    enterprise_values, ebitdas = np.broadcast_arrays(enterprise_values, ebitdas)
+    return np.divide(enterprise_values, ebitdas, out=np.full(ebitdas.shape, np.nan), where=ebitdas != 0)
+
+# Ratio name -> (input names, formula over float64 arrays), the panel version of the single-division tools
+_RATIO_FORMULAS = {
+    "return_on_investment": (("gain_from_investment", "cost_of_investment"), lambda gain, cost: (gain - cost) / cost),
+    "earnings_per_share": (("net_income", "preferred_dividends", "average_outstanding_shares"), lambda income, dividends, shares: (income - dividends) / shares),
+    "price_to_earnings_ratio": (("market_price_per_share", "earnings_per_share"), lambda price, eps: price / eps),
+    "dividend_yield": (("annual_dividends_per_share", "price_per_share"), lambda dividends, price: dividends / price),
+    "debt_to_equity_ratio": (("total_liabilities", "shareholder_equity"), lambda liabilities, equity: liabilities / equity),
+    "current_ratio": (("current_assets", "current_liabilities"), lambda assets, liabilities: assets / liabilities),
+    "quick_ratio": (("current_assets", "inventory", "current_liabilities"), lambda assets, inventory, liabilities: (assets - inventory) / liabilities),
+    "interest_coverage_ratio": (("ebit", "interest_expense"), lambda ebit, interest: ebit / interest),
+    "gross_profit_margin": (("revenue", "cogs"), lambda revenue, cogs: (revenue - cogs) / revenue),
+    "net_profit_margin": (("net_income", "revenue"), lambda income, revenue: income / revenue),
+    "operating_profit_margin": (("operating_income", "revenue"), lambda income, revenue: income / revenue),
+    "inventory_turnover_ratio": (("cogs", "average_inventory"), lambda cogs, inventory: cogs / inventory),
+    "accounts_receivable_turnover_ratio": (("net_credit_sales", "average_accounts_receivable"), lambda sales, receivable: sales / receivable),
+    "debt_service_coverage_ratio": (("net_operating_income", "total_debt_service"), lambda income, debt_service: income / debt_service),
+    "return_on_equity": (("net_income", "shareholder_equity"), lambda income, equity: income / equity),
+    "return_on_assets": (("net_income", "total_assets"), lambda income, assets: income / assets),
+    "debt_ratio": (("total_liabilities", "total_assets"), lambda liabilities, assets: liabilities / assets),
+    "dividend_payout_ratio": (("dividends_per_share", "earnings_per_share"), lambda dividends, eps: dividends / eps),
+    "retention_ratio": (("dividends_per_share", "earnings_per_share"), lambda dividends, eps: 1 - dividends / eps),
+    "price_to_book_ratio": (("market_price_per_share", "book_value_per_share"), lambda price, book_value: price / book_value),
+    "ev_to_ebitda_ratio": (("enterprise_value", "ebitda"), _ev_to_ebitda_ratios),
+}
+
+# Compiled kernels of the compounding tools. The single-division tools stay plain Python,
+# for them numba's dispatch would cost more than the arithmetic.
+@njit('f8(f8, f8, f8, f8)', cache=True)
+def _future_value(present_value, interest_rate, periods, compounding_frequency):
+    return present_value * exp(compounding_frequency * periods * log1p(interest_rate / compounding_frequency))
+
+@njit('f8(f8, f8, f8)', cache=True)
+def _compound_annual_growth_rate(beginning_value, ending_value, periods):
+    # expm1 keeps the precision that "** (1 / periods) - 1" cancels away for small growth rates
+    return expm1(log(ending_value / beginning_value) / periods)
+
+@njit('f8(f8, f8, f8)', cache=True)
+def _loan_payment(principal, annual_interest_rate, periods):
+    monthly_rate = annual_interest_rate / 12
+    growth = (1 + monthly_rate) ** periods
+    return principal * (monthly_rate * growth) / (growth - 1)
+
+@njit('f8(f8, f8, f8, f8, f8)', cache=True)
+def _weighted_average_cost_of_capital(equity, debt, cost_of_equity, cost_of_debt, tax_rate):
+    total_value = equity + debt
+    return ((equity / total_value) * cost_of_equity) + ((debt / total_value) * cost_of_debt * (1 - tax_rate))
+
+@njit('f8(f8, f8, f8)', cache=True)
+def _capital_asset_pricing_model(risk_free_rate, beta, market_return):
+    return risk_free_rate + beta * (market_return - risk_free_rate)
+
+@njit('f8(f8, f8, f8)', cache=True)
+def _annuity_payment(present_value, interest_rate, periods):
+    return (present_value * interest_rate) / (1 - (1 + interest_rate) ** -periods)
+
+@njit('f8(f8, f8)', cache=True)
+def _effective_annual_rate(nominal_rate, compounding_periods):
+    return expm1(compounding_periods * log1p(nominal_rate / compounding_periods))
+
+@njit('f8(f8, f8, f8, f8[:], f8)', cache=True)
+def _swap_value(fixed_rate, floating_rate, notional_amount, accrual_fractions, discount_rate):
+    value = 0.0
+    discount_factor = 1.0
+    for accrual_fraction in accrual_fractions:
+        # discount factors compound period by period, a running product instead of a pow per payment
+        discount_factor /= 1.0 + discount_rate * accrual_fraction
+        value += (fixed_rate - floating_rate) * notional_amount * accrual_fraction * discount_factor
+    return value
+
+@njit('f8[:](f8[:], f8[:], f8[:], f8[:, :], f8[:])', cache=True)
+def _swap_value_batch(fixed_rates, floating_rates, notional_amounts, accrual_fractions, discount_rates):
+    # accrual_fractions has one row per swap, padded with zeros: a zero accrual adds nothing and leaves the discount factor as is
+    swap_values = np.empty(fixed_rates.size)
+    for i in range(fixed_rates.size):
+        swap_values[i] = _swap_value(fixed_rates[i], floating_rates[i], notional_amounts[i], accrual_fractions[i], discount_rates[i])
+    return swap_values
+
+def _swap_accrual_fractions(time_to_maturity: float, payments_per_year: int) -> np.ndarray:
+    """Year fractions of the payment periods, with a short final period when the maturity is not a whole number of periods."""
+    n_payments = max(0, ceil(time_to_maturity * payments_per_year - 1e-9))
+    accrual_fractions = np.full(n_payments, 1.0 / payments_per_year)
+    if n_payments:
+        accrual_fractions[-1] = time_to_maturity - (n_payments - 1) / payments_per_year
+    return accrual_fractions
+
 
 # 1. Future Value of Investment
 @tool
@@ -13,7 +266,7 @@ def get_future_value(
     compounding_frequency: Annotated[int, "Times interest is compounded per period."]
 ) -> float:
     """Calculates the future value of an investment using compound interest. This function helps investors estimate how much their initial investment will grow over a specific period at a given interest rate and compounding frequency. It's useful for planning long-term financial goals and understanding the impact of compound interest on investments."""
-    fv = present_value * (1 + interest_rate / compounding_frequency) ** (compounding_frequency * periods)
+    fv = _future_value(present_value, interest_rate, periods, compounding_frequency)
     return fv
 
 # 2. Present Value of Future Cash Flow
@@ -24,7 +277,7 @@ def get_present_value(
     periods: Annotated[int, "Number of periods until payment."]
 ) -> float:
     """Determines the current worth of a future amount of money by discounting it at a specific rate over a number of periods. This function is essential for assessing the value of future cash flows in today's terms, helping in investment decisions and comparing cash flows occurring at different times."""
-    pv = future_value / (1 + discount_rate) ** periods
+    pv = future_value * exp(-periods * log1p(discount_rate))
     return pv
 
 # 3. Internal Rate of Return (IRR)
@@ -33,11 +286,8 @@ def get_internal_rate_of_return(
     cash_flows: Annotated[List[float], "Sequence of cash flows starting with initial investment (negative value)."]
 ) -> float:
     """Computes the Internal Rate of Return (IRR) for a series of cash flows, which is the discount rate that makes the net present value (NPV) of all cash flows equal to zero. This function is useful for evaluating the profitability of potential investments or projects, especially when comparing multiple options with different cash flow patterns."""
-    try:
-        irr = np.irr(cash_flows)
-        return irr
-    except ImportError:
-        raise ImportError("NumPy is required to compute IRR. Please install NumPy.")
+    irr = _internal_rate_of_return(tuple(cash_flows))
+    return irr
 
 # 4. Payback Period
 @tool
@@ -46,12 +296,11 @@ def get_payback_period(
     cash_flows: Annotated[List[float], "Sequence of net cash inflows."]
 ) -> float:
     """Calculates the time required to recover the initial investment from the net cash inflows generated by the project. This function helps assess the liquidity and risk of an investment by indicating how quickly the invested capital can be recouped. It's particularly useful when evaluating projects where cash flow timing is critical."""
-    cumulative_cash_flow = initial_investment
-    for i, cash_flow in enumerate(cash_flows):
-        cumulative_cash_flow += cash_flow
-        if cumulative_cash_flow >= 0:
-            return i + 1  # Payback period in years
-    return float('inf')  # Investment is not recovered within the provided cash flows
+    # the running sum is not monotonic (cash flows can be negative), so look for the first recovered year
+    recovered = initial_investment + np.cumsum(np.asarray(cash_flows, dtype=np.float64)) >= 0
+    if not recovered.any():
+        return float('inf')  # Investment is not recovered within the provided cash flows
+    return int(np.argmax(recovered)) + 1  # Payback period in years
 
 # 5. Return on Investment (ROI)
 @tool
@@ -60,7 +309,7 @@ def get_return_on_investment(
     cost_of_investment: Annotated[float, "Total cost of the investment."]
 ) -> float:
     """Determines the Return on Investment (ROI), which measures the profitability and efficiency of an investment by calculating the percentage return relative to its cost. This function is useful for comparing the efficiency of several investments and making informed financial decisions."""
-    roi = (gain_from_investment - cost_of_investment) / cost_of_investment
+    roi = _divide(gain_from_investment - cost_of_investment, cost_of_investment)
     return roi
 
 # 6. Earnings Per Share (EPS)
@@ -71,7 +320,7 @@ def get_earnings_per_share(
     average_outstanding_shares: Annotated[float, "Average number of common shares outstanding."]
 ) -> float:
     """Calculates the Earnings Per Share (EPS), representing the portion of a company's profit allocated to each outstanding share of common stock. This metric is important for investors to assess a company's profitability on a per-share basis and compare it with peers or industry benchmarks."""
-    eps = (net_income - preferred_dividends) / average_outstanding_shares
+    eps = _divide(net_income - preferred_dividends, average_outstanding_shares)
     return eps
 
 # 7. Price to Earnings Ratio (P/E Ratio)
@@ -81,7 +330,7 @@ def get_price_to_earnings_ratio(
     earnings_per_share: Annotated[float, "Earnings per share (EPS)."]
 ) -> float:
     """Calculates the Price-to-Earnings (P/E) Ratio, which compares a company's share price to its earnings per share. This ratio helps investors determine the market's valuation of a company's profitability and is useful for comparing valuation levels across companies and industries."""
-    pe_ratio = market_price_per_share / earnings_per_share
+    pe_ratio = _divide(market_price_per_share, earnings_per_share)
     return pe_ratio
 
 # 8. Dividend Yield
@@ -91,7 +340,7 @@ def get_dividend_yield(
     price_per_share: Annotated[float, "Current market price per share."]
 ) -> float:
     """Determines the Dividend Yield, which shows how much a company pays out in dividends each year relative to its stock price. This function is valuable for income-focused investors who are interested in stocks that provide a steady income stream through dividends."""
-    dividend_yield = annual_dividends_per_share / price_per_share
+    dividend_yield = _divide(annual_dividends_per_share, price_per_share)
     return dividend_yield
 
 # 9. Compound Annual Growth Rate (CAGR)
@@ -102,7 +351,7 @@ def get_compound_annual_growth_rate(
     periods: Annotated[int, "Number of periods (years)."]
 ) -> float:
     """Computes the Compound Annual Growth Rate (CAGR), which represents the mean annual growth rate of an investment over a specified time period longer than one year. This function helps investors understand how different investments have performed over time and is useful for comparing the growth rates of various investments."""
-    cagr = (ending_value / beginning_value) ** (1 / periods) - 1
+    cagr = _compound_annual_growth_rate(beginning_value, ending_value, periods)
     return cagr
 
 # 10. Loan Payment Calculator (Amortization)
@@ -113,8 +362,7 @@ def get_loan_payment(
     periods: Annotated[int, "Total number of payment periods."]
 ) -> float:
     """Calculates the periodic payment required to amortize a loan over a specified number of periods at a given annual interest rate. This function helps borrowers plan their repayment schedules and understand the financial commitment involved in taking on a loan."""
-    monthly_rate = annual_interest_rate / 12
-    payment = principal * (monthly_rate * (1 + monthly_rate) ** periods) / ((1 + monthly_rate) ** periods - 1)
+    payment = _loan_payment(principal, annual_interest_rate, periods)
     return payment
 
 # 11. Debt to Equity Ratio
@@ -124,7 +372,7 @@ def get_debt_to_equity_ratio(
     shareholder_equity: Annotated[float, "Total shareholder's equity."]
 ) -> float:
     """Computes the Debt-to-Equity Ratio, which measures a company's financial leverage by comparing its total liabilities to shareholders' equity. This ratio is useful for assessing a company's risk level and financial stability, indicating how much debt is used to finance assets relative to equity."""
-    ratio = total_liabilities / shareholder_equity
+    ratio = _divide(total_liabilities, shareholder_equity)
     return ratio
 
 # 12. Current Ratio
@@ -134,7 +382,7 @@ def get_current_ratio(
     current_liabilities: Annotated[float, "Company's current liabilities."]
 ) -> float:
     """Calculates the Current Ratio, a liquidity ratio that measures a company's ability to pay short-term obligations with its current assets. This function is essential for evaluating a company's short-term financial health and operational efficiency."""
-    ratio = current_assets / current_liabilities
+    ratio = _divide(current_assets, current_liabilities)
     return ratio
 
 # 13. Quick Ratio
@@ -146,7 +394,7 @@ def get_quick_ratio(
 ) -> float:
     """Determines the Quick Ratio, also known as the acid-test ratio, which assesses a company's ability to meet its short-term obligations with its most liquid assets. By excluding inventory, this ratio provides a more stringent measure of liquidity than the current ratio."""
     quick_assets = current_assets - inventory
-    ratio = quick_assets / current_liabilities
+    ratio = _divide(quick_assets, current_liabilities)
     return ratio
 
 # 14. Interest Coverage Ratio
@@ -156,7 +404,7 @@ def get_interest_coverage_ratio(
     interest_expense: Annotated[float, "Total interest expense."]
 ) -> float:
     """Calculates the Interest Coverage Ratio, which evaluates a company's ability to pay interest expenses on outstanding debt with its operating income. A higher ratio indicates greater ease in meeting interest obligations, which is crucial for assessing financial health and creditworthiness."""
-    ratio = ebit / interest_expense
+    ratio = _divide(ebit, interest_expense)
     return ratio
 
 # 15. Gross Profit Margin
@@ -167,7 +415,7 @@ def get_gross_profit_margin(
 ) -> float:
     """Computes the Gross Profit Margin, indicating the percentage of revenue that exceeds the cost of goods sold (COGS). This metric helps assess a company's production efficiency and pricing strategy, providing insight into financial performance and competitiveness."""
     gross_profit = revenue - cogs
-    margin = gross_profit / revenue
+    margin = _divide(gross_profit, revenue)
     return margin
 
 # 16. Net Profit Margin
@@ -177,7 +425,7 @@ def get_net_profit_margin(
     revenue: Annotated[float, "Total revenue or sales."]
 ) -> float:
     """Determines the Net Profit Margin, which measures how much net income is generated as a percentage of revenue. This ratio reflects a company's overall profitability and efficiency in managing expenses, and is useful for comparing profitability across companies and industries."""
-    margin = net_income / revenue
+    margin = _divide(net_income, revenue)
     return margin
 
 # 17. Operating Profit Margin
@@ -187,7 +435,7 @@ def get_operating_profit_margin(
     revenue: Annotated[float, "Total revenue or sales."]
 ) -> float:
     """Calculates the Operating Profit Margin, assessing the proportion of revenue left after covering operating expenses but before interest and taxes. This metric provides insight into a company's operational efficiency and core business profitability, excluding the effects of financing and tax structures."""
-    margin = operating_income / revenue
+    margin = _divide(operating_income, revenue)
     return margin
 
 # 18. Inventory Turnover Ratio
@@ -197,7 +445,7 @@ def get_inventory_turnover_ratio(
     average_inventory: Annotated[float, "Average inventory value."]
 ) -> float:
     """Computes the Inventory Turnover Ratio, which measures how many times a company's inventory is sold and replaced over a period. This ratio helps assess inventory management efficiency and can indicate whether a company has excessive inventory relative to its sales levels."""
-    ratio = cogs / average_inventory
+    ratio = _divide(cogs, average_inventory)
     return ratio
 
 # 19. Accounts Receivable Turnover Ratio
@@ -207,7 +455,7 @@ def get_accounts_receivable_turnover_ratio(
     average_accounts_receivable: Annotated[float, "Average accounts receivable."]
 ) -> float:
     """Determines the Accounts Receivable Turnover Ratio, evaluating how efficiently a company collects on its credit sales. A higher ratio indicates effective credit and collection policies, and this metric is useful for assessing liquidity and operational efficiency."""
-    ratio = net_credit_sales / average_accounts_receivable
+    ratio = _divide(net_credit_sales, average_accounts_receivable)
     return ratio
 
 # 20. Average Collection Period
@@ -216,7 +464,7 @@ def get_average_collection_period(
     accounts_receivable_turnover: Annotated[float, "Accounts receivable turnover ratio."]
 ) -> float:
     """Calculates the Average Collection Period, representing the average number of days it takes for a company to collect payments from its credit sales. This function is useful for evaluating the effectiveness of a company's credit policies and cash flow management."""
-    period = 365 / accounts_receivable_turnover
+    period = _divide(365, accounts_receivable_turnover)
     return period
 
 # 21. Economic Order Quantity (EOQ)
@@ -240,8 +488,7 @@ def get_weighted_average_cost_of_capital(
     tax_rate: Annotated[float, "Corporate tax rate (as decimal)."]
 ) -> float:
     """Calculates the Weighted Average Cost of Capital (WACC), representing the average rate a company is expected to pay to finance its assets. WACC is essential for evaluating investment opportunities and serves as a hurdle rate in capital budgeting decisions."""
-    total_value = equity + debt
-    wacc = ((equity / total_value) * cost_of_equity) + ((debt / total_value) * cost_of_debt * (1 - tax_rate))
+    wacc = _weighted_average_cost_of_capital(equity, debt, cost_of_equity, cost_of_debt, tax_rate)
     return wacc
 
 # 23. Capital Asset Pricing Model (CAPM)
@@ -252,7 +499,7 @@ def get_capital_asset_pricing_model(
     market_return: Annotated[float, "Expected market return (as decimal)."]
 ) -> float:
     """Uses the Capital Asset Pricing Model (CAPM) to calculate the expected return of an asset based on its systematic risk (beta). This function is useful for estimating the cost of equity and making informed investment decisions by comparing expected returns with required returns."""
-    expected_return = risk_free_rate + beta * (market_return - risk_free_rate)
+    expected_return = _capital_asset_pricing_model(risk_free_rate, beta, market_return)
     return expected_return
 
 # 24. Beta of a Stock
@@ -262,7 +509,7 @@ def get_beta(
     variance: Annotated[float, "Variance of market returns."]
 ) -> float:
     """Determines the Beta of a stock, which measures its volatility or systematic risk relative to the overall market. This metric is key in portfolio management and the CAPM, helping investors understand how a stock might respond to market movements."""
-    beta = covariance / variance
+    beta = _divide(covariance, variance)
     return beta
 
 # 25. Sharpe Ratio
@@ -273,7 +520,7 @@ def get_sharpe_ratio(
     standard_deviation: Annotated[float, "Standard deviation of portfolio's excess return."]
 ) -> float:
     """Calculates the Sharpe Ratio, which evaluates the risk-adjusted return of an investment portfolio by comparing its excess return to its volatility. This function helps investors understand the return of an investment compared to its risk, facilitating better portfolio optimization."""
-    sharpe_ratio = (portfolio_return - risk_free_rate) / standard_deviation
+    sharpe_ratio = _divide(portfolio_return - risk_free_rate, standard_deviation)
     return sharpe_ratio
 
 # 26. Treynor Ratio
@@ -284,7 +531,7 @@ def get_treynor_ratio(
     beta: Annotated[float, "Beta of the portfolio."]
 ) -> float:
     """Computes the Treynor Ratio, measuring the risk-adjusted return of a portfolio using its beta as the risk measure. This function is useful for assessing how well a portfolio compensates investors for taking on market risk, and comparing portfolios with different levels of systematic risk."""
-    treynor_ratio = (portfolio_return - risk_free_rate) / beta
+    treynor_ratio = _divide(portfolio_return - risk_free_rate, beta)
     return treynor_ratio
 
 # 27. Jensen's Alpha
@@ -305,7 +552,7 @@ def get_sortino_ratio(
     downside_deviation: Annotated[float, "Standard deviation of negative returns."]
 ) -> float:
     """Determines the Sortino Ratio, which assesses the risk-adjusted return of an investment by focusing only on downside volatility. This function provides a more accurate evaluation of an investment's performance by penalizing only harmful volatility, making it useful for risk-averse investors."""
-    sortino_ratio = (portfolio_return - risk_free_rate) / downside_deviation
+    sortino_ratio = _divide(portfolio_return - risk_free_rate, downside_deviation)
     return sortino_ratio
 
 # 29. Risk-Adjusted Return on Capital (RAROC)
@@ -315,7 +562,7 @@ def get_raroc(
     economic_capital: Annotated[float, "Economic capital at risk."]
 ) -> float:
     """Calculates the Risk-Adjusted Return on Capital (RAROC), which evaluates the profitability of an investment relative to the economic capital at risk. This metric helps in comparing investments with different risk profiles by standardizing returns against risk exposure."""
-    raroc = net_income / economic_capital
+    raroc = _divide(net_income, economic_capital)
     return raroc
 
 # 30. Value at Risk (VaR)
@@ -326,7 +573,9 @@ def get_value_at_risk(
     standard_deviation: Annotated[float, "Standard deviation of portfolio returns."]
 ) -> float:
     """Computes the Value at Risk (VaR), estimating the maximum potential loss of a portfolio over a given time frame at a specified confidence level. This function is crucial for risk management, helping investors and institutions understand the extent of potential losses under normal market conditions."""
-    z_score = norm.ppf(1 - confidence_level)
+    z_score = _VAR_Z_SCORES.get(confidence_level)
+    if z_score is None:
+        z_score = _norm_ppf(1 - confidence_level)
     var = portfolio_value * z_score * standard_deviation
     return var
 
@@ -340,9 +589,7 @@ def get_black_scholes_option_price(
     volatility: Annotated[float, "Stock volatility (as decimal)."]
 ) -> float:
     """Calculates the theoretical price of a European call option using the Black-Scholes model. This function is essential for options valuation, helping traders and investors estimate the fair value of options and make informed trading decisions."""
-    d1 = (log(stock_price / strike_price) + (risk_free_rate + 0.5 * volatility ** 2) * time_to_expiration) / (volatility * sqrt(time_to_expiration))
-    d2 = d1 - volatility * sqrt(time_to_expiration)
-    call_price = stock_price * norm.cdf(d1) - strike_price * exp(-risk_free_rate * time_to_expiration) * norm.cdf(d2)
+    call_price = _black_scholes_call_cached(stock_price, strike_price, time_to_expiration, risk_free_rate, volatility)
     return call_price
 
 # 32. Put-Call Parity
@@ -355,8 +602,7 @@ def get_put_price_using_put_call_parity(
     stock_price: Annotated[float, "Current stock price."]
 ) -> float:
     """Determines the price of a European put option using the put-call parity theorem. This function ensures consistency between put and call option pricing and is useful for arbitrage strategies and verifying option prices in the market."""
-    present_value_strike = strike_price * exp(-risk_free_rate * time_to_expiration)
-    put_price = call_price + present_value_strike - stock_price
+    put_price = _put_from_parity(call_price, strike_price, exp(-risk_free_rate * time_to_expiration), stock_price)
     return put_price
 
 # 33. Modified Internal Rate of Return (MIRR)
@@ -367,11 +613,8 @@ def get_modified_internal_rate_of_return(
     reinvestment_rate: Annotated[float, "Reinvestment rate (return on investment)."]
 ) -> float:
     """Computes the Modified Internal Rate of Return (MIRR), which adjusts the IRR to account for differences in the reinvestment rate of positive cash flows and the financing cost of negative cash flows. This function provides a more accurate reflection of a project's profitability and is useful when the reinvestment rate differs from the project's internal rate of return."""
-    try:
-        mirr = np.mirr(cash_flows, finance_rate, reinvestment_rate)
-        return mirr
-    except ImportError:
-        raise ImportError("NumPy is required to compute MIRR. Please install NumPy.")
+    mirr = _modified_internal_rate_of_return(tuple(cash_flows), finance_rate, reinvestment_rate)
+    return mirr
 
 # 34. Annuity Payment Calculation
 @tool
@@ -381,7 +624,7 @@ def get_annuity_payment(
     periods: Annotated[int, "Number of periods."]
 ) -> float:
     """Calculates the periodic payment amount required to pay off an annuity over a specified number of periods at a given interest rate. This function is useful for planning loan repayments, retirement savings, and any financial scenario involving regular payments over time."""
-    payment = (present_value * interest_rate) / (1 - (1 + interest_rate) ** -periods)
+    payment = _annuity_payment(present_value, interest_rate, periods)
     return payment
 
 # 35. Effective Annual Rate (EAR)
@@ -391,7 +634,7 @@ def get_effective_annual_rate(
     compounding_periods: Annotated[int, "Number of compounding periods per year."]
 ) -> float:
     """Determines the Effective Annual Rate (EAR), which reflects the true annual interest rate accounting for compounding periods. This function helps investors and borrowers compare the annual interest between loans or investments with different compounding frequencies."""
-    ear = (1 + nominal_rate / compounding_periods) ** compounding_periods - 1
+    ear = _effective_annual_rate(nominal_rate, compounding_periods)
     return ear
 
 # 36. Duration of a Bond
@@ -402,8 +645,7 @@ def get_bond_duration(
 ) -> float:
     """Calculates the Macaulay Duration of a bond, measuring the weighted average time until cash flows are received. This function helps investors understand a bond's sensitivity to interest rate changes and manage interest rate risk in their portfolios."""
     try:
-        weighted_cash_flows = [cf / (1 + y) ** t for t, (cf, y) in enumerate(zip(cash_flows, yields), 1)]
-        duration = sum(t * wcf for t, wcf in enumerate(weighted_cash_flows, 1)) / sum(weighted_cash_flows)
+        duration = _bond_duration(tuple(cash_flows), tuple(yields))
         return duration
     except Exception as e:
         raise ValueError(f"An error occurred: {str(e)}")
@@ -415,7 +657,7 @@ def get_debt_service_coverage_ratio(
     total_debt_service: Annotated[float, "Total debt service."]
 ) -> float:
     """Computes the Debt Service Coverage Ratio (DSCR), which evaluates a company's ability to service its debt obligations with its net operating income. A DSCR greater than 1 indicates sufficient income to cover debt payments, important for lenders assessing credit risk."""
-    dscr = net_operating_income / total_debt_service
+    dscr = _divide(net_operating_income, total_debt_service)
     return dscr
 
 # 38. Return on Equity (ROE)
@@ -425,7 +667,7 @@ def get_return_on_equity(
     shareholder_equity: Annotated[float, "Shareholder's equity."]
 ) -> float:
     """Calculates the Return on Equity (ROE), indicating how effectively a company uses shareholders' equity to generate profits. This function is useful for comparing the profitability of companies within the same industry and assessing management effectiveness."""
-    roe = net_income / shareholder_equity
+    roe = _divide(net_income, shareholder_equity)
     return roe
 
 # 39. Return on Assets (ROA)
@@ -435,7 +677,7 @@ def get_return_on_assets(
     total_assets: Annotated[float, "Total assets."]
 ) -> float:
     """Determines the Return on Assets (ROA), measuring how efficiently a company utilizes its assets to generate net income. This metric helps investors assess asset efficiency and compare companies regardless of their capital structures."""
-    roa = net_income / total_assets
+    roa = _divide(net_income, total_assets)
     return roa
 
 # 40. Debt Ratio
@@ -445,7 +687,7 @@ def get_debt_ratio(
     total_assets: Annotated[float, "Total assets."]
 ) -> float:
     """Computes the Debt Ratio, indicating the proportion of a company's assets that are financed through debt. This function helps evaluate a company's financial leverage and risk level, with higher ratios suggesting greater reliance on debt financing."""
-    debt_ratio = total_liabilities / total_assets
+    debt_ratio = _divide(total_liabilities, total_assets)
     return debt_ratio
 
 # 41. Dividend Payout Ratio
@@ -455,7 +697,7 @@ def get_dividend_payout_ratio(
     earnings_per_share: Annotated[float, "Earnings per share (EPS)."]
 ) -> float:
     """Calculates the Dividend Payout Ratio, showing the percentage of earnings distributed to shareholders as dividends. This function is useful for investors assessing a company's dividend policy and sustainability of dividend payments."""
-    payout_ratio = dividends_per_share / earnings_per_share
+    payout_ratio = _divide(dividends_per_share, earnings_per_share)
     return payout_ratio
 
 # 42. Retention Ratio (Plowback Ratio)
@@ -465,7 +707,7 @@ def get_retention_ratio(
     earnings_per_share: Annotated[float, "Earnings per share (EPS)."]
 ) -> float:
     """Determines the Retention Ratio, also known as the Plowback Ratio, indicating the portion of earnings retained in the business for growth and expansion. This function complements the dividend payout ratio and helps in analyzing a company's reinvestment strategy."""
-    retention_ratio = 1 - (dividends_per_share / earnings_per_share)
+    retention_ratio = 1 - _divide(dividends_per_share, earnings_per_share)
     return retention_ratio
 
 # 43. Operating Cash Flow (OCF)
@@ -496,7 +738,7 @@ def get_price_to_book_ratio(
     book_value_per_share: Annotated[float, "Book value per share."]
 ) -> float:
     """Determines the Price-to-Book (P/B) Ratio, comparing a company's market value to its book value. This ratio helps investors identify undervalued or overvalued stocks by assessing how much shareholders are paying for the net assets of the company."""
-    pb_ratio = market_price_per_share / book_value_per_share
+    pb_ratio = _divide(market_price_per_share, book_value_per_share)
     return pb_ratio
 
 # 46. Market Capitalization
@@ -527,7 +769,7 @@ def get_ev_to_ebitda_ratio(
     ebitda: Annotated[float, "Earnings before interest, taxes, depreciation, and amortization."]
 ) -> float:
     """Calculates the EV/EBITDA Ratio, a valuation metric that compares a company's Enterprise Value to its EBITDA. This ratio is widely used to assess a company's value and compare it with peers, as it considers both equity and debt while excluding the effects of non-cash expenses."""
-    ratio = enterprise_value / ebitda
+    ratio = _divide(enterprise_value, ebitda)
     return ratio
 
 # 49. Interest Rate Swap Valuation
@@ -536,10 +778,15 @@ def get_interest_rate_swap_valuation(
     fixed_rate: Annotated[float, "Fixed interest rate (as decimal)."],
     floating_rate: Annotated[float, "Current floating interest rate (as decimal)."],
     notional_amount: Annotated[float, "Notional principal amount."],
-    time_to_maturity: Annotated[float, "Time to maturity in years."]
-) -> float:
-    """Determines the value of an Interest Rate Swap by calculating the net present value of the fixed and floating rate cash flows. This function helps assess the financial benefit or cost of swapping fixed and floating interest rates, which is essential for managing interest rate risk in financial contracts."""
-    swap_value = (fixed_rate - floating_rate) * notional_amount * time_to_maturity
+    time_to_maturity: Annotated[float, "Time to maturity in years."],
+    discount_rate: Annotated[Optional[float], "Annual rate used to discount the payments (as decimal), the floating rate if not given."] = None,
+    payments_per_year: Annotated[int, "Number of swap payments per year."] = 1
+) -> float:
+    """Determines the value of an Interest Rate Swap to the fixed-rate receiver by calculating the net present value of the differences between the fixed and floating rate payments over the payment schedule. This function helps assess the financial benefit or cost of swapping fixed and floating interest rates, which is essential for managing interest rate risk in financial contracts."""
+    if discount_rate is None:
+        discount_rate = floating_rate
+    accrual_fractions = _swap_accrual_fractions(time_to_maturity, payments_per_year)
+    swap_value = _swap_value(fixed_rate, floating_rate, notional_amount, accrual_fractions, discount_rate)
     return swap_value
 
 # 50. Foreign Exchange Forward Rate
@@ -551,5 +798,107 @@ def get_fx_forward_rate(
     time_to_maturity: Annotated[float, "Time to maturity in years."]
 ) -> float:
     """Calculates the Forward Exchange Rate using the interest rate parity formula. This function helps businesses and investors forecast future exchange rates based on the interest rate differential between two countries. It's essential for hedging currency risk in international trade and investment decisions."""
-    forward_rate = spot_rate * ((1 + domestic_interest_rate * time_to_maturity) / (1 + foreign_interest_rate * time_to_maturity))
+    # plain float arithmetic: a numba ufunc called on scalars costs an order of magnitude more than the formula
+    forward_rate = spot_rate * (1 + domestic_interest_rate * time_to_maturity) / (1 + foreign_interest_rate * time_to_maturity)
     return forward_rate
+
+# 51. Black-Scholes Option Pricing for an Option Chain
+@tool
+def get_black_scholes_option_prices(
+    stock_prices: Annotated[List[float], "Current stock price of each option (or a single price shared by all)."],
+    strike_prices: Annotated[List[float], "Strike price of each option."],
+    times_to_expiration: Annotated[List[float], "Time to expiration in years of each option (or a single value shared by all)."],
+    risk_free_rate: Annotated[float, "Risk-free interest rate (as decimal)."],
+    volatilities: Annotated[List[float], "Stock volatility (as decimal) of each option (or a single value shared by all)."]
+) -> List[float]:
+    """Calculates the theoretical prices of a whole chain of European call options at once using the Black-Scholes model. This function is useful for pricing many strikes, expiries or volatility scenarios in one step, for example to build an option chain or a volatility surface."""
+    stock_prices, strike_prices, times_to_expiration, risk_free_rates, volatilities = (
+        np.ascontiguousarray(array, dtype=np.float64).ravel()
+        for array in np.broadcast_arrays(stock_prices, strike_prices, times_to_expiration, risk_free_rate, volatilities)
+    )
+    call_prices = _black_scholes_call_batch(stock_prices, strike_prices, times_to_expiration, risk_free_rates, volatilities)
+    return call_prices.tolist()
+
+# 52. Financial Ratios for a Panel of Companies
+@tool
+def get_financial_ratios(
+    financials: Annotated[Dict[str, List[float]], "Financial statement items by name (e.g. 'net_income', 'revenue', 'total_assets'), each a list with one value per company."]
+) -> Dict[str, List[float]]:
+    """Calculates every financial ratio that can be derived from the given financial statement items (profitability margins, returns on equity and assets, liquidity, leverage, turnover, coverage, valuation and dividend ratios) for a whole panel of companies at once. This function is useful for screening or comparing many companies in a single step instead of computing each ratio for each company separately."""
+    arrays = {name: np.asarray(values, dtype=np.float64) for name, values in financials.items()}
+    ratios = {}
+    # a zero denominator gives NaN for that company instead of a warning or an error for the whole panel
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for ratio_name, (input_names, formula) in _RATIO_FORMULAS.items():
+            if all(input_name in arrays for input_name in input_names):
+                ratio = formula(*(arrays[input_name] for input_name in input_names))
+                ratios[ratio_name] = np.where(np.isfinite(ratio), ratio, np.nan).tolist()
+    return ratios
+
+# 53. Enterprise Value for a Portfolio of Companies
+@tool
+def get_enterprise_values(
+    market_capitalizations: Annotated[List[float], "Market capitalization of each company."],
+    total_debts: Annotated[List[float], "Total debt of each company."],
+    cash_and_equivalents: Annotated[List[float], "Cash and cash equivalents of each company."]
+) -> List[float]:
+    """Computes the Enterprise Value (EV) of a whole portfolio of companies at once, measuring each company's total value including debt and excluding cash. This function is useful for comparing many companies with different capital structures in a single step, for example before ranking them on EV/EBITDA."""
+    enterprise_values = _enterprise_values(*(
+        np.asarray(array, dtype=np.float64) for array in (market_capitalizations, total_debts, cash_and_equivalents)
+    ))
+    return enterprise_values.tolist()
+
+# 54. EV to EBITDA Ratio from Balance Sheet Items
+@tool
+def get_ev_to_ebitda_ratio_from_components(
+    market_capitalization: Annotated[float, "Market capitalization."],
+    total_debt: Annotated[float, "Total debt."],
+    cash_and_equivalents: Annotated[float, "Cash and cash equivalents."],
+    ebitda: Annotated[float, "Earnings before interest, taxes, depreciation, and amortization."]
+) -> float:
+    """Calculates the EV/EBITDA Ratio directly from market capitalization, total debt, cash and EBITDA, without computing the Enterprise Value in a separate step. This function is useful for valuing a company and comparing it with peers when the Enterprise Value is not known yet."""
+    ratio = _divide(market_capitalization + total_debt - cash_and_equivalents, ebitda)
+    return ratio
+
+# 55. Foreign Exchange Forward Rates for a Book of Currency Pairs
+@tool
+def get_fx_forward_rates(
+    spot_rates: Annotated[List[float], "Current spot exchange rate of each currency pair."],
+    domestic_interest_rates: Annotated[List[float], "Domestic interest rate (as decimal) of each currency pair."],
+    foreign_interest_rates: Annotated[List[float], "Foreign interest rate (as decimal) of each currency pair."],
+    times_to_maturity: Annotated[List[float], "Time to maturity in years of each forward (or a single value shared by all)."]
+) -> List[float]:
+    """Calculates the Forward Exchange Rates of a whole book of currency pairs at once using the interest rate parity formula. This function is useful for hedging the currency risk of many exposures or pricing a table of forwards in a single step instead of one currency pair at a time."""
+    forward_rates = _fx_forward_rates(spot_rates, domestic_interest_rates, foreign_interest_rates, times_to_maturity)
+    return forward_rates.tolist()
+
+# 56. Interest Rate Swap Valuation for a Book of Swaps
+@tool
+def get_interest_rate_swap_valuations(
+    fixed_rates: Annotated[List[float], "Fixed interest rate (as decimal) of each swap."],
+    floating_rates: Annotated[List[float], "Current floating interest rate (as decimal) of each swap."],
+    notional_amounts: Annotated[List[float], "Notional principal amount of each swap."],
+    times_to_maturity: Annotated[List[float], "Time to maturity in years of each swap."],
+    discount_rates: Annotated[Optional[List[float]], "Annual rate used to discount the payments (as decimal) of each swap, the floating rates if not given."] = None,
+    payments_per_year: Annotated[int, "Number of swap payments per year, shared by all swaps."] = 1
+) -> List[float]:
+    """Determines the values of a whole book of Interest Rate Swaps with different maturities at once, each as the net present value of the differences between its fixed and floating rate payments. This function is useful for measuring the interest rate exposure of a swap portfolio in a single step instead of valuing each swap separately."""
+    if discount_rates is None:
+        discount_rates = floating_rates
+    fixed_rates, floating_rates, notional_amounts, times_to_maturity, discount_rates = (
+        np.ascontiguousarray(array, dtype=np.float64).ravel()
+        for array in np.broadcast_arrays(fixed_rates, floating_rates, notional_amounts, times_to_maturity, discount_rates)
+    )
+    schedules = [_swap_accrual_fractions(time_to_maturity, payments_per_year) for time_to_maturity in times_to_maturity]
+    accrual_fractions = np.zeros((len(schedules), max((schedule.size for schedule in schedules), default=0)))
+    for i, schedule in enumerate(schedules):
+        accrual_fractions[i, :schedule.size] = schedule
+    swap_values = _swap_value_batch(fixed_rates, floating_rates, notional_amounts, accrual_fractions, discount_rates)
+    return swap_values.tolist()
+
+# The undecorated function of every tool by tool name. Calling a tool object validates its arguments
+# with pydantic on every call, which costs far more than the arithmetic; evaluation harnesses and other
+# hot loops that already pass well-typed arguments can call these directly.
+TOOL_FUNCTIONS: Dict[str, Callable] = {
+    tool_object.name: tool_object.func for tool_object in list(globals().values()) if isinstance(tool_object, BaseTool)
+}